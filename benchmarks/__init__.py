@@ -0,0 +1,37 @@
+"""
+Offline benchmarks for Memebot. Each benchmark is a module which can be run from the
+root of the repository, e.g.
+
+    $ python -m benchmarks.strip_params
+"""
+
+import logging
+import pathlib
+import sys
+
+from memebot import config, log
+
+DATA_DIR = pathlib.Path(__file__).parent / "data"
+
+# A pinned snapshot of the ClearURLs rules (https://github.com/ClearURLs/Rules),
+# so that results are comparable between runs and versions
+RULES_SNAPSHOT = DATA_DIR / "clearurls_rules.json"
+
+
+def configure_logging() -> None:
+    """
+    Configures Memebot's logging without any command-line parsing. Only warnings and
+    errors are logged, so that they do not drown out the results.
+    """
+    config.log_level = logging.getLevelName(logging.WARNING)
+    config.log_location = logging.StreamHandler(sys.stderr)
+    log.configure_logging()
+
+
+def report(line: str = "") -> None:
+    """
+    Writes a line of benchmark output. Memebot's logging redirects ``sys.stdout``,
+    so this writes to the original stdout instead.
+    """
+    if sys.__stdout__:
+        sys.__stdout__.write(f"{line}\n")
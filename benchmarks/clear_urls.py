@@ -0,0 +1,233 @@
+"""
+Benchmarks the ClearURLs integration against the pinned rules snapshot and a synthetic
+corpus of URLs. Reports the time taken to compile the rules, and the throughput and
+per-URL latency of ``strip_trackers`` and the ``ClearURLsProvider`` methods it uses,
+as well as the metrics of the providers which took the most time.
+
+Results can be written as JSON with ``--output``, and compared against the results of
+a previous run with ``--compare``.
+"""
+
+import argparse
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Any
+
+from benchmarks import RULES_SNAPSHOT, configure_logging, corpus, report
+from memebot import config
+from memebot.integrations import clear_urls
+
+
+@dataclass
+class LatencyStats:
+    """
+    Summarizes the latency of a repeated operation
+    """
+
+    count: int
+    per_second: float
+    mean_us: float
+    p50_us: float
+    p99_us: float
+
+
+def _summarize(samples_ns: list[int]) -> LatencyStats:
+    """
+    Summarizes the latencies of individual calls, in nanoseconds
+    """
+    total_ns = sum(samples_ns)
+    # Quantiles need at least two samples
+    percentiles = statistics.quantiles(samples_ns * 2, n=100, method="inclusive")
+    return LatencyStats(
+        count=len(samples_ns),
+        per_second=len(samples_ns) / (total_ns / 1e9) if total_ns else 0.0,
+        mean_us=total_ns / len(samples_ns) / 1e3,
+        p50_us=percentiles[49] / 1e3,
+        p99_us=percentiles[98] / 1e3,
+    )
+
+
+def _time_calls[T](func: Callable[[T], object], args: Iterable[T]) -> list[int]:
+    samples = []
+    for arg in args:
+        start = time.perf_counter_ns()
+        func(arg)
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def _git_revision() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def benchmark_compile(rules: str, repeat: int) -> LatencyStats:
+    return _summarize(
+        _time_calls(
+            lambda _: clear_urls._convert_rules_to_providers(
+                rules, rules_files=clear_urls._read_rules_files()
+            ),
+            range(repeat),
+        )
+    )
+
+
+def benchmark_strip_trackers(
+    urls_by_category: dict[str, list[str]], repeat: int
+) -> dict[str, LatencyStats]:
+    results = {}
+    all_samples = []
+    for category, urls in urls_by_category.items():
+        # Warm up
+        _time_calls(clear_urls.strip_trackers, urls)
+        samples = _time_calls(clear_urls.strip_trackers, urls * repeat)
+        results[f"strip_trackers.{category}"] = _summarize(samples)
+        all_samples += samples
+    results["strip_trackers"] = _summarize(all_samples)
+    return results
+
+
+def benchmark_provider_methods(urls: list[str], repeat: int) -> dict[str, LatencyStats]:
+    """
+    Times each ``ClearURLsProvider`` method which ``strip_trackers`` would call for
+    the given URLs
+    """
+    candidate_calls = [
+        (provider, url)
+        for url in urls
+        for provider in clear_urls.engine.providers.candidates(url)
+    ] * repeat
+    matched_calls = [
+        (provider, url) for provider, url in candidate_calls if provider.matches(url)
+    ]
+
+    return {
+        "ClearURLsProvider.matches": _summarize(
+            _time_calls(lambda call: call[0].matches(call[1]), candidate_calls)
+        ),
+        "ClearURLsProvider.strip_params": _summarize(
+            _time_calls(lambda call: call[0].strip_params(call[1]), matched_calls)
+        ),
+        "ClearURLsProvider.redirect": _summarize(
+            _time_calls(lambda call: call[0].redirect(call[1]), matched_calls)
+        ),
+    }
+
+
+def _report_results(results: dict[str, LatencyStats]) -> None:
+    report(
+        f"{'benchmark':<40} {'count':>8} {'per sec':>12} {'p50 us':>10} {'p99 us':>10}"
+    )
+    for name, stats in results.items():
+        report(
+            f"{name:<40} {stats.count:>8} {stats.per_second:>12.0f} "
+            f"{stats.p50_us:>10.2f} {stats.p99_us:>10.2f}"
+        )
+
+
+def _report_comparison(
+    results: dict[str, LatencyStats], baseline: dict[str, Any]
+) -> None:
+    report()
+    report(f"Compared to {baseline['metadata']}")
+    report(f"{'benchmark':<40} {'per sec':>12} {'p50':>10} {'p99':>10}")
+    for name, stats in results.items():
+        if not (old := baseline["results"].get(name)):
+            continue
+        report(
+            f"{name:<40} {stats.per_second / old['per_second']:>11.2f}x "
+            f"{stats.p50_us / old['p50_us']:>9.2f}x {stats.p99_us / old['p99_us']:>9.2f}x"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        default=RULES_SNAPSHOT,
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--size", help="Number of URLs per corpus category", default=500, type=int
+    )
+    parser.add_argument("--seed", help="Seed for the URL corpus", default=0, type=int)
+    parser.add_argument(
+        "--repeat", help="Number of times to repeat each benchmark", default=5, type=int
+    )
+    parser.add_argument(
+        "--output", help="Path to write the results to as JSON", type=pathlib.Path
+    )
+    parser.add_argument(
+        "--compare",
+        help="Path to the JSON results of a previous run to compare against",
+        type=pathlib.Path,
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    # Every URL should actually be cleaned, rather than looked up
+    config.clearurls_result_cache_size = 0
+    # Only the bundled custom providers are merged on top of the rules
+    config.clearurls_rules_files = []
+    # The bot's default budget, so that checking it is part of the measurements
+    config.clearurls_url_time_budget = timedelta(milliseconds=100)
+
+    rules = args.rules.read_text()
+    urls_by_category = corpus.generate(args.size, args.seed)
+
+    results = {"compile": benchmark_compile(rules, args.repeat)}
+    clear_urls._publish_engine(clear_urls._build_engine(rules))
+    clear_urls.metrics.registry.reset()
+    results |= benchmark_strip_trackers(urls_by_category, args.repeat)
+    provider_summary = clear_urls.metrics.registry.summary()
+    results |= benchmark_provider_methods(
+        [url for urls in urls_by_category.values() for url in urls], args.repeat
+    )
+
+    metadata = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rules": str(args.rules),
+        "rules_checksum": clear_urls.engine.rules_checksum,
+        "corpus_size": args.size,
+        "corpus_seed": args.seed,
+        "repeat": args.repeat,
+        "providers": len(clear_urls.engine.providers),
+        # Providers only compile most of their patterns once they match a URL
+        "compiled_providers": clear_urls.engine.providers.compiled_count,
+    }
+    report(f"Metadata: {metadata}")
+    _report_results(results)
+    report()
+    report(provider_summary)
+
+    if args.output:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "metadata": metadata,
+                    "results": {name: asdict(stats) for name, stats in results.items()},
+                },
+                indent=2,
+            )
+        )
+    if args.compare:
+        _report_comparison(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
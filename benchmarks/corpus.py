@@ -0,0 +1,162 @@
+"""
+Generates a synthetic corpus of URLs, and of chat messages containing them, for
+benchmarking the ClearURLs integration. The corpus is generated from a seed, so it is
+identical between runs and versions.
+"""
+
+import random
+import urllib.parse
+
+# Hosts which are covered by at least one provider in the rules snapshot
+MATCHING_HOSTS = [
+    "www.amazon.com",
+    "www.amazon.co.uk",
+    "www.google.com",
+    "www.youtube.com",
+    "twitter.com",
+    "www.facebook.com",
+    "www.reddit.com",
+    "www.instagram.com",
+    "www.ebay.com",
+    "www.aliexpress.com",
+    "www.bing.com",
+    "www.linkedin.com",
+    "medium.com",
+    "www.nytimes.com",
+]
+
+# Hosts which are not covered by any provider in the rules snapshot
+NON_MATCHING_HOSTS = [
+    "example.org",
+    "docs.python.org",
+    "en.wikipedia.org",
+    "news.ycombinator.com",
+    "www.bbc.co.uk",
+    "stackoverflow.com",
+    "discord.com",
+    "lobste.rs",
+]
+
+TRACKING_KEYS = [
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_term",
+    "utm_content",
+    "fbclid",
+    "gclid",
+    "igshid",
+    "ref_",
+    "tag",
+    "ved",
+    "ei",
+]
+
+BENIGN_KEYS = ["id", "q", "page", "v", "list", "lang", "sort", "query", "index", "t"]
+
+CATEGORIES = ["short", "long_query", "nested_redirect", "non_matching"]
+
+MESSAGE_CATEGORIES = ["chat", "clean_links", "tracking_links"]
+
+CHAT_WORDS = [
+    "the", "a", "lol", "this", "is", "so", "good", "did", "you", "see", "what",
+    "happened", "yesterday", "anyone", "up", "for", "games", "tonight", "check",
+    "out", "new", "video", "meme", "wait", "really", "no", "way", "haha", "nice",
+]  # fmt: skip
+
+
+def _token(rng: random.Random, length: int = 8) -> str:
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=length))
+
+
+def _path(rng: random.Random) -> str:
+    return "/".join(_token(rng, rng.randint(3, 10)) for _ in range(rng.randint(1, 3)))
+
+
+def _query(rng: random.Random, size: int, tracking_ratio: float) -> str:
+    params = [
+        (
+            rng.choice(TRACKING_KEYS)
+            if rng.random() < tracking_ratio
+            else rng.choice(BENIGN_KEYS),
+            _token(rng, rng.randint(1, 24)),
+        )
+        for _ in range(size)
+    ]
+    return urllib.parse.urlencode(params)
+
+
+def _short_url(rng: random.Random) -> str:
+    host = rng.choice(MATCHING_HOSTS)
+    return f"https://{host}/{_path(rng)}?{_query(rng, rng.randint(1, 3), 0.5)}"
+
+
+def _long_query_url(rng: random.Random) -> str:
+    host = rng.choice(MATCHING_HOSTS)
+    return f"https://{host}/{_path(rng)}?{_query(rng, rng.randint(20, 40), 0.3)}"
+
+
+def _nested_redirect_url(rng: random.Random) -> str:
+    target = f"https://{rng.choice(MATCHING_HOSTS)}/{_path(rng)}?{_query(rng, 4, 0.5)}"
+    facebook = (
+        "https://l.facebook.com/l.php?"
+        f"u={urllib.parse.quote(target, safe='')}&h=AT{_token(rng, 16)}"
+    )
+    return (
+        "https://www.google.com/url?"
+        f"q={urllib.parse.quote(facebook, safe='')}&sa=D&ved={_token(rng, 12)}"
+    )
+
+
+def _non_matching_url(rng: random.Random) -> str:
+    host = rng.choice(NON_MATCHING_HOSTS)
+    return f"https://{host}/{_path(rng)}?{_query(rng, rng.randint(0, 6), 0.3)}"
+
+
+def _chat(rng: random.Random) -> str:
+    return " ".join(rng.choices(CHAT_WORDS, k=rng.randint(3, 30)))
+
+
+def _clean_link_message(rng: random.Random) -> str:
+    host = rng.choice(NON_MATCHING_HOSTS)
+    url = f"https://{host}/{_path(rng)}?{_query(rng, rng.randint(0, 3), 0.0)}"
+    return f"{_chat(rng)} {url}"
+
+
+def _tracking_link_message(rng: random.Random) -> str:
+    return f"{_chat(rng)} {_short_url(rng)} {_chat(rng)}"
+
+
+def generate_messages(size_per_category: int, seed: int = 0) -> dict[str, list[str]]:
+    """
+    Generates ``size_per_category`` chat messages for each category in
+    ``MESSAGE_CATEGORIES``: messages without links, messages with links which have no
+    tracking metadata, and messages with links which do
+    """
+    rng = random.Random(seed)
+    generators = {
+        "chat": _chat,
+        "clean_links": _clean_link_message,
+        "tracking_links": _tracking_link_message,
+    }
+    return {
+        category: [generators[category](rng) for _ in range(size_per_category)]
+        for category in MESSAGE_CATEGORIES
+    }
+
+
+def generate(size_per_category: int, seed: int = 0) -> dict[str, list[str]]:
+    """
+    Generates ``size_per_category`` URLs for each category in ``CATEGORIES``
+    """
+    rng = random.Random(seed)
+    generators = {
+        "short": _short_url,
+        "long_query": _long_query_url,
+        "nested_redirect": _nested_redirect_url,
+        "non_matching": _non_matching_url,
+    }
+    return {
+        category: [generators[category](rng) for _ in range(size_per_category)]
+        for category in CATEGORIES
+    }
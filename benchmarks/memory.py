@@ -0,0 +1,94 @@
+"""
+Measures the memory held by a ClearURLs engine built from the pinned rules snapshot,
+once every provider has compiled its patterns, as it would after matching URLs for a
+while. Reports the bytes allocated by the engine, the number of objects it added, the
+number of distinct compiled patterns, and the resident memory of the process.
+"""
+
+import argparse
+import collections
+import gc
+import pathlib
+import re
+import tracemalloc
+from collections.abc import Iterator
+
+from benchmarks import RULES_SNAPSHOT, configure_logging, report
+from memebot import config
+from memebot.integrations import clear_urls
+
+
+def _resident_kib() -> int:
+    """
+    Returns the resident memory of this process, on Linux
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _gc_objects_by_type() -> collections.Counter[str]:
+    gc.collect()
+    return collections.Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def _compiled_patterns(
+    providers: clear_urls.ProviderIndex,
+) -> Iterator[re.Pattern[str]]:
+    for provider in providers:
+        yield provider.url_pattern
+        yield from provider.redirections
+        yield from provider.exceptions
+        if provider.rules_pattern is not None:
+            yield provider.rules_pattern
+        if provider.raw_rules_pattern is not None:
+            yield provider.raw_rules_pattern
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        default=RULES_SNAPSHOT,
+        type=pathlib.Path,
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    config.clearurls_rules_files = []
+    rules = args.rules.read_text()
+
+    objects_before = _gc_objects_by_type()
+    resident_before = _resident_kib()
+    tracemalloc.start()
+    engine = clear_urls._build_engine(rules)
+    for provider in engine.providers:
+        provider.matches("")
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resident_after = _resident_kib()
+    objects_added = _gc_objects_by_type() - objects_before
+
+    patterns = list(_compiled_patterns(engine.providers))
+    report(f"providers:                {len(engine.providers)}")
+    report(f"allocated by engine:      {allocated / 1024:.0f} KiB")
+    report(f"resident memory growth:   {resident_after - resident_before} KiB")
+    report(f"objects tracked by gc:    {objects_added.total()}")
+    for name, count in objects_added.most_common(8):
+        report(f"  {name:<24}{count}")
+    report(f"compiled patterns:        {len(patterns)}")
+    report(f"  distinct objects:       {len({id(pattern) for pattern in patterns})}")
+    report(
+        f"  distinct sources:       {len({pattern.pattern for pattern in patterns})}"
+    )
+
+
+if __name__ == "__main__":
+    main()
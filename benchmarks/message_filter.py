@@ -0,0 +1,81 @@
+"""
+Measures the overhead which cleaning links automatically adds to every chat message.
+Times ``find_dirty_urls`` on messages without links, messages with links which have no
+tracking metadata and messages with links which do, as well as cleaning the links which
+it finds, as the ``on_message`` listener would.
+"""
+
+import argparse
+import pathlib
+from datetime import timedelta
+
+from benchmarks import RULES_SNAPSHOT, configure_logging, corpus, report
+from benchmarks.clear_urls import LatencyStats, _summarize, _time_calls
+from memebot import config
+from memebot.integrations import clear_urls
+
+
+def _report_results(results: dict[str, LatencyStats]) -> None:
+    report(
+        f"{'benchmark':<40} {'count':>8} {'per sec':>12} {'p50 us':>10} {'p99 us':>10}"
+    )
+    for name, stats in results.items():
+        report(
+            f"{name:<40} {stats.count:>8} {stats.per_second:>12.0f} "
+            f"{stats.p50_us:>10.2f} {stats.p99_us:>10.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        default=RULES_SNAPSHOT,
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--size", help="Number of messages per category", default=2000, type=int
+    )
+    parser.add_argument("--seed", help="Seed for the messages", default=0, type=int)
+    parser.add_argument(
+        "--repeat", help="Number of times to repeat each benchmark", default=5, type=int
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    # Every link should actually be cleaned, rather than looked up
+    config.clearurls_result_cache_size = 0
+    # Only the bundled custom providers are merged on top of the rules
+    config.clearurls_rules_files = []
+    # The bot's default budget, so that checking it is part of the measurements
+    config.clearurls_url_time_budget = timedelta(milliseconds=100)
+    clear_urls._publish_engine(clear_urls._build_engine(args.rules.read_text()))
+
+    results = {}
+    for category, messages in corpus.generate_messages(args.size, args.seed).items():
+        # Warm up, which also compiles the providers which match
+        _time_calls(clear_urls.find_dirty_urls, messages)
+        results[f"find_dirty_urls.{category}"] = _summarize(
+            _time_calls(clear_urls.find_dirty_urls, messages * args.repeat)
+        )
+        hits = sum(bool(clear_urls.find_dirty_urls(message)) for message in messages)
+        report(f"{category}: {hits} of {len(messages)} messages have dirty links")
+
+        dirty_messages = [
+            dirty_urls
+            for message in messages
+            if (dirty_urls := clear_urls.find_dirty_urls(message))
+        ]
+        if dirty_messages:
+            results[f"strip_trackers_many.{category}"] = _summarize(
+                _time_calls(
+                    clear_urls.strip_trackers_many, dirty_messages * args.repeat
+                )
+            )
+
+    _report_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares the cost of matching query parameter names against ClearURLs rules with
+``ClearURLsProvider.is_tracking_param``, which performs one hash lookup and at most one
+regex call, against the previous approach of testing every rule pattern in turn.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import timeit
+from collections.abc import Callable, Sequence
+
+from benchmarks import RULES_SNAPSHOT, configure_logging, report
+from memebot import config
+from memebot.integrations import clear_urls
+
+# Parameter names which are not tracking data for any provider
+_BENIGN_KEYS = ["id", "q", "page", "v", "list", "lang", "sort", "query", "index"]
+# Parameter names which are tracking data for many providers
+_COMMON_TRACKING_KEYS = ["utm_source", "utm_medium", "fbclid", "gclid", "ref"]
+
+
+def _legacy_is_tracking_param(rules: Sequence[re.Pattern[str]], key: str) -> bool:
+    return any(rule.match(key) for rule in rules)
+
+
+def _time_per_key(
+    is_tracking_param: Callable[[str], bool],
+    keys: Sequence[str],
+    repeat: int,
+    number: int,
+) -> float:
+    timer = timeit.Timer(lambda: [is_tracking_param(key) for key in keys])
+    return min(timer.repeat(repeat=repeat, number=number)) / (number * len(keys))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        default=RULES_SNAPSHOT,
+        type=pathlib.Path,
+    )
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument("--number", default=200, type=int)
+    args = parser.parse_args()
+
+    configure_logging()
+    config.clearurls_rules_files = []
+    rules = args.rules.read_text()
+    rules_files = clear_urls._read_rules_files()
+    providers = {
+        provider.provider: provider
+        for provider in clear_urls._convert_rules_to_providers(
+            rules, rules_files=rules_files
+        )
+    }
+    provider_data = json.loads(rules)["providers"]
+    for rules_file in rules_files:
+        provider_data |= {
+            name: data for name, data in rules_file.providers.items() if data
+        }
+
+    legacy_total = 0.0
+    hybrid_total = 0.0
+    total_keys = 0
+    for name, data in provider_data.items():
+        patterns = {
+            *data.get("rules", []),
+            *data.get("rawRules", []),
+            *data.get("referralMarketing", []),
+        }
+        if not patterns or name not in providers:
+            continue
+
+        provider = providers[name]
+        legacy_rules = [re.compile(pattern) for pattern in patterns]
+        keys = [*provider.literal_rules, *_COMMON_TRACKING_KEYS, *_BENIGN_KEYS]
+
+        legacy = _time_per_key(
+            lambda key, rules=legacy_rules: _legacy_is_tracking_param(rules, key),
+            keys,
+            args.repeat,
+            args.number,
+        )
+        hybrid = _time_per_key(
+            provider.is_tracking_param, keys, args.repeat, args.number
+        )
+        legacy_total += legacy * len(keys)
+        hybrid_total += hybrid * len(keys)
+        total_keys += len(keys)
+
+    report(f"Rules: {args.rules}")
+    report(f"Parameter names tested: {total_keys}")
+    report(f"Per-rule matching: {legacy_total / total_keys * 1e9:8.1f} ns/key")
+    report(f"Hybrid matching:   {hybrid_total / total_keys * 1e9:8.1f} ns/key")
+    report(f"Speedup:           {legacy_total / hybrid_total:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
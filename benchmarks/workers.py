@@ -0,0 +1,114 @@
+"""
+Measures how the throughput of cleaning URLs on a pool of workers scales with the
+number of workers, from 1 up to one per CPU core. Cleans the synthetic corpus in
+batches, as the offline CLI does, and reports the throughput of each pool relative to
+a single worker, next to cleaning the corpus on the calling thread.
+
+Pools are warmed up with a batch for each worker before they are timed, so that
+starting the workers and compiling their engines is reported separately.
+"""
+
+import argparse
+import os
+import pathlib
+import time
+from collections.abc import Iterator
+
+from benchmarks import RULES_SNAPSHOT, configure_logging, corpus, report
+from memebot import config
+from memebot.integrations import clear_urls
+from memebot.integrations.clear_urls import workers
+
+
+def _batched(urls: list[str], batch_size: int) -> Iterator[list[str]]:
+    for i in range(0, len(urls), batch_size):
+        yield urls[i : i + batch_size]
+
+
+def _clean_on_pool(
+    rules: str, urls: list[str], jobs: int, kind: workers.WorkerKind, batch_size: int
+) -> tuple[float, float]:
+    """
+    Returns the seconds taken to warm up a pool of ``jobs`` workers, and to clean the
+    URLs on it once it has warmed up
+    """
+    start = time.perf_counter()
+    with workers.create_executor(jobs, rules, kind) as executor:
+        # A batch for each worker, so that the workers start and compile the
+        # providers which match the corpus
+        warm_up = _batched(urls[: jobs * batch_size], batch_size)
+        for _ in executor.map(workers.strip_batch, warm_up):
+            pass
+        started = time.perf_counter()
+        for _ in executor.map(workers.strip_batch, _batched(urls, batch_size)):
+            pass
+        return started - start, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        default=RULES_SNAPSHOT,
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--size", help="Number of URLs per category", default=5000, type=int
+    )
+    parser.add_argument("--seed", help="Seed for the corpus", default=0, type=int)
+    parser.add_argument(
+        "--batch-size",
+        help="Number of URLs sent to a worker at a time",
+        default=250,
+        type=int,
+    )
+    parser.add_argument(
+        "--max-jobs",
+        help="Largest number of workers to measure (default: one per CPU core)",
+        default=os.cpu_count() or 1,
+        type=int,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Kinds of workers to measure (default: the default kind for this build)",
+        choices=workers.WORKER_KINDS,
+        action="append",
+        dest="worker_kinds",
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    workers.configure_worker(config.log_level, [])
+    rules = args.rules.read_text()
+    clear_urls._publish_engine(clear_urls._build_engine(rules))
+    urls = [
+        url for urls in corpus.generate(args.size, args.seed).values() for url in urls
+    ]
+
+    # Warm up, which also compiles the providers which match
+    workers.strip_batch(urls)
+    start = time.perf_counter()
+    workers.strip_batch(urls)
+    inline = time.perf_counter() - start
+
+    report(f"{len(urls)} URLs on {os.cpu_count()} CPU cores")
+    report(
+        f"{'workers':<24} {'warm-up ms':>10} {'URLs/sec':>12} {'speedup':>8} "
+        f"{'efficiency':>10}"
+    )
+    report(f"{'calling thread':<24} {'':>10} {len(urls) / inline:>12.0f}")
+    for kind in args.worker_kinds or [workers.default_worker_kind()]:
+        single = 0.0
+        for jobs in range(1, args.max_jobs + 1):
+            warm_up, elapsed = _clean_on_pool(rules, urls, jobs, kind, args.batch_size)
+            single = single or elapsed
+            report(
+                f"{f'{kind} x {jobs}':<24} {warm_up * 1e3:>10.0f} "
+                f"{len(urls) / elapsed:>12.0f} {single / elapsed:>7.2f}x "
+                f"{single / elapsed / jobs:>10.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
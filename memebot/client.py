@@ -5,6 +5,8 @@ import discord
 import discord.ext.commands
 
 from memebot import commands, config, db, log
+from memebot.integrations import clear_urls, paywall_bypass
+from memebot.integrations.clear_urls import short_links, workers
 from memebot.lib import exception, util
 
 
@@ -16,6 +18,8 @@ async def on_ready() -> None:
     if not memebot.user:
         raise exception.MemebotInternalError("Memebot is not logged in to Discord")
     log.info(f"Logged in as {memebot.user}")
+    clear_urls.start_background_refresh()
+    clear_urls.start_metrics_summary()
     synced = await memebot.tree.sync()
     log.info(f"Synced {len(synced)} command(s)")
     if config.database_enabled:
@@ -36,6 +40,60 @@ async def on_interaction(interaction: discord.Interaction) -> None:
     )
 
 
+def _auto_clean_enabled(message: discord.Message) -> bool:
+    return (
+        message.guild is not None
+        and message.guild.id in config.clearurls_auto_clean_guilds
+        and not message.author.bot
+    )
+
+
+async def _reply_with_clean_links(
+    message: discord.Message, dirty_urls: list[str]
+) -> None:
+    clean_urls = [
+        clean_url
+        for dirty_url, clean_url in zip(
+            dirty_urls, await workers.strip_trackers_many(dirty_urls), strict=True
+        )
+        if clean_url != dirty_url
+    ]
+    if clean_urls:
+        await message.reply(
+            util.format_links("Links without trackers:", clean_urls),
+            mention_author=False,
+        )
+
+
+async def on_message(message: discord.Message) -> None:
+    """
+    Replies to messages with links which contain tracking metadata, in guilds which
+    have opted in. Every message is checked, so links are only cleaned once a cheap
+    check has found tracking metadata in them.
+    """
+    if not _auto_clean_enabled(message):
+        return
+    if dirty_urls := clear_urls.find_dirty_urls(message.content):
+        await _reply_with_clean_links(message, dirty_urls)
+
+
+async def on_message_edit(before: discord.Message, after: discord.Message) -> None:
+    """
+    Replies to edited messages as ``on_message`` does, but only with links which
+    the edit added, so that no link is cleaned twice
+    """
+    # Discord also reports an edit when it loads the embeds of a message
+    if not _auto_clean_enabled(after) or after.content == before.content:
+        return
+    already_cleaned = set(clear_urls.find_dirty_urls(before.content))
+    if dirty_urls := [
+        dirty_url
+        for dirty_url in clear_urls.find_dirty_urls(after.content)
+        if dirty_url not in already_cleaned
+    ]:
+        await _reply_with_clean_links(after, dirty_urls)
+
+
 async def on_command_error(
     interaction: discord.Interaction, error: discord.app_commands.AppCommandError
 ) -> None:
@@ -82,9 +140,21 @@ async def on_command_error(
     await interaction.response.send_message(err_msg, ephemeral=True)
 
 
+class Memebot(discord.ext.commands.Bot):
+    async def close(self) -> None:
+        """
+        Logs out of Discord, and closes the HTTP sessions and the workers which the
+        integrations started while the bot was running
+        """
+        await super().close()
+        await short_links.close()
+        await paywall_bypass.close()
+        await workers.close()
+
+
 @functools.cache
-def get_memebot() -> discord.ext.commands.Bot:
-    new_memebot = discord.ext.commands.Bot(
+def get_memebot() -> Memebot:
+    new_memebot = Memebot(
         command_prefix="/",
         intents=discord.Intents().all(),
         activity=discord.Game(name="• /hello"),
@@ -94,6 +164,8 @@ def get_memebot() -> discord.ext.commands.Bot:
 
     new_memebot.add_listener(on_ready)
     new_memebot.add_listener(on_interaction)
+    new_memebot.add_listener(on_message)
+    new_memebot.add_listener(on_message_edit)
     new_memebot.tree.error(on_command_error)
 
     return new_memebot
@@ -1,8 +1,29 @@
 import discord
 
+from memebot.integrations import paywall_bypass
 from memebot.lib import exception, util
 
-PREFIX = "https://removepaywalls.com"
+
+async def _send_bypass_link(interaction: discord.Interaction, link: str) -> None:
+    """
+    Replies with the link on a backend which works for it. Links whose backend is
+    already known are answered at once, and the others once the backends are probed.
+    """
+    if (backend := paywall_bypass.known_backend(link)) is not None:
+        await interaction.response.send_message(
+            f"[Link]({link}) without paywall: {backend.bypass_link(link)}"
+        )
+        return
+
+    await interaction.response.defer(thinking=True)
+    if (backend := await paywall_bypass.find_backend(link)) is not None:
+        await interaction.followup.send(
+            f"[Link]({link}) without paywall: {backend.bypass_link(link)}"
+        )
+    else:
+        await interaction.followup.send(
+            f"Could not find a working way around the paywall of <{link}>"
+        )
 
 
 @discord.app_commands.command()  # type: ignore
@@ -14,21 +35,14 @@ async def paywall(interaction: discord.Interaction, link: str) -> None:
     if not util.is_url(link):
         raise exception.MemebotUserError("Invalid link")
 
-    link = remove_params(link)
-
-    await interaction.response.send_message(
-        f"[Link]({link}) without paywall: {PREFIX}/{link}"
-    )
+    await _send_bypass_link(interaction, remove_params(link))
 
 
 @discord.app_commands.context_menu(name="Remove paywall")
 async def paywall_context_menu(
     interaction: discord.Interaction, message: discord.Message
 ) -> None:
-    link = remove_params(util.extract_link(message))
-    await interaction.response.send_message(
-        f"[Link]({link}) without paywall: {PREFIX}/{link}"
-    )
+    await _send_bypass_link(interaction, remove_params(util.extract_link(message)))
 
 
 def remove_params(url: str) -> str:
@@ -1,21 +1,102 @@
 import discord
 
+from memebot import config
 from memebot.integrations import clear_urls
-from memebot.lib import exception, util
+from memebot.integrations.clear_urls import short_links, workers
+from memebot.lib import constants, exception, util
+
+
+def _format_duration(elapsed_ns: int) -> str:
+    return f"{elapsed_ns / 1e3:.0f}us"
+
+
+def _format_explanation(
+    explanation: clear_urls.Explanation, short_link: str | None = None
+) -> str:
+    """
+    Describes each step of cleaning a link, cut short if it is too long for Discord.
+    ``short_link`` is the link which was expanded into the cleaned link, if any.
+    """
+    lines = [
+        *([f"Expanded short link <{short_link}>"] if short_link is not None else []),
+        f"Link without trackers: <{explanation.clean_url}>",
+        (
+            f"Cleaned in {_format_duration(explanation.total_ns)}. "
+            f"Looked up {explanation.candidates} candidate provider(s) in "
+            f"{_format_duration(explanation.lookup_ns)}."
+        ),
+    ]
+    budget = config.clearurls_url_time_budget
+    if budget and explanation.total_ns > budget.total_seconds() * 1e9:
+        lines.append(
+            f"This is over the time budget of {budget}, "
+            "so the link is only partially cleaned outside of explain mode."
+        )
+    if not explanation.providers:
+        lines.append("No provider matched this link.")
+    if len(explanation.hops) > 1:
+        lines.append(f"Followed {len(explanation.hops) - 1} redirect(s).")
+
+    for provider in explanation.providers:
+        hop = f" (hop {provider.hop + 1})" if len(explanation.hops) > 1 else ""
+        lines.append(
+            f"- **{provider.provider}**{hop} matched in "
+            f"{_format_duration(provider.match_ns)}"
+        )
+        if provider.vetoed_by is not None:
+            lines.append(f"  - Vetoed by exception `{provider.vetoed_by}`")
+            continue
+        removed = ", ".join(
+            [f"`{text}` (raw rule `{rule}`)" for text, rule in provider.removed_raw]
+            + [f"`{key}` (rule `{rule}`)" for key, rule in provider.removed_params]
+        )
+        lines.append(
+            f"  - Removed {removed or 'nothing'} in "
+            f"{_format_duration(provider.strip_ns)}"
+        )
+        if provider.redirection is not None:
+            lines.append(
+                f"  - Redirected by `{provider.redirection}` to "
+                f"<{provider.redirected_url}> in "
+                f"{_format_duration(provider.redirect_ns)}"
+            )
+
+    message = "\n".join(lines)
+    if len(message) > constants.MAX_MESSAGE_LENGTH:
+        message = f"{message[: constants.MAX_MESSAGE_LENGTH - 1]}…"
+    return message
 
 
 @discord.app_commands.command()  # type: ignore
-async def trackers(interaction: discord.Interaction, link: str) -> None:
+@discord.app_commands.describe(
+    explain="Privately show which rules changed the link, and how long they took"
+)
+async def trackers(
+    interaction: discord.Interaction, link: str, explain: bool = False
+) -> None:
     """
     Generate the given link without tracking metadata
     """
     if not util.is_url(link):
         raise exception.MemebotUserError("Invalid link")
 
+    if explain:
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        expanded_link = await short_links.expand(link)
+        await interaction.followup.send(
+            _format_explanation(
+                clear_urls.explain(expanded_link),
+                link if expanded_link != link else None,
+            ),
+            ephemeral=True,
+        )
+        return
+
     await interaction.response.defer(thinking=True)
 
     await interaction.followup.send(
-        f"Link without trackers: {clear_urls.strip_trackers(link)}"
+        "Link without trackers: "
+        f"{clear_urls.strip_trackers(await short_links.expand(link))}"
     )
 
 
@@ -28,5 +109,22 @@ async def trackers_context_menu(
     await interaction.response.defer(thinking=True)
 
     await interaction.followup.send(
-        f"Link without trackers: {clear_urls.strip_trackers(link)}"
+        "Link without trackers: "
+        f"{clear_urls.strip_trackers(await short_links.expand(link))}"
+    )
+
+
+@discord.app_commands.context_menu(name="Remove trackers from all links")
+async def trackers_all_links_context_menu(
+    interaction: discord.Interaction, message: discord.Message
+) -> None:
+    links = util.extract_links(message)
+
+    await interaction.response.defer(thinking=True)
+
+    await interaction.followup.send(
+        util.format_links(
+            "Links without trackers:",
+            await workers.strip_trackers_many(await short_links.expand_many(links)),
+        )
     )
@@ -1,6 +1,7 @@
 import argparse
 import logging
 import os
+import pathlib
 import urllib.parse
 from datetime import timedelta
 
@@ -19,10 +20,40 @@ database_enabled: bool
 # MongoDB URI
 database_uri: urllib.parse.ParseResult
 
-# ClearURLs rules URL
+# ClearURLs rules URL, which is empty if the rules are not downloaded
 clearurls_rules_url: str
+# Local ClearURLs rules files, merged in order on top of the downloaded rules
+clearurls_rules_files: list[pathlib.Path]
 # ClearURLs rules refresh duration
 clearurls_rules_refresh_hours: timedelta
+# Directory in which a snapshot of the ClearURLs rules is kept
+clearurls_cache_dir: pathlib.Path
+# Maximum number of cleaned URLs to cache
+clearurls_result_cache_size: int
+# Time after which cleaning a URL stops with the partially cleaned result
+clearurls_url_time_budget: timedelta
+# Interval at which a summary of the ClearURLs metrics is logged
+clearurls_metrics_interval: timedelta
+# IDs of the guilds in which links in messages are cleaned without a command
+clearurls_auto_clean_guilds: set[int]
+# Hosts of link shorteners, whose links are expanded before they are cleaned
+clearurls_short_link_hosts: set[str]
+# Time after which expanding a short link stops, and the short link is used instead
+clearurls_short_link_budget: timedelta
+# File of URLs which new ClearURLs rules are evaluated on before they are published,
+# or None for the built-in corpus
+clearurls_canary_corpus: pathlib.Path | None
+# Percentage of the canary URLs which new ClearURLs rules may clean differently
+clearurls_canary_max_changed_percent: float
+# Percentage by which new ClearURLs rules may be slower to clean the canary URLs
+clearurls_canary_max_slowdown_percent: float
+# Number of workers which clean batches of links off the event loop, or 0 for none
+clearurls_workers: int
+
+# URL templates of the archive and bypass services used to get around paywalls
+paywall_backends: list[str]
+# Time after which probing the paywall backends for a link stops
+paywall_probe_timeout: timedelta
 
 
 def populate_config_from_command_line() -> None:
@@ -97,18 +128,131 @@ def populate_config_from_command_line() -> None:
     # ClearURLs
     parser.add_argument(
         "--clearurls-rules-url",
-        help="URL from which to download ClearURLs rules",
+        help="URL from which to download ClearURLs rules. "
+        "If empty, only the rules files are used",
         default=os.getenv(
             "CLEARURLS_RULES_URL", "https://rules2.clearurls.xyz/data.minify.json"
         ),
         type=str,
     )
+    parser.add_argument(
+        "--clearurls-rules-files",
+        help="Comma-separated paths of local ClearURLs rules files, which are merged "
+        "in order on top of the downloaded rules, and reloaded whenever they change",
+        default=os.getenv("CLEARURLS_RULES_FILES", ""),
+        type=validators.validate_path_list,
+    )
     parser.add_argument(
         "--clearurls-rules-refresh-hours",
-        help="Number of hours to wait between (lazy) refreshes of ClearURLs rules",
+        help="Number of hours to wait between background refreshes of ClearURLs rules",
         default=os.getenv("CLEARURLS_RULES_REFRESH_HOURS", "24"),
         type=validators.validate_hour_int,
     )
+    parser.add_argument(
+        "--clearurls-cache-dir",
+        help="Directory in which to keep a snapshot of the ClearURLs rules, "
+        "which is used on startup and when the rules cannot be downloaded",
+        default=os.getenv(
+            "CLEARURLS_CACHE_DIR",
+            str(pathlib.Path.home() / ".cache" / "memebot" / "clearurls"),
+        ),
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--clearurls-result-cache-size",
+        help="Maximum number of cleaned URLs to cache. 0 disables the cache",
+        default=os.getenv("CLEARURLS_RESULT_CACHE_SIZE", "4096"),
+        type=int,
+    )
+    parser.add_argument(
+        "--clearurls-url-time-budget-ms",
+        help="Number of milliseconds after which cleaning a single URL stops, "
+        "and the partially cleaned URL is used instead. 0 disables the budget",
+        default=os.getenv("CLEARURLS_URL_TIME_BUDGET_MS", "100"),
+        type=validators.validate_millisecond_int,
+    )
+    parser.add_argument(
+        "--clearurls-metrics-interval-minutes",
+        help="Number of minutes to wait between logging summaries of which ClearURLs "
+        "providers matched URLs, and how long they took. 0 disables the summaries",
+        default=os.getenv("CLEARURLS_METRICS_INTERVAL_MINUTES", "60"),
+        type=validators.validate_minute_int,
+    )
+    parser.add_argument(
+        "--clearurls-auto-clean-guilds",
+        help="Comma-separated IDs of Discord servers in which Memebot replies to any "
+        "message with links containing tracking metadata, with the cleaned links",
+        default=os.getenv("CLEARURLS_AUTO_CLEAN_GUILDS", ""),
+        type=validators.validate_int_set,
+    )
+    parser.add_argument(
+        "--clearurls-short-link-hosts",
+        help="Comma-separated hosts of link shorteners, whose links are expanded "
+        "into the URLs they redirect to before trackers are removed",
+        default=os.getenv(
+            "CLEARURLS_SHORT_LINK_HOSTS",
+            "t.co,bit.ly,amzn.to,amzn.eu,a.co,tinyurl.com,ow.ly,buff.ly,lnkd.in,dlvr.it",
+        ),
+        type=validators.validate_str_set,
+    )
+    parser.add_argument(
+        "--clearurls-short-link-budget-ms",
+        help="Number of milliseconds after which expanding a short link stops, "
+        "and the short link is cleaned as it is. 0 disables expanding short links",
+        default=os.getenv("CLEARURLS_SHORT_LINK_BUDGET_MS", "2000"),
+        type=validators.validate_millisecond_int,
+    )
+    parser.add_argument(
+        "--clearurls-canary-corpus",
+        help="Path of a file of URLs, one per line, which new ClearURLs rules are "
+        "evaluated on before they are published. Uses the built-in corpus if empty, "
+        "and an empty file disables the evaluation",
+        default=os.getenv("CLEARURLS_CANARY_CORPUS", ""),
+        type=validators.validate_optional_path,
+    )
+    parser.add_argument(
+        "--clearurls-canary-max-changed-percent",
+        help="Percentage of the canary URLs which new ClearURLs rules may clean "
+        "differently from the current rules, beyond which they are not published",
+        default=os.getenv("CLEARURLS_CANARY_MAX_CHANGED_PERCENT", "10"),
+        type=float,
+    )
+    parser.add_argument(
+        "--clearurls-canary-max-slowdown-percent",
+        help="Percentage by which new ClearURLs rules may be slower than the current "
+        "rules to clean the canary URLs, beyond which they are not published",
+        default=os.getenv("CLEARURLS_CANARY_MAX_SLOWDOWN_PERCENT", "50"),
+        type=float,
+    )
+    parser.add_argument(
+        "--clearurls-workers",
+        help="Number of workers which clean the links of automatically cleaned "
+        "messages, and of the context menu for all links, on other CPU cores. "
+        "0 cleans them on the event loop",
+        default=os.getenv("CLEARURLS_WORKERS", "0"),
+        type=int,
+    )
+
+    # Paywall Configuration
+    parser.add_argument(
+        "--paywall-backends",
+        help="Comma-separated URL templates of archive and bypass services which "
+        "serve a link without its paywall, with {url} standing in for the link",
+        default=os.getenv(
+            "PAYWALL_BACKENDS",
+            "https://removepaywalls.com/{url},https://archive.ph/newest/{url},"
+            "https://web.archive.org/web/{url}",
+        ),
+        type=validators.validate_url_template_list,
+    )
+    parser.add_argument(
+        "--paywall-probe-timeout-ms",
+        help="Number of milliseconds to wait for any paywall backend to serve a link, "
+        "when none is known to work for its domain. 0 disables probing, "
+        "and always uses the first backend",
+        default=os.getenv("PAYWALL_PROBE_TIMEOUT_MS", "2500"),
+        type=validators.validate_millisecond_int,
+    )
 
     args = parser.parse_args()
 
@@ -126,6 +270,35 @@ def populate_config_from_command_line() -> None:
     database_uri = args.database_uri
 
     global clearurls_rules_url
+    global clearurls_rules_files
     global clearurls_rules_refresh_hours
+    global clearurls_cache_dir
+    global clearurls_result_cache_size
+    global clearurls_url_time_budget
+    global clearurls_metrics_interval
+    global clearurls_auto_clean_guilds
+    global clearurls_short_link_hosts
+    global clearurls_short_link_budget
+    global clearurls_canary_corpus
+    global clearurls_canary_max_changed_percent
+    global clearurls_canary_max_slowdown_percent
+    global clearurls_workers
     clearurls_rules_url = args.clearurls_rules_url
+    clearurls_rules_files = args.clearurls_rules_files
     clearurls_rules_refresh_hours = args.clearurls_rules_refresh_hours
+    clearurls_cache_dir = args.clearurls_cache_dir
+    clearurls_result_cache_size = args.clearurls_result_cache_size
+    clearurls_url_time_budget = args.clearurls_url_time_budget_ms
+    clearurls_metrics_interval = args.clearurls_metrics_interval_minutes
+    clearurls_auto_clean_guilds = args.clearurls_auto_clean_guilds
+    clearurls_short_link_hosts = args.clearurls_short_link_hosts
+    clearurls_short_link_budget = args.clearurls_short_link_budget_ms
+    clearurls_canary_corpus = args.clearurls_canary_corpus
+    clearurls_canary_max_changed_percent = args.clearurls_canary_max_changed_percent
+    clearurls_canary_max_slowdown_percent = args.clearurls_canary_max_slowdown_percent
+    clearurls_workers = args.clearurls_workers
+
+    global paywall_backends
+    global paywall_probe_timeout
+    paywall_backends = args.paywall_backends
+    paywall_probe_timeout = args.paywall_probe_timeout_ms
@@ -6,6 +6,7 @@ by the config module.
 import collections
 import logging
 import logging.handlers
+import pathlib
 import sys
 from datetime import timedelta
 
@@ -30,3 +31,37 @@ def validate_bool(val: str) -> bool:
 def validate_hour_int(val: str) -> timedelta:
     as_int = int(val)
     return timedelta(hours=as_int)
+
+
+def validate_minute_int(val: str) -> timedelta:
+    as_int = int(val)
+    return timedelta(minutes=as_int)
+
+
+def validate_millisecond_int(val: str) -> timedelta:
+    as_int = int(val)
+    return timedelta(milliseconds=as_int)
+
+
+def validate_int_set(val: str) -> set[int]:
+    return {int(item) for item in val.split(",") if item.strip()}
+
+
+def validate_str_set(val: str) -> set[str]:
+    return {item.strip().lower() for item in val.split(",") if item.strip()}
+
+
+def validate_path_list(val: str) -> list[pathlib.Path]:
+    return [pathlib.Path(item.strip()) for item in val.split(",") if item.strip()]
+
+
+def validate_optional_path(val: str) -> pathlib.Path | None:
+    return pathlib.Path(val.strip()) if val.strip() else None
+
+
+def validate_url_template_list(val: str) -> list[str]:
+    templates = [item.strip() for item in val.split(",") if item.strip()]
+    for template in templates:
+        if "{url}" not in template:
+            raise ValueError(f"URL template {template} does not contain {{url}}")
+    return templates
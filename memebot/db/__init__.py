@@ -1,9 +1,16 @@
+from typing import Any
+
+import pymongo.collection
+
 from memebot import config
 
 from .internals import DatabaseInternals
 
 db_internals = DatabaseInternals()
 
+# Name of the database which holds all of Memebot's collections
+DATABASE_NAME = "memebot"
+
 
 def test() -> bool:
     """
@@ -16,3 +23,16 @@ def test() -> bool:
         except Exception:
             return False
     return True
+
+
+def get_collection(name: str) -> pymongo.collection.Collection[dict[str, Any]] | None:
+    """
+    Gets a collection from Memebot's database
+    :return: The collection, or None if the database is disabled or not connected
+    """
+    if not config.database_enabled:
+        return None
+    database = db_internals.get_db(DATABASE_NAME)
+    if database is None:
+        return None
+    return database[name]
@@ -0,0 +1,1987 @@
+import asyncio
+import functools
+import hashlib
+import http
+import json
+import os
+import pathlib
+import re
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections.abc import Hashable, Iterable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Any, cast
+
+import pymongo.collection
+import pymongo.errors
+
+from memebot import config, db, log
+from memebot.integrations.clear_urls import canary, metrics, syntax
+from memebot.lib import cache, exception, util
+
+# Providers which are not part of the upstream ClearURLs rules. They are merged on top
+# of the downloaded rules, and below any rules files in the config.
+_CUSTOM_RULES_FILE = pathlib.Path(__file__).with_name("custom_rules.json")
+
+
+def _decode_uri(uri: str) -> str:
+    # Only a single level of encoding is removed, unlike the addon, which decodes
+    # completely. A redirect nested inside this one keeps its own encoding, which
+    # the redirection patterns of its host may depend on, e.g. a Google redirect to
+    # an l.facebook.com redirect, whose pattern only matches an encoded URL.
+    return urllib.parse.unquote(uri)
+
+
+def _decode_query_key(key: str) -> str:
+    if "%" in key or "+" in key:
+        return urllib.parse.unquote_plus(key)
+    return key
+
+
+# Matches a pattern which has no special meaning other than its literal characters
+_LITERAL_PATTERN = re.compile(r"(?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*")
+_ESCAPED_CHAR_PATTERN = re.compile(r"\\(.)")
+
+
+def _is_literal_pattern(pattern: str) -> bool:
+    return bool(_LITERAL_PATTERN.fullmatch(pattern))
+
+
+def _unescape_literal_pattern(pattern: str) -> str:
+    return _ESCAPED_CHAR_PATTERN.sub(r"\1", pattern)
+
+
+def _casefold_literal_pattern(pattern: str) -> str:
+    """
+    Returns the casefolded parameter name which a literal pattern matches. Most of them
+    are already casefolded, in which case the shared pattern string itself is returned.
+    """
+    name = _unescape_literal_pattern(pattern)
+    folded = name.casefold()
+    return name if folded == name else folded
+
+
+class _Interner:
+    """
+    Shares equal strings, collections and compiled patterns between the providers
+    built by a single refresh of the rules. Many providers list the same rules, e.g.
+    the ``utm_*`` family, so each distinct pattern is only stored and compiled once.
+
+    Values are only interned until the refresh is done, since the table of them would
+    outweigh the duplicates which it saves afterwards. Compiled patterns are shared
+    for as long as the providers are, since most of them are only compiled once their
+    provider matches a URL.
+    """
+
+    __slots__ = ("_compiled", "_values")
+
+    def __init__(self) -> None:
+        self._values: dict[Hashable, Hashable] | None = {}
+        self._compiled: dict[tuple[str, int], re.Pattern[str]] = {}
+
+    def intern[T: Hashable](self, value: T) -> T:
+        """
+        Returns the first value which was interned equal to ``value``, or ``value``
+        itself once the refresh is done
+        """
+        if self._values is None:
+            return value
+        return cast(T, self._values.setdefault(value, value))
+
+    def finish_refresh(self) -> None:
+        self._values = None
+
+    def strings(self, values: Iterable[str] | None) -> tuple[str, ...]:
+        """
+        Interns each of the strings, and the tuple of them
+        """
+        return self.intern(tuple(self.intern(value) for value in values or ()))
+
+    def compile(self, pattern: str, flags: int = 0) -> re.Pattern[str]:
+        key = (pattern, flags)
+        if (compiled := self._compiled.get(key)) is None:
+            compiled = self._compiled[key] = re.compile(pattern, flags)
+        return compiled
+
+    def compile_alternation(
+        self, patterns: Sequence[str], flags: int = 0
+    ) -> re.Pattern[str] | None:
+        """
+        Compiles several patterns into a single pattern which matches any one of them
+        """
+        if not patterns:
+            return None
+        return self.compile("|".join(f"(?:{pattern})" for pattern in patterns), flags)
+
+
+@dataclass(frozen=True, slots=True)
+class _CompiledPatterns:
+    """
+    The patterns of a ``ClearURLsProvider`` which are only compiled once it is needed
+    """
+
+    # Most rules are plain parameter names, which can be checked with a single hash
+    # lookup. The rest are combined into a single alternation.
+    literal_rules: frozenset[str]
+    rules_pattern: re.Pattern[str] | None
+    # Raw rules are removed from anywhere in the URL, so they are all combined into a
+    # single alternation which is substituted in one pass
+    raw_rules_pattern: re.Pattern[str] | None
+    redirections: tuple[re.Pattern[str], ...]
+    exceptions: tuple[re.Pattern[str], ...]
+
+
+_NO_PATTERNS = _CompiledPatterns(frozenset(), None, None, (), ())
+
+
+class ClearURLsProvider:
+    """
+    Describes a provider pattern specified by the ClearURLs schema
+    https://github.com/ClearURLs/Rules
+
+    Only the URL pattern is compiled up front. Most providers never match a URL that
+    is posted, so their other patterns are compiled the first time the URL pattern
+    matches. Any rule or redirection which could backtrack catastrophically is
+    quarantined at that point, and so is the whole provider if one of its exceptions
+    could.
+
+    There are many providers, which hold on to their patterns for as long as they are
+    in use, so they have no ``__dict__`` and keep their patterns in tuples.
+    """
+
+    __slots__ = (
+        "_compiled",
+        "_exception_patterns",
+        "_interner",
+        "_raw_rule_patterns",
+        "_redirection_patterns",
+        "_rule_patterns",
+        "provider",
+        "url_pattern",
+    )
+
+    def __init__(
+        self,
+        provider: str,
+        url_pattern: str,
+        rule_patterns: list[str] | None,
+        raw_rule_patterns: list[str] | None,
+        referral_marketing_patterns: list[str] | None,
+        redirection_patterns: list[str] | None,
+        exception_patterns: list[str] | None,
+        interner: _Interner | None = None,
+    ) -> None:
+        """
+        Ingests a provider object, builds its URL pattern. Its patterns are shared
+        through ``interner`` with the other providers which use it.
+        """
+        self._interner = interner = interner or _Interner()
+        self.provider = provider
+        self.url_pattern = interner.compile(url_pattern)
+
+        # Sorted and deduplicated, but kept in a tuple, which is much smaller than a set
+        self._rule_patterns = interner.strings(
+            sorted({*(rule_patterns or ()), *(referral_marketing_patterns or ())})
+        )
+        self._raw_rule_patterns = interner.strings(raw_rule_patterns)
+        self._redirection_patterns = interner.strings(redirection_patterns)
+        self._exception_patterns = interner.strings(exception_patterns)
+        self._compiled: _CompiledPatterns | None = None
+
+    @property
+    def compiled(self) -> bool:
+        """
+        Whether the patterns other than the URL pattern have been compiled yet
+        """
+        return self._compiled is not None
+
+    def _quarantine(
+        self, patterns: Iterable[str], ignore_case: bool = False
+    ) -> list[str]:
+        """
+        Filters out patterns which could backtrack catastrophically
+        """
+        safe_patterns = []
+        for pattern in patterns:
+            if syntax.has_catastrophic_backtracking(pattern, ignore_case):
+                log.warning(
+                    f"Quarantined ClearURLs pattern {pattern!r} of provider "
+                    f"{self.provider}, which could backtrack catastrophically"
+                )
+            else:
+                safe_patterns.append(pattern)
+        return safe_patterns
+
+    def _patterns(self) -> _CompiledPatterns:
+        if self._compiled is not None:
+            return self._compiled
+
+        literal_rules = {
+            rule for rule in self._rule_patterns if _is_literal_pattern(rule)
+        }
+        exception_patterns = self._quarantine(self._exception_patterns)
+        if len(exception_patterns) < len(self._exception_patterns):
+            # Ignoring an exception could break URLs which it protects,
+            # so the whole provider is disabled instead
+            self._compiled = _NO_PATTERNS
+            return self._compiled
+
+        interner = self._interner
+        try:
+            self._compiled = _CompiledPatterns(
+                # Rules are case-insensitive, as in the ClearURLs add-on, so the
+                # literal rules are casefolded, and so are the names looked up
+                literal_rules=interner.intern(
+                    frozenset(
+                        interner.intern(_casefold_literal_pattern(rule))
+                        for rule in literal_rules
+                    )
+                ),
+                rules_pattern=interner.compile_alternation(
+                    self._quarantine(
+                        [
+                            rule
+                            for rule in self._rule_patterns
+                            if rule not in literal_rules
+                        ],
+                        ignore_case=True,
+                    ),
+                    re.IGNORECASE,
+                ),
+                raw_rules_pattern=interner.compile_alternation(
+                    self._quarantine(self._raw_rule_patterns, ignore_case=True),
+                    re.IGNORECASE,
+                ),
+                redirections=interner.intern(
+                    tuple(
+                        interner.compile(pattern)
+                        for pattern in self._quarantine(self._redirection_patterns)
+                    )
+                ),
+                exceptions=interner.intern(
+                    tuple(interner.compile(pattern) for pattern in exception_patterns)
+                ),
+            )
+        except re.error as e:
+            log.exception(
+                f"ClearURLs provider {self.provider} has an invalid pattern", exc_info=e
+            )
+            self._compiled = _NO_PATTERNS
+        return self._compiled
+
+    @property
+    def literal_rules(self) -> frozenset[str]:
+        return self._patterns().literal_rules
+
+    @property
+    def rules_pattern(self) -> re.Pattern[str] | None:
+        return self._patterns().rules_pattern
+
+    @property
+    def raw_rules_pattern(self) -> re.Pattern[str] | None:
+        return self._patterns().raw_rules_pattern
+
+    @property
+    def redirections(self) -> tuple[re.Pattern[str], ...]:
+        return self._patterns().redirections
+
+    @property
+    def exceptions(self) -> tuple[re.Pattern[str], ...]:
+        return self._patterns().exceptions
+
+    def matches(self, url: str) -> bool:
+        """
+        Determines if a URL matches this provider's URL pattern,
+        and does not match any of its exception patterns
+        """
+        url = url.strip()
+        return bool(self.url_pattern.match(url)) and not any(
+            exc.match(url) for exc in self.exceptions
+        )
+
+    def matching_exception(self, url: str) -> str | None:
+        """
+        Returns the first exception pattern which matches the URL, if any
+        """
+        url = url.strip()
+        for exc in self.exceptions:
+            if exc.match(url):
+                return exc.pattern
+        return None
+
+    def matching_rule(self, key: str) -> str | None:
+        """
+        Returns the rule which makes a query parameter name a tracking parameter, if
+        any. This is much slower than ``is_tracking_param``, and is only meant for
+        explaining how a URL was cleaned.
+        """
+        patterns = self._patterns()
+        if (folded_key := key.casefold()) in patterns.literal_rules:
+            return folded_key
+        if not (patterns.rules_pattern and patterns.rules_pattern.fullmatch(key)):
+            return None
+        # The combined pattern does not tell which of its rules matched
+        for rule in self._rule_patterns:
+            if (
+                not _is_literal_pattern(rule)
+                and not syntax.has_catastrophic_backtracking(rule, ignore_case=True)
+                and re.fullmatch(rule, key, re.IGNORECASE)
+            ):
+                return rule
+        return None
+
+    def matching_raw_rules(self, url: str) -> list[tuple[str, str]]:
+        """
+        Returns each part of the URL which a raw rule removes, with the rule which
+        removes it. Like ``matching_rule``, this is only meant for explaining how a
+        URL was cleaned.
+        """
+        if (raw_rules_pattern := self.raw_rules_pattern) is None:
+            return []
+        raw_rules = [
+            re.compile(rule, re.IGNORECASE)
+            for rule in self._raw_rule_patterns
+            if not syntax.has_catastrophic_backtracking(rule, ignore_case=True)
+        ]
+        matches = []
+        for match in raw_rules_pattern.finditer(url):
+            for raw_rule in raw_rules:
+                rule_match = raw_rule.match(url, match.start())
+                if rule_match and rule_match.end() == match.end():
+                    matches.append((match.group(), raw_rule.pattern))
+                    break
+        return matches
+
+    def is_tracking_param(self, key: str) -> bool:
+        """
+        Determines if a query parameter name matches any of this provider's rules,
+        ignoring case
+        """
+        patterns = self._patterns()
+        if key.casefold() in patterns.literal_rules:
+            return True
+        return bool(patterns.rules_pattern and patterns.rules_pattern.fullmatch(key))
+
+    def strip_params(self, url: str) -> str:
+        """
+        Strips tracking parameters per this provider's rules.
+
+        Raw rules are removed from anywhere in the URL first, e.g. Amazon's
+        ``/ref=...`` path segments, in a single substitution. The query is then
+        scanned in place, and only the offending ``key=value`` segments are spliced
+        out. Everything else is left exactly as it was, and if nothing is removed,
+        ``url`` itself is returned.
+        """
+        return self.strip_params_counted(url)[0]
+
+    def strip_params_counted(self, url: str) -> tuple[str, int]:
+        """
+        Strips tracking parameters as ``strip_params`` does, and also returns the
+        number of parameters and raw rule matches which were removed
+        """
+        removed = 0
+        if (raw_rules_pattern := self.raw_rules_pattern) is not None:
+            url, removed = raw_rules_pattern.subn("", url)
+
+        query_end = url.find("#")
+        if query_end == -1:
+            query_end = len(url)
+        query_start = url.find("?", 0, query_end) + 1
+        if not query_start:
+            return url, removed
+
+        # The spans of the segments which are kept
+        kept: list[tuple[int, int]] = []
+        removed_params = 0
+        start = query_start
+        while start <= query_end:
+            end = url.find("&", start, query_end)
+            if end == -1:
+                end = query_end
+            key_end = url.find("=", start, end)
+            key = url[start : end if key_end == -1 else key_end]
+            if key and self.is_tracking_param(_decode_query_key(key)):
+                removed_params += 1
+            else:
+                kept.append((start, end))
+            start = end + 1
+
+        if not removed_params:
+            return url, removed
+
+        query = "&".join(url[start:end] for start, end in kept)
+        return (
+            f"{url[: query_start - 1]}{'?' if query else ''}{query}{url[query_end:]}",
+            removed + removed_params,
+        )
+
+    def redirect(self, url: str) -> str:
+        """
+        Performs a simulated redirect per this provider's redirection patterns.
+        This prevents tracking across site redirects.
+
+        Eagerly returns the transformation described by the pattern for the first
+        pattern in this provider's ``self.redirections`` which matches the URL.
+        """
+        for redirect in self.redirections:
+            if match := redirect.match(url):
+                # If the URI is encoded as part of the redirect,
+                # we need to decode it to be a valid URL
+                new_url = _decode_uri(match.group(1))
+
+                # If the redirection URI does not have a scheme,
+                # we borrow the scheme from its parent URL
+                scheme = ""
+                if not util.URL_REGEX.match(new_url):
+                    original_scheme = urllib.parse.urlparse(url).scheme
+                    scheme = f"{original_scheme}://"
+
+                return f"{scheme}{new_url}"
+
+        return url
+
+    def redirection_for(self, url: str) -> str | None:
+        """
+        Returns the first redirection pattern which matches the URL, if any
+        """
+        for redirect in self.redirections:
+            if redirect.match(url):
+                return redirect.pattern
+        return None
+
+    def clean(self, url: str) -> str:
+        """
+        Strips the URL completely of any tracking data per the rules defined by
+        this provider
+        """
+        return self.redirect(self.strip_params(url))
+
+    def has_trackers(self, url: str) -> bool:
+        """
+        Determines whether ``clean`` would change the URL, without building the
+        cleaned URL
+        """
+        if self.raw_rules_pattern and self.raw_rules_pattern.search(url):
+            return True
+        query = url.partition("#")[0].partition("?")[2]
+        if query and any(
+            (key := param.partition("=")[0])
+            and self.is_tracking_param(_decode_query_key(key))
+            for param in query.split("&")
+        ):
+            return True
+        return any(redirect.match(url) for redirect in self.redirections)
+
+    def __repr__(self) -> str:
+        return self.provider
+
+
+# Matches the authority of a URL, i.e. everything between the scheme and the path
+_URL_AUTHORITY_PATTERN = re.compile(r"[^:/?#]*://([^/?#]*)")
+_URL_AUTHORITY_DELIMITER_PATTERN = re.compile(r"[.@:]")
+
+# The pieces of a ClearURLs ``urlPattern`` which can precede its host,
+# e.g. ``^https?:\/\/(?:[a-z0-9-]+\.)*?``
+_URL_PATTERN_SCHEME = re.compile(r"\^?https\?:\\?/\\?/")
+_URL_PATTERN_SUBDOMAINS = re.compile(r"\((?:\?:)?[^()|]*\\\.\)(?:[*+]\??|\?)?")
+_URL_PATTERN_LABEL = re.compile(r"(?:[A-Za-z0-9]|\\?-)+")
+_URL_PATTERN_UNESCAPED_DOT = re.compile(r"\.[A-Za-z0-9]")
+_URL_PATTERN_OPTIONAL_QUANTIFIER = re.compile(r"[?*]|\{0*[,}]")
+
+
+def _url_authority(url: str) -> str | None:
+    """
+    Returns the lowercased authority of a URL, or ``None`` if it does not have one
+    """
+    if authority := _URL_AUTHORITY_PATTERN.match(url):
+        return authority.group(1).lower()
+    return None
+
+
+def _leading_host_label(pattern: str) -> str | None:
+    """
+    Finds the literal host label at the start of ``pattern``, if it is guaranteed to
+    be a complete label of any host which the pattern matches.
+    """
+    if not (match := _URL_PATTERN_LABEL.match(pattern)):
+        return None
+    label = match.group().replace("\\", "").lower()
+    rest = pattern[match.end() :]
+
+    # An unescaped "." between two labels matches any character, but in a host it is
+    # always intended to be a literal dot
+    if rest.startswith("\\.") or _URL_PATTERN_UNESCAPED_DOT.match(rest):
+        return label
+
+    # e.g. amazon(?:\.[a-z]{2,}){1,}
+    if rest.startswith("(?:\\."):
+        group_end = syntax.find_group_end(rest, 0)
+        if group_end != -1 and not _URL_PATTERN_OPTIONAL_QUANTIFIER.match(
+            rest, group_end + 1
+        ):
+            return label
+    return None
+
+
+def _host_index_keys(url_pattern: str) -> list[str] | None:
+    """
+    Determines the host labels under which a provider with the given ``urlPattern``
+    should be indexed. A URL can only match the pattern if its host contains at least
+    one of these labels.
+
+    Returns ``None`` if the pattern is not anchored to a specific host.
+    """
+    if not (scheme := _URL_PATTERN_SCHEME.match(url_pattern)):
+        return None
+    host_pattern = url_pattern[scheme.end() :]
+
+    # Skip over any subdomains, so long as they are delimited from the host by a dot
+    if subdomains := _URL_PATTERN_SUBDOMAINS.match(host_pattern):
+        host_pattern = host_pattern[subdomains.end() :]
+
+    # e.g. (?:yandex(?:\.[a-z]{2,}){1,}|ya\.ru)
+    if host_pattern.startswith("(?:"):
+        group_end = syntax.find_group_end(host_pattern, 0)
+        if group_end == -1 or _URL_PATTERN_OPTIONAL_QUANTIFIER.match(
+            host_pattern, group_end + 1
+        ):
+            return None
+        alternatives = syntax.split_alternatives(host_pattern[3:group_end])
+    else:
+        alternatives = [host_pattern]
+
+    keys = []
+    for alternative in alternatives:
+        if (label := _leading_host_label(alternative)) is None:
+            return None
+        keys.append(label)
+    return keys
+
+
+class ProviderIndex:
+    """
+    An ordered collection of ``ClearURLsProvider`` objects, indexed by the host labels
+    which their URL patterns are anchored to.
+
+    Nearly every ClearURLs ``urlPattern`` is anchored to a domain, so only the
+    providers indexed under one of a URL's host labels, plus the few "global"
+    providers which could not be indexed, need to be tested against that URL.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[ClearURLsProvider],
+        fingerprints: Mapping[str, bytes] | None = None,
+    ) -> None:
+        self._providers = tuple(providers)
+        # A fingerprint of the raw JSON each provider was built from, by name, so that
+        # unchanged providers can be reused when the rules are refreshed without
+        # keeping the JSON itself around
+        self._fingerprints = dict(fingerprints or {})
+        self._providers_by_name = {
+            provider.provider: provider for provider in self._providers
+        }
+        global_positions: list[int] = []
+        positions_by_label: dict[str, list[int]] = {}
+
+        for position, provider in enumerate(self._providers):
+            keys = _host_index_keys(provider.url_pattern.pattern)
+            if keys is None:
+                global_positions.append(position)
+                continue
+            for key in keys:
+                positions_by_label.setdefault(key, []).append(position)
+
+        # The index lives as long as its providers, so it is kept in tuples, which
+        # are smaller than the lists it was built in
+        self._global_positions = tuple(global_positions)
+        self._positions_by_label = {
+            label: tuple(positions) for label, positions in positions_by_label.items()
+        }
+
+    def candidates(self, url: str) -> list[ClearURLsProvider]:
+        """
+        Returns the providers which could possibly match ``url``, in their original
+        order.
+        """
+        return self.candidates_for_authority(_url_authority(url))
+
+    def candidates_for_authority(
+        self, authority: str | None
+    ) -> list[ClearURLsProvider]:
+        """
+        Returns the providers which could possibly match any URL with the given
+        authority, as returned by ``_url_authority``, in their original order.
+        """
+        positions = set(self._global_positions)
+        if authority is not None:
+            # Splitting on every delimiter in the authority means that user info and
+            # ports can only ever produce extra candidates, never hide one
+            for label in _URL_AUTHORITY_DELIMITER_PATTERN.split(authority):
+                positions.update(self._positions_by_label.get(label, ()))
+
+        return [self._providers[position] for position in sorted(positions)]
+
+    def reusable_provider(
+        self, name: str, fingerprint: bytes
+    ) -> ClearURLsProvider | None:
+        """
+        Returns the provider named ``name`` if it was built from JSON with exactly the
+        same ``fingerprint``, as returned by ``_provider_fingerprint``, or ``None`` if
+        it has to be built again
+        """
+        if self._fingerprints.get(name) != fingerprint:
+            return None
+        return self._providers_by_name.get(name)
+
+    @property
+    def names(self) -> set[str]:
+        """
+        The names of every provider in the index
+        """
+        return set(self._providers_by_name)
+
+    @property
+    def compiled_count(self) -> int:
+        """
+        The number of providers which have compiled their patterns, because they
+        matched at least one URL
+        """
+        return sum(provider.compiled for provider in self._providers)
+
+    @property
+    def global_providers(self) -> list[ClearURLsProvider]:
+        """
+        The providers which are tested against every URL
+        """
+        return [self._providers[position] for position in self._global_positions]
+
+    def __iter__(self) -> Iterator[ClearURLsProvider]:
+        return iter(self._providers)
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+
+# The most redirects which are followed from a single URL
+_MAX_REDIRECT_HOPS = 8
+
+
+def _clean_hop(
+    url: str,
+    candidates: Sequence[ClearURLsProvider],
+    start: int,
+    deadline: int | None,
+    registry: metrics.MetricsRegistry | None,
+) -> tuple[str, bool]:
+    """
+    Cleans the URL with all providers whose patterns match it, and records what each
+    provider did, and how long it took, in the metrics ``registry`` if there is one.
+    Returns the cleaned URL, and whether any provider redirected it.
+
+    If cleaning goes past the ``deadline``, the URL is returned as cleaned so far.
+    The deadline is checked between providers, since a regex cannot be interrupted
+    part way through.
+    """
+    dirty_url = url
+    redirected = False
+    for provider in candidates:
+        provider_metrics = (
+            registry.provider(provider.provider) if registry is not None else None
+        )
+        if provider.matches(dirty_url):
+            url, removed = provider.strip_params_counted(url)
+            redirected_url = provider.redirect(url)
+            # Redirecting returns the URL itself when no redirection matches it
+            provider_redirected = redirected_url is not url
+            if provider_redirected:
+                url = redirected_url
+                redirected = True
+            if provider_metrics is not None:
+                provider_metrics.matched += 1
+                provider_metrics.params_removed += removed
+                provider_metrics.redirects += provider_redirected
+
+        end = time.perf_counter_ns()
+        if provider_metrics is not None:
+            provider_metrics.latency.observe(end - start)
+        start = end
+        if deadline is not None and end > deadline:
+            log.warning(
+                f"ClearURLs provider {provider} exceeded the time budget of "
+                f"{config.clearurls_url_time_budget} while cleaning {dirty_url}, "
+                "using the partially cleaned URL"
+            )
+            break
+    return url, redirected
+
+
+def _follow_redirect(hops: list[str], url: str) -> bool:
+    """
+    Determines whether a URL which the last of ``hops`` was redirected to should be
+    cleaned in turn. Redirect loops, and chains of too many redirects, are cut short.
+    """
+    if url == hops[-1]:
+        return False
+    if url in hops:
+        log.warning(f"ClearURLs redirects from {hops[0]} loop back to {url}")
+        return False
+    if len(hops) > _MAX_REDIRECT_HOPS:
+        log.warning(
+            f"ClearURLs redirects from {hops[0]} are more than "
+            f"{_MAX_REDIRECT_HOPS} hops long, stopping at {url}"
+        )
+        return False
+    return True
+
+
+@dataclass
+class ProviderExplanation:
+    """
+    Describes what a single provider whose URL pattern matched did to a URL
+    """
+
+    provider: str
+    # The index of the redirect hop which the provider cleaned
+    hop: int = 0
+    # The exception pattern which stopped the provider from cleaning the URL
+    vetoed_by: str | None = None
+    # Each part of the URL which was removed, with the raw rule which removed it
+    removed_raw: list[tuple[str, str]] = field(default_factory=list)
+    # Each query parameter which was removed, with the rule which removed it
+    removed_params: list[tuple[str, str]] = field(default_factory=list)
+    # The redirection pattern which was followed, and the URL it led to
+    redirection: str | None = None
+    redirected_url: str | None = None
+    match_ns: int = 0
+    strip_ns: int = 0
+    redirect_ns: int = 0
+
+
+@dataclass
+class Explanation:
+    """
+    Describes how a URL was cleaned, step by step
+    """
+
+    dirty_url: str
+    clean_url: str
+    # The URL cleaned by each hop, starting with the dirty URL and followed by each
+    # URL that it was redirected to
+    hops: list[str]
+    # Number of providers which were looked up for every hop, matching or not
+    candidates: int
+    lookup_ns: int
+    providers: list[ProviderExplanation]
+    total_ns: int
+
+
+def _explain_provider(
+    provider: ClearURLsProvider, dirty_url: str, url: str, hop: int
+) -> tuple[ProviderExplanation, str]:
+    """
+    Cleans the URL with a single provider as ``_clean_hop`` does, and describes what
+    happened. Returns the description and the cleaned URL.
+    """
+    explanation = ProviderExplanation(provider.provider, hop)
+
+    start = time.perf_counter_ns()
+    explanation.vetoed_by = provider.matching_exception(dirty_url)
+    explanation.match_ns = time.perf_counter_ns() - start
+    if explanation.vetoed_by is not None:
+        return explanation, url
+
+    start = time.perf_counter_ns()
+    stripped_url = provider.strip_params(url)
+    explanation.strip_ns = time.perf_counter_ns() - start
+    if stripped_url is not url:
+        explanation.removed_raw = provider.matching_raw_rules(url)
+        if provider.raw_rules_pattern is not None:
+            url = provider.raw_rules_pattern.sub("", url)
+        query = url.partition("#")[0].partition("?")[2]
+        for param in query.split("&"):
+            key = _decode_query_key(param.partition("=")[0])
+            if key and (rule := provider.matching_rule(key)) is not None:
+                explanation.removed_params.append((key, rule))
+
+    start = time.perf_counter_ns()
+    redirected_url = provider.redirect(stripped_url)
+    explanation.redirect_ns = time.perf_counter_ns() - start
+    if redirected_url is not stripped_url:
+        explanation.redirection = provider.redirection_for(stripped_url)
+        explanation.redirected_url = redirected_url
+
+    return explanation, redirected_url
+
+
+# Stands in for the load time of rules which have never been loaded
+_NEVER = datetime.fromtimestamp(0.0, tz=UTC)
+
+
+@dataclass(frozen=True)
+class _RulesFile:
+    """
+    The providers of a local rules file, as of its modification time
+    """
+
+    path: pathlib.Path
+    # ``None`` if the file could not be read, in which case it has no providers
+    mtime_ns: int | None
+    checksum: str
+    # Providers which are mapped to ``None`` are removed from the rules below them
+    providers: dict[str, dict[str, Any] | None]
+
+
+@dataclass(frozen=True)
+class ClearURLsEngine:
+    """
+    An immutable snapshot of a set of ClearURLs rules, compiled and ready to clean URLs.
+
+    Refreshing the rules publishes a new engine, rather than modifying the current one,
+    so a caller which holds on to an engine sees consistent rules for as long as it
+    needs them. Several engines can also be used side by side, e.g. to compare rules.
+    """
+
+    providers: ProviderIndex
+    # Checksum of all the rules which the providers were built from, which keeps the
+    # results of different engines apart in the result cache
+    checksum: str = ""
+    loaded_at: datetime = _NEVER
+    # Checksum of the downloaded rules alone, and the rules themselves, so that the
+    # engine can be rebuilt when only the rules files change
+    rules_checksum: str = ""
+    rules: str = field(default="", repr=False)
+    rules_files: tuple[_RulesFile, ...] = ()
+
+    def _clean_url(
+        self,
+        dirty_url: str,
+        candidates: Sequence[ClearURLsProvider],
+        cached: bool = True,
+    ) -> tuple[str, bool]:
+        """
+        Cleans the URL with the given candidate providers, and then cleans each URL that
+        it is redirected to with the providers for that URL, until it is not redirected
+        any further. e.g. once a Google redirect is unwrapped, the URL inside it is
+        cleaned by the providers for its own host.
+
+        Every hop of a chain cleans to the same URL, so each of them is cached, and a
+        chain which reaches a cached hop stops there. Cleaning stops with the URL as
+        cleaned so far if it takes longer than the configured time budget. If
+        ``cached`` is false, the result cache, the time budget and the metrics are
+        not used.
+
+        Returns the cleaned URL, and whether it was cleaned within the time budget.
+        URLs which were only partially cleaned must not be cached.
+        """
+        budget = config.clearurls_url_time_budget if cached else None
+        start = time.perf_counter_ns()
+        deadline = start + int(budget.total_seconds() * 1e9) if budget else None
+        result_cache = get_result_cache() if cached else None
+        registry = metrics.registry if cached else None
+
+        hops = [dirty_url]
+        url, redirected = _clean_hop(dirty_url, candidates, start, deadline, registry)
+        while redirected and _follow_redirect(hops, url):
+            if deadline is not None and time.perf_counter_ns() > deadline:
+                break
+            if (
+                result_cache is not None
+                and (clean_url := result_cache.get((self.checksum, url))) is not None
+            ):
+                url, redirected = clean_url, False
+                break
+            hops.append(url)
+            url, redirected = _clean_hop(
+                url,
+                self.providers.candidates(url),
+                time.perf_counter_ns(),
+                deadline,
+                registry,
+            )
+
+        within_budget = deadline is None or time.perf_counter_ns() <= deadline
+        # Chains which were cut short would not clean to the same URL from every hop
+        if (
+            result_cache is not None
+            and len(hops) > 1
+            and not redirected
+            and within_budget
+        ):
+            for hop in hops[1:]:
+                result_cache.put((self.checksum, hop), url)
+        return url, within_budget
+
+    def strip_trackers(self, dirty_url: str) -> str:
+        """
+        Cleans a URL of all tracking metadata. Cleans tracking parameters and performs
+        redirects in-place to prevent sharing traffic with affiliates.
+        """
+        start = time.perf_counter_ns()
+        dirty_url = dirty_url.strip()
+        if not self.providers:
+            raise exception.MemebotInternalError(
+                f"Failed to strip tracking params from {dirty_url}: "
+                "No ClearURLs providers"
+            )
+
+        # The checksum is part of the key, so results from other rules are never reused
+        result_cache = get_result_cache()
+        cache_key = (self.checksum, dirty_url)
+        if (clean_url := result_cache.get(cache_key)) is None:
+            clean_url, within_budget = self._clean_url(
+                dirty_url, self.providers.candidates(dirty_url)
+            )
+            if within_budget:
+                result_cache.put(cache_key, clean_url)
+
+        metrics.registry.call("strip_trackers").observe(time.perf_counter_ns() - start)
+        return clean_url
+
+    def clean(self, dirty_url: str) -> str:
+        """
+        Cleans a URL as ``strip_trackers`` does, but without the result cache, the
+        time budget or the metrics, so that engines can be compared on equal terms
+        without counting the comparison as traffic, and so that threads can share the
+        engine.
+        """
+        dirty_url = dirty_url.strip()
+        clean_url, _ = self._clean_url(
+            dirty_url, self.providers.candidates(dirty_url), cached=False
+        )
+        return clean_url
+
+    def find_dirty_urls(self, text: str) -> list[str]:
+        """
+        Finds the URLs in a piece of text which have tracking metadata, e.g. in a chat
+        message. Most text has no URLs at all, so it is filtered in stages which get
+        more expensive: a substring check for ``http``, a lookup of the candidate
+        providers for each URL, and a check of whether any of those providers would
+        remove anything from it. No URL is actually cleaned.
+        """
+        if "http" not in text:
+            return []
+        return [
+            url
+            for url in dict.fromkeys(util.URL_REGEX.findall(text))
+            if any(
+                # Exceptions are only tested once the provider has found something
+                # to remove, since some providers have a great many of them
+                provider.url_pattern.match(url)
+                and provider.has_trackers(url)
+                and provider.matches(url)
+                for provider in self.providers.candidates(url)
+            )
+        ]
+
+    def strip_trackers_many(self, dirty_urls: Iterable[str]) -> list[str]:
+        """
+        Cleans many URLs of all tracking metadata, as ``strip_trackers`` does.
+        Returns the cleaned URLs in the same order as ``dirty_urls``.
+
+        URLs are grouped by their authority, so that the candidate providers are only
+        looked up once per group.
+        """
+        start = time.perf_counter_ns()
+        dirty_urls = [dirty_url.strip() for dirty_url in dirty_urls]
+        if not self.providers:
+            raise exception.MemebotInternalError(
+                f"Failed to strip tracking params from {dirty_urls}: "
+                "No ClearURLs providers"
+            )
+
+        result_cache = get_result_cache()
+        clean_urls: dict[str, str] = {}
+        urls_by_authority: dict[str | None, list[str]] = {}
+        for dirty_url in dict.fromkeys(dirty_urls):
+            if (clean_url := result_cache.get((self.checksum, dirty_url))) is not None:
+                clean_urls[dirty_url] = clean_url
+            else:
+                urls_by_authority.setdefault(_url_authority(dirty_url), []).append(
+                    dirty_url
+                )
+
+        for authority, group in urls_by_authority.items():
+            candidates = self.providers.candidates_for_authority(authority)
+            for dirty_url in group:
+                clean_url, within_budget = self._clean_url(dirty_url, candidates)
+                clean_urls[dirty_url] = clean_url
+                if within_budget:
+                    result_cache.put((self.checksum, dirty_url), clean_url)
+
+        metrics.registry.call("strip_trackers_many").observe(
+            time.perf_counter_ns() - start
+        )
+        return [clean_urls[dirty_url] for dirty_url in dirty_urls]
+
+    def explain(self, dirty_url: str) -> Explanation:
+        """
+        Cleans a URL as ``strip_trackers`` does, and describes which providers matched
+        it, what each of them did and how long each step took.
+
+        Results are neither cached nor recorded in the metrics, and the time budget is
+        not applied, so that every step is shown.
+        """
+        start = time.perf_counter_ns()
+        dirty_url = dirty_url.strip()
+        if not self.providers:
+            raise exception.MemebotInternalError(
+                f"Failed to explain cleaning {dirty_url}: No ClearURLs providers"
+            )
+
+        hops = [dirty_url]
+        candidate_count = 0
+        lookup_ns = 0
+        providers = []
+        while True:
+            hop_url = url = hops[-1]
+            lookup_start = time.perf_counter_ns()
+            candidates = self.providers.candidates(hop_url)
+            lookup_ns += time.perf_counter_ns() - lookup_start
+            candidate_count += len(candidates)
+
+            redirected = False
+            for provider in candidates:
+                if provider.url_pattern.match(hop_url):
+                    explanation, url = _explain_provider(
+                        provider, hop_url, url, len(hops) - 1
+                    )
+                    providers.append(explanation)
+                    redirected |= explanation.redirected_url is not None
+
+            if not (redirected and _follow_redirect(hops, url)):
+                break
+            hops.append(url)
+
+        return Explanation(
+            dirty_url=dirty_url,
+            clean_url=url,
+            hops=hops,
+            candidates=candidate_count,
+            lookup_ns=lookup_ns,
+            providers=providers,
+            total_ns=time.perf_counter_ns() - start,
+        )
+
+
+# The engine which is currently used to clean URLs. It is only ever replaced as a
+# whole, so readers should take a single reference to it for each request.
+engine = ClearURLsEngine(ProviderIndex([]))
+
+# When the rules were last downloaded, or found to be unchanged
+rules_last_download: datetime = _NEVER
+# Validators for conditional requests, as sent by the rules host
+rules_etag: str | None = None
+rules_last_modified: str | None = None
+
+# How long downloading the rules may stall before it fails, so that a hung connection
+# cannot hold up the refreshes and rules file reloads which wait for it
+_DOWNLOAD_TIMEOUT = timedelta(seconds=30)
+
+_SNAPSHOT_RULES_FILE = "rules.json"
+_SNAPSHOT_METADATA_FILE = "rules.meta.json"
+
+
+def _compute_rules_checksum(rules: str) -> str:
+    return hashlib.sha256(rules.encode()).hexdigest()
+
+
+def _write_file_atomically(path: pathlib.Path, data: str) -> None:
+    """
+    Writes to a temporary file first, so that ``path`` is never left half-written
+    """
+    temp_path = path.with_name(f"{path.name}.tmp")
+    temp_path.write_text(data)
+    temp_path.replace(path)
+
+
+def _save_rules_snapshot(rules_url: str, rules: str) -> None:
+    """
+    Persists the rules and their metadata to the cache directory, so that they can
+    be loaded by ``_load_rules_snapshot`` after a restart
+    """
+    metadata = {
+        "url": rules_url,
+        "checksum": _compute_rules_checksum(rules),
+        "etag": rules_etag,
+        "last_modified": rules_last_modified,
+        "downloaded": rules_last_download.isoformat(),
+    }
+    try:
+        config.clearurls_cache_dir.mkdir(parents=True, exist_ok=True)
+        _write_file_atomically(config.clearurls_cache_dir / _SNAPSHOT_RULES_FILE, rules)
+        # The metadata is written last, so it never describes rules that weren't saved
+        _write_file_atomically(
+            config.clearurls_cache_dir / _SNAPSHOT_METADATA_FILE, json.dumps(metadata)
+        )
+    except OSError as e:
+        log.warning(f"Failed to save ClearURLs rules snapshot: {e}")
+
+
+def _save_rules_download_time(rules_url: str) -> None:
+    """
+    Updates the download time of an existing snapshot, without rewriting its rules
+    """
+    metadata_path = config.clearurls_cache_dir / _SNAPSHOT_METADATA_FILE
+    try:
+        metadata = json.loads(metadata_path.read_text())
+        if metadata.get("url") != rules_url:
+            return
+        metadata["downloaded"] = rules_last_download.isoformat()
+        _write_file_atomically(metadata_path, json.dumps(metadata))
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to update ClearURLs rules snapshot: {e}")
+
+
+def _load_rules_snapshot(rules_url: str) -> str:
+    """
+    Loads the rules saved by ``_save_rules_snapshot``, and restores the last download
+    timestamp and conditional request validators that go with them.
+
+    If there is no usable snapshot for ``rules_url``, just returns an empty string
+    """
+    try:
+        metadata = json.loads(
+            (config.clearurls_cache_dir / _SNAPSHOT_METADATA_FILE).read_text()
+        )
+        rules = (config.clearurls_cache_dir / _SNAPSHOT_RULES_FILE).read_text()
+    except FileNotFoundError:
+        return ""
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to read ClearURLs rules snapshot: {e}")
+        return ""
+
+    if not util.validate_type(metadata, dict[str, str | None]):
+        log.warning(f"Malformed ClearURLs rules snapshot metadata: {metadata}")
+        return ""
+    if metadata.get("url") != rules_url:
+        log.info("Ignoring ClearURLs rules snapshot for a different URL")
+        return ""
+    if metadata.get("checksum") != _compute_rules_checksum(rules):
+        log.warning("Ignoring corrupt ClearURLs rules snapshot")
+        return ""
+
+    global rules_last_download
+    global rules_etag
+    global rules_last_modified
+    try:
+        rules_last_download = datetime.fromisoformat(metadata["downloaded"] or "")
+    except (KeyError, ValueError) as e:
+        log.warning(f"Malformed ClearURLs rules snapshot metadata: {e}")
+        return ""
+    rules_etag = metadata.get("etag")
+    rules_last_modified = metadata.get("last_modified")
+
+    log.info(f"Loaded ClearURLs rules snapshot from {rules_last_download}")
+    return rules
+
+
+def _forget_rules() -> None:
+    """
+    Forgets the conditional request validators of the current rules, so that the next
+    download fetches them in full
+    """
+    global rules_etag
+    global rules_last_modified
+    rules_etag = None
+    rules_last_modified = None
+
+
+def _request_rules(rules_url: str) -> str | None:
+    """
+    Requests the rules file from ``rules_url``, and updates the last download timestamp
+    and conditional request validators if any rules are received.
+
+    Once there are current rules, the request is conditional on the rules having
+    changed since the last download, so unchanged rules cost a single "304 Not
+    Modified" response.
+
+    Returns ``None`` if the rules have not been modified, or an empty string if the
+    response was empty
+    """
+    global rules_last_download
+    global rules_etag
+    global rules_last_modified
+
+    log.info("Downloading ClearURLs rules...")
+    headers = {}
+    # Without any current rules, "304 Not Modified" would leave nothing to build
+    if engine.rules:
+        if rules_etag:
+            headers["If-None-Match"] = rules_etag
+        if rules_last_modified:
+            headers["If-Modified-Since"] = rules_last_modified
+
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(rules_url, headers=headers),
+            timeout=_DOWNLOAD_TIMEOUT.total_seconds(),
+        ) as manifest:
+            data = cast(str, manifest.read().strip().decode())
+            etag = manifest.headers.get("ETag")
+            last_modified = manifest.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code != http.HTTPStatus.NOT_MODIFIED:
+            raise e
+        log.info("ClearURLs rules have not changed")
+        rules_last_download = datetime.now(UTC)
+        return None
+
+    if not data:
+        log.warning("Did not resolve any data from ClearURLs")
+        return ""
+
+    rules_last_download = datetime.now(UTC)
+    rules_etag = etag
+    rules_last_modified = last_modified
+    return data
+
+
+def _download_new_rules(rules_url: str) -> str:
+    """
+    Downloads the rules file from the configured URL, updates the last download
+    timestamp, and saves the data to the snapshot if it differs from the rules of the
+    current engine.
+
+    If there is no new data, just returns an empty string
+    """
+    data = _request_rules(rules_url)
+    if data is None:
+        _save_rules_download_time(rules_url)
+        return ""
+    if not data:
+        return ""
+
+    if _compute_rules_checksum(data) == engine.rules_checksum:
+        _save_rules_download_time(rules_url)
+        return ""
+
+    _save_rules_snapshot(rules_url, data)
+    return data
+
+
+def _rules_file_paths() -> list[pathlib.Path]:
+    """
+    Returns the paths of the rules files, in the order in which they are merged
+    """
+    return [_CUSTOM_RULES_FILE, *config.clearurls_rules_files]
+
+
+def _read_rules_file(path: pathlib.Path, previous: _RulesFile | None) -> _RulesFile:
+    """
+    Reads the providers of a rules file, unless it has not been modified since it was
+    read as ``previous``. A file which cannot be read, e.g. because it is missing, is
+    skipped, so that it does not hold back the rules and the other files.
+    """
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+        if previous is not None and previous.mtime_ns == mtime_ns:
+            return previous
+        rules = path.read_text()
+    except OSError as e:
+        if previous is None or previous.mtime_ns is not None:
+            log.warning(f"Skipping unreadable ClearURLs rules file {path}: {e}")
+        return _RulesFile(path, None, "", {})
+
+    try:
+        providers = json.loads(rules).get("providers")
+    except (json.JSONDecodeError, AttributeError) as e:
+        raise exception.MemebotInternalError(
+            f"Malformed ClearURLs rules file {path}: {e}"
+        ) from e
+    if not isinstance(providers, dict) or not all(
+        isinstance(provider_data, dict | None) for provider_data in providers.values()
+    ):
+        raise exception.MemebotInternalError(
+            f"Malformed ClearURLs rules file {path}: "
+            'Expected an object of providers under "providers"'
+        )
+
+    log.info(f"Read {len(providers)} ClearURLs providers from {path}")
+    return _RulesFile(path, mtime_ns, _compute_rules_checksum(rules), providers)
+
+
+def _read_rules_files(previous: Sequence[_RulesFile] = ()) -> tuple[_RulesFile, ...]:
+    """
+    Reads every rules file, reusing those in ``previous`` which have not been modified
+    """
+    previous_by_path = {rules_file.path: rules_file for rules_file in previous}
+    return tuple(
+        _read_rules_file(path, previous_by_path.get(path))
+        for path in _rules_file_paths()
+    )
+
+
+def _rules_files_signature() -> tuple[tuple[pathlib.Path, int | None], ...]:
+    """
+    Identifies the current version of every rules file by its modification time,
+    which is ``None`` if the file cannot be read
+    """
+    signature = []
+    for path in _rules_file_paths():
+        try:
+            mtime_ns: int | None = path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        signature.append((path, mtime_ns))
+    return tuple(signature)
+
+
+def _compute_engine_checksum(
+    rules_checksum: str, rules_files: Sequence[_RulesFile]
+) -> str:
+    if not rules_files:
+        return rules_checksum
+    return _compute_rules_checksum(
+        "\n".join(
+            [rules_checksum, *(rules_file.checksum for rules_file in rules_files)]
+        )
+    )
+
+
+@dataclass
+class _ProviderSchema:
+    @staticmethod
+    def _validate_list_str(data: Sequence[str] | None, error_message: str) -> None:
+        if (
+            data is not None
+            and type(data) is not list
+            and not all(type(pattern) is str for pattern in data)
+        ):
+            raise TypeError(error_message)
+
+    def __post_init__(self) -> None:
+        """
+        Performs type validation on a newly constructed object.
+        Raises ``TypeError`` for any invalid data
+        """
+        if type(self.url_pattern) is not str:
+            raise TypeError(f"{self.url_pattern=}")
+        _ProviderSchema._validate_list_str(self.rules, f"{self.rules=}")
+        _ProviderSchema._validate_list_str(self.raw_rules, f"{self.raw_rules=}")
+        _ProviderSchema._validate_list_str(
+            self.referral_marketing, f"{self.referral_marketing=}"
+        )
+        _ProviderSchema._validate_list_str(self.redirections, f"{self.redirections=}")
+        _ProviderSchema._validate_list_str(self.exceptions, f"{self.exceptions=}")
+
+    url_pattern: str
+    rules: list[str] | None = None
+    raw_rules: list[str] | None = None
+    referral_marketing: list[str] | None = None
+    redirections: list[str] | None = None
+    exceptions: list[str] | None = None
+
+
+def _provider_fingerprint(provider_data: object) -> bytes:
+    return hashlib.sha256(json.dumps(provider_data, sort_keys=True).encode()).digest()
+
+
+def _json_to_provider(
+    provider: str,
+    provider_data: Mapping[str, str | Sequence[str]],
+    interner: _Interner | None = None,
+) -> ClearURLsProvider | None:
+    """
+    Maps raw provider JSON data to a ``ClearURLsProvider`` object.
+    Validates the ``provider_data`` before converting.
+    """
+
+    try:
+        # These types are ignored because they are validated manually at runtime
+        validated_data = _ProviderSchema(
+            url_pattern=provider_data.get("urlPattern"),  # type: ignore[arg-type]
+            rules=provider_data.get("rules"),  # type: ignore[arg-type]
+            raw_rules=provider_data.get("rawRules"),  # type: ignore[arg-type]
+            referral_marketing=provider_data.get("referralMarketing"),  # type: ignore[arg-type]
+            redirections=provider_data.get("redirections"),  # type: ignore[arg-type]
+            exceptions=provider_data.get("exceptions"),  # type: ignore[arg-type]
+        )
+    except TypeError as e:
+        log.exception(f"ClearURLs provider {provider} failed validation", exc_info=e)
+        return None
+
+    if syntax.has_catastrophic_backtracking(validated_data.url_pattern):
+        log.warning(
+            f"Quarantined ClearURLs provider {provider}, whose URL pattern "
+            f"{validated_data.url_pattern!r} could backtrack catastrophically"
+        )
+        return None
+
+    return ClearURLsProvider(
+        provider,
+        validated_data.url_pattern,
+        validated_data.rules,
+        validated_data.raw_rules,
+        validated_data.referral_marketing,
+        validated_data.redirections,
+        validated_data.exceptions,
+        interner,
+    )
+
+
+def _convert_rules_to_providers(
+    rules: str,
+    previous: ProviderIndex | None = None,
+    rules_files: Sequence[_RulesFile] = (),
+) -> ProviderIndex:
+    """
+    Converts the raw block of JSON rules into a ``ProviderIndex`` of
+    ``ClearURLsProvider`` objects.
+
+    Creates one ``ClearURLsProvider`` for each key under the top-level "providers" entry
+    in the provided JSON, and in each of ``rules_files`` in order. A provider in a rules
+    file replaces the provider of the same name from the rules before it, or removes it
+    if it is ``null``. The rules may be empty, if every provider is in the rules files.
+    Providers in ``previous`` whose JSON has not changed are reused, rather than
+    validated and compiled again. The new providers share their patterns with each
+    other through a single ``_Interner``.
+    """
+    log.info("Resolving ClearURLs providers...")
+    all_providers: dict[str, Any] = {}
+    if rules:
+        try:
+            all_providers = json.loads(rules).get("providers")
+        except json.JSONDecodeError as e:
+            raise exception.MemebotInternalError(
+                f"Malformed ClearURLs manifest: {rules}"
+            ) from e
+
+        if not all_providers:
+            raise exception.MemebotInternalError(
+                f"Malformed ClearURLs manifest: {rules}"
+            )
+
+    for rules_file in rules_files:
+        for name, provider_data in rules_file.providers.items():
+            if provider_data is None:
+                all_providers.pop(name, None)
+            else:
+                all_providers[name] = provider_data
+    if not all_providers:
+        raise exception.MemebotInternalError("No ClearURLs providers in any rules")
+
+    previous = previous or ProviderIndex([])
+    interner = _Interner()
+    resolved_providers = []
+    fingerprints = {}
+    reused = 0
+    for name in all_providers:
+        provider_data = all_providers[name]
+        fingerprint = _provider_fingerprint(provider_data)
+        if new_provider := previous.reusable_provider(name, fingerprint):
+            reused += 1
+        else:
+            new_provider = _json_to_provider(name, provider_data, interner)
+
+        if new_provider:
+            resolved_providers.append(new_provider)
+            fingerprints[name] = fingerprint
+
+    interner.finish_refresh()
+    index = ProviderIndex(resolved_providers, fingerprints)
+    log.info(
+        f"Reused {reused}, rebuilt {len(index) - reused} and dropped "
+        f"{len(previous.names - index.names)} ClearURLs providers"
+    )
+    log.info(
+        f"Indexed {len(index) - len(index.global_providers)} ClearURLs providers "
+        f"by host, {len(index.global_providers)} are global"
+    )
+    return index
+
+
+# How long to wait before retrying a failed refresh
+_REFRESH_RETRY_DELAY = timedelta(minutes=5)
+# How often the rules files are checked for changes
+_RULES_FILES_POLL_INTERVAL = timedelta(seconds=5)
+
+_refresh_task: asyncio.Task[bool] | None = None
+_background_refresh_task: asyncio.Task[bool] | None = None
+_rules_files_watch_task: asyncio.Task[None] | None = None
+# Held while a new engine is built and published, so that an engine built from new
+# rules files cannot be replaced by one which was built from the old ones
+_rebuild_lock = asyncio.Lock()
+_metrics_summary_task: asyncio.Task[None] | None = None
+
+
+type _RulesCollection = pymongo.collection.Collection[dict[str, Any]]
+
+# The collection in which replicas share the rules, with one document per rules URL
+_SHARED_RULES_COLLECTION = "clearurls_rules"
+# How long a replica may take to fetch the rules before another one may try
+_SHARED_RULES_FETCH_LEASE = timedelta(minutes=5)
+# How often replicas check for rules which were fetched by another replica
+_SHARED_RULES_POLL_INTERVAL = timedelta(minutes=1)
+# Identifies this process among the replicas sharing the rules
+_REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _acquire_fetch_lease(collection: _RulesCollection, rules_url: str) -> bool:
+    """
+    Tries to become the only replica which fetches the rules from ``rules_url``,
+    until the lease expires
+    """
+    now = datetime.now(UTC)
+    try:
+        collection.update_one(
+            {
+                "_id": rules_url,
+                "$or": [
+                    {"lease_expires": {"$exists": False}},
+                    {"lease_expires": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "lease_owner": _REPLICA_ID,
+                    "lease_expires": now + _SHARED_RULES_FETCH_LEASE,
+                }
+            },
+            upsert=True,
+        )
+    except pymongo.errors.DuplicateKeyError:
+        # The document exists, but another replica holds the lease
+        return False
+    return True
+
+
+def _release_fetch_lease(collection: _RulesCollection, rules_url: str) -> None:
+    collection.update_one(
+        {"_id": rules_url, "lease_owner": _REPLICA_ID},
+        {"$unset": {"lease_owner": "", "lease_expires": ""}},
+    )
+
+
+def _fetch_shared_rules(
+    collection: _RulesCollection,
+    rules_url: str,
+    shared: Mapping[str, Any] | None,
+) -> ClearURLsEngine | None:
+    """
+    Downloads the rules on behalf of every replica. If they have changed, builds a new
+    engine from them and then shares them, so that only rules which could be built
+    are ever shared. Rules which could not be built, e.g. because they failed the
+    canary evaluation, are recorded as refused instead.
+    """
+    global rules_etag
+    global rules_last_modified
+
+    # Unchanged rules cost a single "304 Not Modified" response for every replica
+    shared = shared or {}
+    shared_checksum = shared.get("checksum")
+    rules_etag = shared.get("etag") if shared_checksum else None
+    rules_last_modified = shared.get("last_modified") if shared_checksum else None
+
+    data = _request_rules(rules_url)
+    metadata = {
+        "etag": rules_etag,
+        "last_modified": rules_last_modified,
+        "downloaded": rules_last_download.isoformat(),
+    }
+    if data == "":
+        return None
+    checksum = _compute_rules_checksum(data) if data else None
+    if data is None or checksum == shared_checksum:
+        collection.update_one({"_id": rules_url}, {"$set": metadata})
+        return None
+
+    try:
+        new_engine = _build_engine(data, checksum)
+    except Exception:
+        # The rules were downloaded all the same, so that they are not downloaded and
+        # evaluated again until they are due. Building them forgot their validators,
+        # so that they are then downloaded in full.
+        collection.update_one(
+            {"_id": rules_url},
+            {
+                "$set": {
+                    "etag": None,
+                    "last_modified": None,
+                    "downloaded": rules_last_download.isoformat(),
+                    "refused_checksum": checksum,
+                }
+            },
+            upsert=True,
+        )
+        _release_fetch_lease(collection, rules_url)
+        raise
+    _save_rules_snapshot(rules_url, data)
+    collection.update_one(
+        {"_id": rules_url},
+        {"$set": metadata | {"rules": data, "checksum": checksum}},
+        upsert=True,
+    )
+    log.info("Shared new ClearURLs rules with other replicas")
+    return new_engine
+
+
+def _load_shared_engine(
+    collection: _RulesCollection, rules_url: str
+) -> ClearURLsEngine | None:
+    """
+    Builds a new engine from the rules shared by the replicas, if they differ from
+    the current engine's. If the shared rules are due for a refresh, one replica
+    downloads them for everyone.
+    """
+    global rules_last_download
+    global rules_etag
+    global rules_last_modified
+
+    # The rules themselves are only read when they have changed
+    shared = collection.find_one({"_id": rules_url}, {"rules": False})
+    downloaded = (
+        datetime.fromisoformat(shared["downloaded"])
+        if shared and shared.get("downloaded")
+        else _NEVER
+    )
+    if downloaded + config.clearurls_rules_refresh_hours <= datetime.now(
+        UTC
+    ) and _acquire_fetch_lease(collection, rules_url):
+        # If the download fails, the lease is only released once it expires, so that
+        # the other replicas do not retry any sooner than this one would
+        new_engine = _fetch_shared_rules(collection, rules_url, shared)
+        _release_fetch_lease(collection, rules_url)
+        if new_engine:
+            return new_engine
+        shared = collection.find_one({"_id": rules_url}, {"rules": False})
+
+    if not shared or not shared.get("checksum"):
+        log.info("Waiting for another replica to share ClearURLs rules")
+        return None
+    rules_last_download = datetime.fromisoformat(shared["downloaded"])
+    if shared["checksum"] == engine.rules_checksum:
+        return None
+
+    document = collection.find_one({"_id": rules_url, "checksum": shared["checksum"]})
+    if not document:
+        # The rules changed again since they were polled
+        return None
+    log.info("Loading ClearURLs rules shared by another replica")
+    new_engine = _build_engine(document["rules"], document["checksum"])
+    rules_etag = document.get("etag")
+    rules_last_modified = document.get("last_modified")
+    _save_rules_snapshot(rules_url, document["rules"])
+    return new_engine
+
+
+def _evaluate_canary(new_engine: ClearURLsEngine) -> None:
+    """
+    Cleans the canary corpus with the current engine and the new one, and refuses the
+    new engine if it cleans too many of the URLs differently, or cleans them too much
+    slower. The first engine has nothing to be compared with, so it is never refused.
+    """
+    if not engine.providers:
+        return
+    corpus = canary.load_corpus(config.clearurls_canary_corpus)
+    if not corpus:
+        return
+    report = canary.evaluate(corpus, engine.clean, new_engine.clean)
+    if refusal := report.refusal(
+        config.clearurls_canary_max_changed_percent,
+        config.clearurls_canary_max_slowdown_percent,
+    ):
+        log.warning(report.summary())
+        raise exception.MemebotInternalError(
+            f"Refused to publish new ClearURLs rules: {refusal}"
+        )
+    log.info(report.summary())
+
+
+def _build_engine(rules: str, checksum: str | None = None) -> ClearURLsEngine:
+    """
+    Builds a new engine from the rules and the rules files, reusing any unchanged
+    providers and rules files of the current engine. The checksum of the rules is
+    computed, unless it is already known.
+
+    If the rules differ from the current engine's, the new engine has to pass the
+    canary evaluation first. Changes to the rules files alone are published as they
+    are, since they are made locally.
+    """
+    rules_checksum = checksum or _compute_rules_checksum(rules)
+    try:
+        rules_files = _read_rules_files(engine.rules_files)
+        new_engine = ClearURLsEngine(
+            _convert_rules_to_providers(rules, engine.providers, rules_files),
+            _compute_engine_checksum(rules_checksum, rules_files),
+            datetime.now(UTC),
+            rules_checksum,
+            rules,
+            rules_files,
+        )
+        if rules_checksum != engine.rules_checksum:
+            _evaluate_canary(new_engine)
+    except Exception:
+        # Make sure that these rules are downloaded in full next time
+        _forget_rules()
+        raise
+    return new_engine
+
+
+def _load_rules_files_engine() -> ClearURLsEngine | None:
+    """
+    Rebuilds the current engine with the current rules files, if any of them have
+    changed since it was built. Without a rules URL, the first engine is built from
+    the rules files alone.
+    This blocks, so it should not be run on the event loop.
+    """
+    if not engine.providers and config.clearurls_rules_url:
+        # The rules files are read along with the rules once they are downloaded
+        return None
+    if engine.providers and _rules_files_signature() == tuple(
+        (rules_file.path, rules_file.mtime_ns) for rules_file in engine.rules_files
+    ):
+        return None
+    return _build_engine(engine.rules, engine.rules_checksum)
+
+
+def _load_new_engine() -> ClearURLsEngine | None:
+    """
+    Fetches the rules and builds a new engine from them, if they have changed.
+    The rules are shared with other replicas through the database when it is enabled,
+    and downloaded directly otherwise. Without a rules URL, only the rules files are
+    used.
+    This blocks, so it should not be run on the event loop.
+    """
+    if not config.clearurls_rules_url:
+        return _load_rules_files_engine()
+
+    if (collection := db.get_collection(_SHARED_RULES_COLLECTION)) is not None:
+        try:
+            return _load_shared_engine(collection, config.clearurls_rules_url)
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"Failed to use shared ClearURLs rules, downloading them: {e}")
+
+    new_rules = _download_new_rules(config.clearurls_rules_url)
+    if not new_rules:
+        return None
+    try:
+        return _build_engine(new_rules)
+    except exception.MemebotInternalError:
+        # Keep the current rules in the snapshot, so that rules which were refused
+        # are not loaded after a restart either
+        if engine.rules:
+            _save_rules_snapshot(config.clearurls_rules_url, engine.rules)
+        raise
+
+
+def _load_snapshot_engine() -> ClearURLsEngine | None:
+    """
+    Builds an engine from the rules snapshot, if there is one.
+    This blocks, so it should not be run on the event loop.
+    """
+    rules = _load_rules_snapshot(config.clearurls_rules_url)
+    if not rules:
+        return None
+    try:
+        return _build_engine(rules)
+    except exception.MemebotInternalError as e:
+        log.warning(f"Failed to load ClearURLs rules snapshot: {e}")
+        return None
+
+
+@functools.cache
+def get_result_cache() -> cache.LRUCache[tuple[str, str], str]:
+    """
+    Returns the cache of ``strip_trackers`` results, which is keyed by the rules
+    checksum and the URL
+    """
+    return cache.LRUCache(config.clearurls_result_cache_size)
+
+
+def _publish_engine(new_engine: ClearURLsEngine) -> None:
+    """
+    Swaps in a new engine with a single assignment, so requests are served by either
+    the old rules or the new rules, never a mix of both.
+    """
+    global engine
+    old_engine = engine
+    engine = new_engine
+    log.info(
+        f"{old_engine.providers.compiled_count} of {len(old_engine.providers)} "
+        "ClearURLs providers matched a URL and compiled their patterns"
+    )
+
+    result_cache = get_result_cache()
+    log.info(f"Clearing ClearURLs result cache: {result_cache.stats}")
+    result_cache.clear()
+
+
+async def _refresh_providers() -> bool:
+    try:
+        async with _rebuild_lock:
+            new_engine = await asyncio.to_thread(_load_new_engine)
+            if new_engine:
+                _publish_engine(new_engine)
+    except (OSError, exception.MemebotInternalError) as e:
+        # If we don't have any providers from a previous run,
+        # we can't proceed further
+        if not engine.providers:
+            raise e
+        log.warning(f"Failed to refresh ClearURLs rules: {e}")
+        return False
+
+    log.info("Done refreshing providers.")
+    return True
+
+
+async def refresh_providers() -> bool:
+    """
+    Refreshes the ClearURLs providers without blocking the event loop. Requests
+    continue to be served by the current providers until the new ones are ready.
+    Returns whether the refresh succeeded, if there were providers to keep when it
+    failed.
+
+    Concurrent calls share a single in-flight refresh.
+    """
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_providers())
+    return await asyncio.shield(_refresh_task)
+
+
+async def _load_providers_from_snapshot() -> None:
+    if engine.providers:
+        return
+    try:
+        snapshot_engine = await asyncio.to_thread(_load_snapshot_engine)
+    except Exception as e:
+        log.exception("Failed to load ClearURLs rules snapshot", exc_info=e)
+        return
+    # A refresh may have finished first, in which case its providers are newer
+    if snapshot_engine and not engine.providers:
+        _publish_engine(snapshot_engine)
+
+
+async def _refresh_providers_periodically() -> None:
+    await _load_providers_from_snapshot()
+    while True:
+        if engine.providers:
+            if not config.clearurls_rules_url:
+                # There are no rules to download, and the rules files are watched
+                # separately
+                return
+            next_refresh = rules_last_download + config.clearurls_rules_refresh_hours
+            if config.database_enabled:
+                # Rules may be fetched by another replica at any time
+                next_refresh = min(
+                    next_refresh, datetime.now(UTC) + _SHARED_RULES_POLL_INTERVAL
+                )
+            await asyncio.sleep((next_refresh - datetime.now(UTC)).total_seconds())
+        try:
+            refreshed = await refresh_providers()
+        except Exception as e:
+            log.exception("Failed to refresh ClearURLs providers", exc_info=e)
+            await asyncio.sleep(_REFRESH_RETRY_DELAY.total_seconds())
+            continue
+        if not engine.providers:
+            # Nothing was loaded, such as when the rules were empty, or when
+            # another replica is still fetching the rules which are shared
+            log.warning("Refreshing ClearURLs rules did not load any providers")
+            retry_delay = (
+                _SHARED_RULES_POLL_INTERVAL
+                if config.database_enabled
+                else _REFRESH_RETRY_DELAY
+            )
+            await asyncio.sleep(retry_delay.total_seconds())
+        elif not refreshed:
+            # The current providers are kept, and the rules are still due, so the
+            # refresh would otherwise be retried straight away
+            await asyncio.sleep(_REFRESH_RETRY_DELAY.total_seconds())
+
+
+async def reload_rules_files() -> None:
+    """
+    Rebuilds the current engine with the rules files if any of them have changed,
+    without blocking the event loop. Only the providers which changed are compiled
+    again.
+    """
+    try:
+        async with _rebuild_lock:
+            new_engine = await asyncio.to_thread(_load_rules_files_engine)
+            if new_engine:
+                _publish_engine(new_engine)
+    except (OSError, exception.MemebotInternalError) as e:
+        log.warning(f"Failed to reload ClearURLs rules files: {e}")
+
+
+async def _watch_rules_files() -> None:
+    """
+    Polls the modification times of the rules files, and reloads them when they
+    change. Each change is only reloaded once, even if the reload fails, until the
+    files change again.
+    """
+    last_signature = _rules_files_signature()
+    while True:
+        await asyncio.sleep(_RULES_FILES_POLL_INTERVAL.total_seconds())
+        signature = _rules_files_signature()
+        if signature != last_signature:
+            last_signature = signature
+            await reload_rules_files()
+
+
+def start_background_refresh() -> None:
+    """
+    Starts refreshing the ClearURLs providers in the background. Providers are loaded
+    from the rules snapshot first, if there is one, and then refreshed whenever they
+    are older than the configured interval, or whenever a rules file changes. Does
+    nothing if the refresh is already running.
+    """
+    global _background_refresh_task
+    global _rules_files_watch_task
+    if _background_refresh_task is None or _background_refresh_task.done():
+        _background_refresh_task = asyncio.create_task(
+            _refresh_providers_periodically()
+        )
+    if _rules_files_watch_task is None or _rules_files_watch_task.done():
+        _rules_files_watch_task = asyncio.create_task(_watch_rules_files())
+
+
+async def _log_metrics_periodically() -> None:
+    while True:
+        await asyncio.sleep(config.clearurls_metrics_interval.total_seconds())
+        log.info(metrics.registry.summary())
+
+
+def start_metrics_summary() -> None:
+    """
+    Starts logging a summary of the ClearURLs metrics at the configured interval.
+    Does nothing if the interval is 0, or if the summary is already running.
+    """
+    global _metrics_summary_task
+    if not config.clearurls_metrics_interval:
+        return
+    if _metrics_summary_task is None or _metrics_summary_task.done():
+        _metrics_summary_task = asyncio.create_task(_log_metrics_periodically())
+
+
+def strip_trackers(dirty_url: str) -> str:
+    """
+    Cleans a URL of all tracking metadata with the current ``engine``
+    """
+    return engine.strip_trackers(dirty_url)
+
+
+def strip_trackers_many(dirty_urls: Iterable[str]) -> list[str]:
+    """
+    Cleans many URLs of all tracking metadata with the current ``engine``
+    """
+    return engine.strip_trackers_many(dirty_urls)
+
+
+def find_dirty_urls(text: str) -> list[str]:
+    """
+    Finds the URLs in a piece of text which the current ``engine`` would clean
+    """
+    return engine.find_dirty_urls(text)
+
+
+def explain(dirty_url: str) -> Explanation:
+    """
+    Describes how the current ``engine`` cleans a URL, step by step
+    """
+    return engine.explain(dirty_url)
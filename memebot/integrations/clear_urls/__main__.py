@@ -0,0 +1,166 @@
+"""
+Cleans URLs of tracking metadata offline, without running the bot.
+
+Reads one URL per line from the given files, or from stdin, and writes one cleaned URL
+per line to stdout, in the same order:
+
+    $ python -m memebot.integrations.clear_urls --rules data.minify.json urls.txt
+
+Providers from ``--rules-file`` are merged on top of the rules, so changes to them
+can be tried out on a list of URLs before they are deployed.
+
+With more than one job, URLs are cleaned by the workers of
+``memebot.integrations.clear_urls.workers``.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import fileinput
+import itertools
+import logging
+import os
+import pathlib
+import sys
+from collections.abc import Iterable, Iterator, Sequence
+from typing import TextIO
+
+from memebot.integrations import clear_urls
+from memebot.integrations.clear_urls import workers
+
+
+def _load_providers(rules: str) -> None:
+    clear_urls._publish_engine(clear_urls._build_engine(rules))
+
+
+def _strip_batch(urls: list[str]) -> list[str]:
+    return clear_urls.strip_trackers_many(urls)
+
+
+def _batched(lines: Iterable[str], batch_size: int) -> Iterator[list[str]]:
+    iterator = iter(lines)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def _write_batch(output: TextIO, dirty_urls: list[str], clean_urls: list[str]) -> None:
+    # Blank lines are passed through, so that output lines match input lines
+    output.writelines(
+        f"{clean_url if dirty_url else ''}\n"
+        for dirty_url, clean_url in zip(dirty_urls, clean_urls, strict=True)
+    )
+
+
+def clean_stream(
+    lines: Iterable[str],
+    output: TextIO,
+    rules: str,
+    jobs: int = 1,
+    batch_size: int = 1000,
+    worker_kind: workers.WorkerKind | None = None,
+) -> None:
+    """
+    Cleans each line of ``lines`` as a URL, and writes the results to ``output`` in
+    the same order.
+
+    With more than one job, batches of URLs are cleaned in parallel by a pool of
+    workers of the given kind, or the default kind for this build of Python. Only a
+    few batches are in flight at a time, so arbitrarily large inputs can be streamed.
+    """
+    dirty_urls = (line.strip() for line in lines)
+
+    # Threads share these providers, and other workers compile their own
+    _load_providers(rules)
+    if jobs <= 1:
+        for batch in _batched(dirty_urls, batch_size):
+            _write_batch(output, batch, _strip_batch(batch))
+        return
+
+    with workers.create_executor(jobs, rules, worker_kind) as executor:
+        pending: collections.deque[
+            tuple[list[str], concurrent.futures.Future[list[str]]]
+        ] = collections.deque()
+        for batch in _batched(dirty_urls, batch_size):
+            pending.append((batch, executor.submit(workers.strip_batch, batch)))
+            # Keep every worker busy, without reading the whole input into memory
+            if len(pending) >= jobs * 2:
+                batch, result = pending.popleft()
+                _write_batch(output, batch, result.result())
+        while pending:
+            batch, result = pending.popleft()
+            _write_batch(output, batch, result.result())
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m memebot.integrations.clear_urls",
+        description="Clean URLs of tracking metadata with ClearURLs rules",
+    )
+    parser.add_argument(
+        "files",
+        help="Files containing one URL per line. Reads from stdin if none are given",
+        nargs="*",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--rules",
+        help="Path to a ClearURLs rules file",
+        required=True,
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "--rules-file",
+        help="Path to a rules file whose providers replace those of the same name in "
+        "the rules. Can be given several times, and is merged in order",
+        action="append",
+        default=[],
+        dest="rules_files",
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of workers to clean URLs with. 0 uses one per CPU core "
+        "(default: 1)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Kind of workers to clean URLs with. Defaults to threads on free-threaded "
+        "builds of Python, and to processes otherwise",
+        choices=workers.WORKER_KINDS,
+        dest="worker_kind",
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Number of URLs to send to a worker at a time (default: 1000)",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "--log-level",
+        help="Set logging level (default: WARNING)",
+        default=logging.getLevelName(logging.WARNING),
+        type=str,
+    )
+    args = parser.parse_args(argv)
+
+    # Memebot's logging redirects stdout, so hold on to the real one first
+    output = sys.stdout
+    workers.configure_worker(args.log_level, args.rules_files)
+
+    jobs = args.jobs or os.cpu_count() or 1
+    with fileinput.input(args.files) as lines:
+        clean_stream(
+            lines,
+            output,
+            args.rules.read_text(),
+            jobs,
+            args.batch_size,
+            args.worker_kind,
+        )
+
+
+if __name__ == "__main__":
+    main()
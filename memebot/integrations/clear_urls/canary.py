@@ -0,0 +1,182 @@
+"""
+Evaluates new ClearURLs rules against a golden corpus of URLs before they are
+published. Every URL is cleaned with both the current rules and the new rules, and the
+report shows which URLs would be cleaned differently, and how the time taken to clean
+each URL compares, so that a bad release of the rules can be refused.
+"""
+
+import pathlib
+import sys
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+# The corpus which is used unless another one is configured
+BUILTIN_CORPUS = pathlib.Path(__file__).with_name("canary_corpus.txt")
+# Each URL is timed this many times with each set of rules, and the fastest time is
+# kept, so that a single slow run does not count as a regression
+_TIMING_ROUNDS = 5
+
+
+def load_corpus(path: pathlib.Path | None = None) -> list[str]:
+    """
+    Reads a corpus of URLs, one per line, skipping blank lines and comments which start
+    with ``#``. Reads the built-in corpus if no path is given.
+    """
+    with (path or BUILTIN_CORPUS).open() as corpus:
+        lines = (line.strip() for line in corpus)
+        return list(dict.fromkeys(line for line in lines if line and line[0] != "#"))
+
+
+@dataclass(frozen=True)
+class CanaryChange:
+    """
+    A URL which the new rules clean differently from the current rules
+    """
+
+    url: str
+    current_url: str
+    candidate_url: str
+
+
+@dataclass(frozen=True)
+class CanaryTiming:
+    """
+    The fastest time taken to clean a URL with the current rules and the new rules
+    """
+
+    url: str
+    current_ns: int
+    candidate_ns: int
+
+
+@dataclass(frozen=True)
+class CanaryReport:
+    """
+    Compares how the current rules and the new rules clean the corpus
+    """
+
+    changes: list[CanaryChange]
+    timings: list[CanaryTiming]
+
+    @property
+    def changed_percent(self) -> float:
+        return len(self.changes) / len(self.timings) * 100 if self.timings else 0.0
+
+    @property
+    def current_ns(self) -> int:
+        return sum(timing.current_ns for timing in self.timings)
+
+    @property
+    def candidate_ns(self) -> int:
+        return sum(timing.candidate_ns for timing in self.timings)
+
+    @property
+    def slowdown_percent(self) -> float:
+        """
+        How much longer the new rules take to clean the whole corpus, as a percentage
+        of the time taken by the current rules. Negative if they are faster.
+        """
+        if not self.current_ns:
+            return 0.0
+        return (self.candidate_ns / self.current_ns - 1) * 100
+
+    def refusal(self, max_changed_percent: float, max_slowdown_percent: float) -> str:
+        """
+        Describes why the new rules should not be published, or returns an empty string
+        if they are within both thresholds
+        """
+        reasons = []
+        if self.changed_percent > max_changed_percent:
+            reasons.append(
+                f"{self.changed_percent:.1f}% of the canary URLs are cleaned "
+                f"differently, over the threshold of {max_changed_percent:g}%"
+            )
+        if self.slowdown_percent > max_slowdown_percent:
+            reasons.append(
+                f"the canary URLs are cleaned {self.slowdown_percent:.1f}% slower, "
+                f"over the threshold of {max_slowdown_percent:g}%"
+            )
+        return " and ".join(reasons)
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Describes the outcome, the ``top`` changed URLs as a diff, and the ``top`` URLs
+        whose cleaning slowed down the most
+        """
+        lines = [
+            (
+                f"ClearURLs canary on {len(self.timings)} URLs: "
+                f"{len(self.changes)} cleaned differently "
+                f"({self.changed_percent:.1f}%), cleaned in "
+                f"{self.current_ns / 1e3:.0f}us with the current rules and "
+                f"{self.candidate_ns / 1e3:.0f}us with the new rules "
+                f"({self.slowdown_percent:+.1f}%)"
+            )
+        ]
+        for change in self.changes[:top]:
+            lines += [
+                f"  {change.url}",
+                f"    - {change.current_url}",
+                f"    + {change.candidate_url}",
+            ]
+        if len(self.changes) > top:
+            lines.append(f"  ... and {len(self.changes) - top} more")
+
+        slowest = sorted(
+            self.timings,
+            key=lambda timing: timing.candidate_ns - timing.current_ns,
+            reverse=True,
+        )[:top]
+        lines += [
+            f"  {timing.current_ns / 1e3:.1f}us -> {timing.candidate_ns / 1e3:.1f}us "
+            f"{timing.url}"
+            for timing in slowest
+            if timing.candidate_ns > timing.current_ns
+        ]
+        return "\n".join(lines)
+
+
+def _time_ns(clean: Callable[[str], str], url: str) -> int:
+    start = time.perf_counter_ns()
+    clean(url)
+    return time.perf_counter_ns() - start
+
+
+def evaluate(
+    corpus: Iterable[str],
+    clean_current: Callable[[str], str],
+    clean_candidate: Callable[[str], str],
+) -> CanaryReport:
+    """
+    Cleans every URL in the corpus with both ``clean_current`` and ``clean_candidate``,
+    which should neither cache their results nor stop early.
+
+    The outputs are compared on a first pass, which also compiles the patterns of any
+    providers which match the corpus, so that compiling them is not timed.
+    """
+    changes = []
+    urls = list(corpus)
+    for url in urls:
+        current_url = clean_current(url)
+        candidate_url = clean_candidate(url)
+        if current_url != candidate_url:
+            changes.append(CanaryChange(url, current_url, candidate_url))
+
+    current_ns = [sys.maxsize] * len(urls)
+    candidate_ns = [sys.maxsize] * len(urls)
+    for _ in range(_TIMING_ROUNDS):
+        # Alternated, so that both sets of rules see the same conditions on average
+        for i, url in enumerate(urls):
+            current_ns[i] = min(current_ns[i], _time_ns(clean_current, url))
+            candidate_ns[i] = min(candidate_ns[i], _time_ns(clean_candidate, url))
+
+    return CanaryReport(
+        changes,
+        [
+            CanaryTiming(url, current, candidate)
+            for url, current, candidate in zip(
+                urls, current_ns, candidate_ns, strict=True
+            )
+        ],
+    )
@@ -0,0 +1,118 @@
+"""
+Counters and latency histograms describing how the ClearURLs providers behave on the
+URLs they clean. They are kept in the in-process ``registry``, which can be read at
+any time, and is summarized in the log periodically.
+"""
+
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+
+# Bucket ``i`` counts latencies below ``2 ** i`` microseconds, up to about 1 second.
+# The last bucket counts everything slower than that.
+_BUCKET_COUNT = 22
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Counts latencies in buckets whose bounds double, from 1 microsecond up
+    """
+
+    count: int = 0
+    total_ns: int = 0
+    buckets: list[int] = field(default_factory=lambda: [0] * _BUCKET_COUNT)
+
+    def observe(self, elapsed_ns: int) -> None:
+        self.count += 1
+        self.total_ns += elapsed_ns
+        self.buckets[min((elapsed_ns // 1000).bit_length(), _BUCKET_COUNT - 1)] += 1
+
+    @property
+    def mean_us(self) -> float:
+        return self.total_ns / self.count / 1e3 if self.count else 0.0
+
+    def quantile_us(self, q: float) -> float:
+        """
+        Returns the upper bound, in microseconds, of the bucket which holds the
+        latency at quantile ``q``. Latencies beyond the last bucket are reported as
+        infinite.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets[:-1]):
+            seen += bucket
+            if seen >= rank:
+                return float(2**i)
+        return float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"count={self.count} mean={self.mean_us:.1f}us "
+            f"p50<{self.quantile_us(0.5):.0f}us p99<{self.quantile_us(0.99):.0f}us"
+        )
+
+
+@dataclass
+class ProviderMetrics:
+    """
+    Describes how a single provider behaved on the URLs it was a candidate for.
+    Its latency includes matching the URL, as well as cleaning it when it matched.
+    """
+
+    matched: int = 0
+    # Including the parts of URLs removed by raw rules
+    params_removed: int = 0
+    redirects: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class MetricsRegistry:
+    """
+    Collects the metrics of each provider by name, and the latency of each public
+    cleaning call by the name of the call
+    """
+
+    def __init__(self) -> None:
+        self.since = datetime.now(UTC)
+        self.providers: dict[str, ProviderMetrics] = {}
+        self.calls: dict[str, LatencyHistogram] = {}
+
+    def provider(self, name: str) -> ProviderMetrics:
+        if (metrics := self.providers.get(name)) is None:
+            metrics = self.providers[name] = ProviderMetrics()
+        return metrics
+
+    def call(self, name: str) -> LatencyHistogram:
+        if (histogram := self.calls.get(name)) is None:
+            histogram = self.calls[name] = LatencyHistogram()
+        return histogram
+
+    def reset(self) -> None:
+        self.since = datetime.now(UTC)
+        self.providers.clear()
+        self.calls.clear()
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Describes every call, and the ``top`` providers which took the most time
+        """
+        lines = [f"ClearURLs metrics since {self.since:%Y-%m-%d %H:%M:%S}:"]
+        lines += [f"  {name}: {histogram}" for name, histogram in self.calls.items()]
+        slowest = sorted(
+            self.providers.items(),
+            key=lambda item: item[1].latency.total_ns,
+            reverse=True,
+        )[:top]
+        lines += [
+            f"  provider {name}: matched={metrics.matched} "
+            f"params_removed={metrics.params_removed} redirects={metrics.redirects} "
+            f"{metrics.latency}"
+            for name, metrics in slowest
+        ]
+        return "\n".join(lines)
+
+
+# The metrics of every engine in this process
+registry = MetricsRegistry()
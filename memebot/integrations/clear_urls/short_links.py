@@ -0,0 +1,179 @@
+"""
+Expands short links, such as t.co and bit.ly links, into the URLs which they redirect
+to, so that the trackers hidden behind them can be removed. Redirects are followed with
+HEAD requests, for only as long as they lead to other short links.
+
+Expanded links are cached, and concurrent expansions of the same link share a single
+chain of requests, so popular short links are only expanded once.
+"""
+
+import asyncio
+import functools
+import http
+import urllib.parse
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import aiohttp
+
+from memebot import config, log
+from memebot.lib import cache
+
+# The most redirects which are followed from a single short link
+_MAX_HOPS = 5
+# The most requests which are in flight to a single host at a time
+_MAX_REQUESTS_PER_HOST = 4
+# How long a single request may take. Expansions which outlast the budget keep going
+# in the background until then, so that their result is cached for next time.
+_REQUEST_TIMEOUT = timedelta(seconds=10)
+_EXPANSION_CACHE_SIZE = 4096
+_EXPANSION_TTL = timedelta(hours=24)
+
+_REDIRECT_STATUSES = frozenset(
+    {
+        http.HTTPStatus.MOVED_PERMANENTLY,
+        http.HTTPStatus.FOUND,
+        http.HTTPStatus.SEE_OTHER,
+        http.HTTPStatus.TEMPORARY_REDIRECT,
+        http.HTTPStatus.PERMANENT_REDIRECT,
+    }
+)
+
+
+@dataclass
+class _Expander:
+    """
+    The HTTP session and concurrency state of the event loop which expands links.
+    It is created on first use, since the session has to be created on the loop.
+    """
+
+    loop: asyncio.AbstractEventLoop
+    session: aiohttp.ClientSession
+    # Caps the requests to each host, by host
+    host_limits: dict[str, asyncio.Semaphore] = field(default_factory=dict)
+    # The expansion of each short link which is in progress, by short link
+    in_flight: dict[str, asyncio.Task[str]] = field(default_factory=dict)
+
+
+_expander: _Expander | None = None
+
+
+@functools.cache
+def get_expansion_cache() -> cache.LRUCache[str, str]:
+    """
+    Returns the cache of expanded short links, keyed by each link in the chain of
+    redirects that led to the expanded URL
+    """
+    return cache.LRUCache(_EXPANSION_CACHE_SIZE, _EXPANSION_TTL)
+
+
+def _host(url: str) -> str | None:
+    try:
+        return urllib.parse.urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+def is_short_link(url: str) -> bool:
+    """
+    Determines if a URL is on one of the configured link shortener hosts
+    """
+    return _host(url) in config.clearurls_short_link_hosts
+
+
+def _get_expander() -> _Expander:
+    global _expander
+    loop = asyncio.get_running_loop()
+    if _expander is None or _expander.loop is not loop or _expander.session.closed:
+        _expander = _Expander(loop, aiohttp.ClientSession())
+    return _expander
+
+
+async def close() -> None:
+    """
+    Closes the HTTP session used to expand links, if there is one
+    """
+    global _expander
+    if _expander is not None:
+        await _expander.session.close()
+        _expander = None
+
+
+async def _follow_redirects(expander: _Expander, short_link: str) -> str:
+    """
+    Follows the redirects from ``short_link`` for as long as they lead to other short
+    links, and caches the URL they lead to for every link along the way. If a request
+    fails, returns the URL reached so far, without caching it.
+    """
+    hops = [short_link]
+    url = short_link
+    try:
+        while is_short_link(url) and len(hops) <= _MAX_HOPS:
+            host = _host(url) or ""
+            if (limit := expander.host_limits.get(host)) is None:
+                limit = expander.host_limits[host] = asyncio.Semaphore(
+                    _MAX_REQUESTS_PER_HOST
+                )
+            async with (
+                limit,
+                asyncio.timeout(_REQUEST_TIMEOUT.total_seconds()),
+                expander.session.head(url, allow_redirects=False) as response,
+            ):
+                response.raise_for_status()
+                location = response.headers.get("Location")
+                if response.status not in _REDIRECT_STATUSES or not location:
+                    break
+            url = urllib.parse.urljoin(url, location)
+            if url in hops:
+                log.warning(f"Short link {short_link} redirects in a loop at {url}")
+                break
+            hops.append(url)
+    except (aiohttp.ClientError, TimeoutError) as e:
+        log.warning(f"Failed to expand short link {short_link} at {url}: {e!r}")
+        return url
+
+    if len(hops) > _MAX_HOPS:
+        log.warning(
+            f"Short link {short_link} redirects more than {_MAX_HOPS} times, "
+            f"stopping at {url}"
+        )
+    expansion_cache = get_expansion_cache()
+    for hop in hops:
+        expansion_cache.put(hop, url)
+    return url
+
+
+async def expand(url: str) -> str:
+    """
+    Expands a short link into the URL which it redirects to. Other URLs are returned
+    as they are, and so are short links which cannot be expanded within the
+    configured budget, although their expansion carries on in the background.
+    """
+    budget = config.clearurls_short_link_budget
+    if not budget or not is_short_link(url):
+        return url
+    if (expanded := get_expansion_cache().get(url)) is not None:
+        return expanded
+
+    expander = _get_expander()
+    if (task := expander.in_flight.get(url)) is None:
+        task = expander.in_flight[url] = asyncio.create_task(
+            _follow_redirects(expander, url)
+        )
+        task.add_done_callback(lambda _: expander.in_flight.pop(url, None))
+
+    try:
+        async with asyncio.timeout(budget.total_seconds()):
+            # Shielded, so that the expansion is cached even if this caller gives up
+            return await asyncio.shield(task)
+    except TimeoutError:
+        log.info(f"Expanding short link {url} took longer than {budget}, skipping it")
+        return url
+
+
+async def expand_many(urls: Iterable[str]) -> list[str]:
+    """
+    Expands many short links concurrently, within a single budget
+    """
+    return list(await asyncio.gather(*(expand(url) for url in urls)))
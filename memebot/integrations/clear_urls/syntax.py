@@ -0,0 +1,393 @@
+"""
+Helpers for reading the source of regex patterns without compiling them
+"""
+
+import re
+import string
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+
+def find_class_end(pattern: str, start: int) -> int:
+    """
+    Finds the index of the bracket closing the character class opened at ``start``.
+    Returns the end of the pattern if the class is never closed.
+    """
+    i = start + 1
+    while i < len(pattern):
+        match pattern[i]:
+            case "\\":
+                i += 1
+            case "]" if i > start + 1:
+                return i
+        i += 1
+    return len(pattern)
+
+
+def find_group_end(pattern: str, start: int) -> int:
+    """
+    Finds the index of the parenthesis closing the group opened at ``start``.
+    Returns -1 if the group is never closed.
+    """
+    depth = 0
+    i = start
+    while i < len(pattern):
+        match pattern[i]:
+            case "\\":
+                i += 1
+            case "[":
+                i = find_class_end(pattern, i)
+            case "(":
+                depth += 1
+            case ")":
+                depth -= 1
+                if depth == 0:
+                    return i
+        i += 1
+    return -1
+
+
+def split_alternatives(pattern: str) -> list[str]:
+    """
+    Splits a pattern on its top-level ``|`` operators
+    """
+    alternatives = []
+    depth = 0
+    last = 0
+    i = 0
+    while i < len(pattern):
+        match pattern[i]:
+            case "\\":
+                i += 1
+            case "[":
+                i = find_class_end(pattern, i)
+            case "(":
+                depth += 1
+            case ")":
+                depth -= 1
+            case "|" if depth == 0:
+                alternatives.append(pattern[last:i])
+                last = i + 1
+        i += 1
+    alternatives.append(pattern[last:])
+    return alternatives
+
+
+# The characters matched by each class escape, e.g. ``\d``
+_CLASS_ESCAPES = {
+    "d": frozenset(string.digits),
+    "w": frozenset(string.ascii_letters + string.digits + "_"),
+    "s": frozenset(string.whitespace),
+}
+_CHAR_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "f": "\f", "v": "\v"}
+_ZERO_WIDTH_ESCAPES = frozenset("bBAZ")
+_LOOKAROUND_PREFIXES = ("?=", "?!", "?<=", "?<!", "?#")
+_GROUP_PREFIX_PATTERN = re.compile(r"\?(?:P?<[^>=!]+>|[aiLmsux-]*:)")
+_FLAGS_GROUP_PATTERN = re.compile(r"\?[aiLmsux-]+$")
+_QUANTIFIER_PATTERN = re.compile(r"([*+?])|\{(\d*)(,?)(\d*)\}")
+_IGNORECASE_PATTERN = re.compile(r"\(\?[aiLmsux-]*i")
+# Character classes with ranges wider than this are treated as matching anything
+_MAX_RANGE = 256
+
+
+# A sequence of terms which must match one after another
+type _Sequence = list[_Term]
+
+
+@dataclass(frozen=True)
+class _CharSet:
+    """
+    A set of characters, which is every character but ``chars`` if ``negated``
+    """
+
+    chars: frozenset[str]
+    negated: bool = False
+
+
+def _union(a: _CharSet, b: _CharSet) -> _CharSet:
+    if not a.negated and not b.negated:
+        return _CharSet(a.chars | b.chars)
+    if a.negated and b.negated:
+        return _CharSet(a.chars & b.chars, True)
+    positive, negative = (b, a) if a.negated else (a, b)
+    return _CharSet(negative.chars - positive.chars, True)
+
+
+def _are_disjoint(a: _CharSet, b: _CharSet) -> bool:
+    if not a.negated and not b.negated:
+        return a.chars.isdisjoint(b.chars)
+    if a.negated and b.negated:
+        # Both sets contain every character which neither of them excludes
+        return False
+    positive, negative = (b, a) if a.negated else (a, b)
+    return positive.chars <= negative.chars
+
+
+def _union_all(char_sets: Iterable[_CharSet | None]) -> _CharSet | None:
+    """
+    Unites the sets, where ``None`` stands for any character
+    """
+    chars = _CharSet(frozenset())
+    for char_set in char_sets:
+        if char_set is None:
+            return None
+        chars = _union(chars, char_set)
+    return chars
+
+
+def _ignoring_case(a: _CharSet) -> _CharSet:
+    return _CharSet(a.chars | {char.swapcase() for char in a.chars}, a.negated)
+
+
+@dataclass
+class _Term:
+    """
+    A single atom or group of a pattern, along with its quantifier
+    """
+
+    # The characters which an atom can match, or ``None`` if it could be anything
+    chars: _CharSet | None
+    # The alternatives of a group, each of which is a sequence of terms
+    alternatives: list[_Sequence] = field(default_factory=list)
+    optional: bool = False
+    unbounded: bool = False
+
+
+def _class_chars(body: str) -> _CharSet | None:
+    """
+    Determines the characters matched by the body of a character class
+    """
+    negated = body.startswith("^")
+    if negated:
+        body = body[1:]
+
+    chars: set[str] = set()
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == "\\":
+            escape = body[i + 1 : i + 2]
+            i += 2
+            if escape in _CLASS_ESCAPES:
+                chars |= _CLASS_ESCAPES[escape]
+                continue
+            if escape.isalnum() and escape not in _CHAR_ESCAPES:
+                return None
+            char = _CHAR_ESCAPES.get(escape, escape)
+        else:
+            i += 1
+
+        if body[i : i + 1] == "-" and i + 1 < len(body) and body[i + 1] != "\\":
+            last = body[i + 1]
+            i += 2
+            if ord(last) - ord(char) > _MAX_RANGE:
+                return None
+            chars.update(chr(c) for c in range(ord(char), ord(last) + 1))
+        else:
+            chars.add(char)
+    return _CharSet(frozenset(chars), negated)
+
+
+def _parse_quantifier(pattern: str, i: int, term: _Term) -> int:
+    """
+    Applies the quantifier at ``i``, if there is one, to ``term``.
+    Returns the index after the quantifier.
+    """
+    if not (quantifier := _QUANTIFIER_PATTERN.match(pattern, i)):
+        return i
+    symbol, minimum, comma, maximum = quantifier.groups()
+    if symbol:
+        term.optional = symbol != "+"
+        term.unbounded = symbol != "?"
+    else:
+        term.optional = not int(minimum or 0)
+        term.unbounded = bool(comma) and not maximum
+    i = quantifier.end()
+    # Lazy and possessive quantifiers
+    if pattern[i : i + 1] in ("?", "+"):
+        i += 1
+    return i
+
+
+def _parse_sequence(pattern: str) -> _Sequence:
+    terms = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in "^$":
+            i += 1
+            continue
+
+        if char == "\\":
+            escape = pattern[i + 1 : i + 2]
+            i += 2
+            if escape in _ZERO_WIDTH_ESCAPES:
+                continue
+            if escape in _CLASS_ESCAPES:
+                term = _Term(_CharSet(_CLASS_ESCAPES[escape]))
+            elif escape.isalnum() and escape not in _CHAR_ESCAPES:
+                term = _Term(None)
+            else:
+                term = _Term(_CharSet(frozenset(_CHAR_ESCAPES.get(escape, escape))))
+        elif char == "[":
+            end = find_class_end(pattern, i)
+            term = _Term(_class_chars(pattern[i + 1 : end]))
+            i = end + 1
+        elif char == "(":
+            end = find_group_end(pattern, i)
+            if end == -1:
+                end = len(pattern)
+            body = pattern[i + 1 : end]
+            i = end + 1
+            if body.startswith(_LOOKAROUND_PREFIXES) or _FLAGS_GROUP_PATTERN.match(
+                body
+            ):
+                # Zero-width, so it cannot consume anything which another term could
+                i = _parse_quantifier(pattern, i, _Term(None))
+                continue
+            if prefix := _GROUP_PREFIX_PATTERN.match(body):
+                body = body[prefix.end() :]
+            term = _Term(
+                None,
+                [
+                    _parse_sequence(alternative)
+                    for alternative in split_alternatives(body)
+                ],
+            )
+        elif char == ".":
+            term = _Term(None)
+            i += 1
+        else:
+            term = _Term(_CharSet(frozenset(char)))
+            i += 1
+
+        i = _parse_quantifier(pattern, i, term)
+        terms.append(term)
+    return terms
+
+
+def _term_chars(term: _Term, ignore_case: bool) -> _CharSet | None:
+    """
+    Determines every character which a term could consume
+    """
+    if not term.alternatives:
+        if term.chars is None or not ignore_case:
+            return term.chars
+        return _ignoring_case(term.chars)
+
+    return _union_all(
+        _term_chars(inner, ignore_case)
+        for alternative in term.alternatives
+        for inner in alternative
+    )
+
+
+def _first_chars(terms: _Sequence, ignore_case: bool) -> tuple[_CharSet | None, bool]:
+    """
+    Determines every character which a sequence could start with, and whether it can
+    match the empty string
+    """
+    chars: _CharSet | None = _CharSet(frozenset())
+    for term in terms:
+        if term.alternatives:
+            firsts = [_first_chars(a, ignore_case) for a in term.alternatives]
+            term_chars = _union_all(first_chars for first_chars, _ in firsts)
+            nullable = term.optional or any(nullable for _, nullable in firsts)
+        else:
+            term_chars = _term_chars(term, ignore_case)
+            nullable = term.optional
+        chars = _union_all([chars, term_chars])
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def _has_overlapping_alternatives(term: _Term, ignore_case: bool) -> bool:
+    """
+    Determines if the alternatives of a group could start with the same character,
+    or if one of them can match the empty string, which is a prefix of any other,
+    e.g. ``(a|aa)+`` or ``(?:b|)+``
+    """
+    if len(term.alternatives) < 2:
+        return False
+    firsts = [
+        _first_chars(alternative, ignore_case) for alternative in term.alternatives
+    ]
+    for i, (chars, nullable) in enumerate(firsts):
+        if nullable:
+            return True
+        for other_chars, _ in firsts[i + 1 :]:
+            if (
+                chars is None
+                or other_chars is None
+                or not _are_disjoint(chars, other_chars)
+            ):
+                return True
+    return False
+
+
+def _contains_unbounded(term: _Term) -> bool:
+    return term.unbounded or any(
+        _contains_unbounded(inner)
+        for alternative in term.alternatives
+        for inner in alternative
+    )
+
+
+def _is_ambiguous_repeat(term: _Term, ignore_case: bool) -> bool:
+    """
+    Determines if an unbounded repeat of a group contains an unbounded term which is
+    not separated from its next repetition by a character it cannot consume itself,
+    e.g. ``(a+)+`` or ``(.*,)*``, or alternatives which overlap, e.g. ``(a|aa)+``.
+    Input which nearly matches such a group can be split between the repetitions in
+    exponentially many ways.
+    """
+    if _has_overlapping_alternatives(term, ignore_case):
+        return True
+    for alternative in term.alternatives:
+        for position, inner in enumerate(alternative):
+            if not _contains_unbounded(inner):
+                continue
+            inner_chars = _term_chars(inner, ignore_case)
+            separated = inner_chars is not None and any(
+                not other.optional
+                and (other_chars := _term_chars(other, ignore_case)) is not None
+                and _are_disjoint(inner_chars, other_chars)
+                for other in alternative[:position] + alternative[position + 1 :]
+            )
+            if not separated:
+                return True
+    return False
+
+
+def _find_ambiguous_repeat(terms: _Sequence, ignore_case: bool) -> bool:
+    for term in terms:
+        if (
+            term.unbounded
+            and term.alternatives
+            and _is_ambiguous_repeat(term, ignore_case)
+        ):
+            return True
+        if any(
+            _find_ambiguous_repeat(alternative, ignore_case)
+            for alternative in term.alternatives
+        ):
+            return True
+    return False
+
+
+def has_catastrophic_backtracking(pattern: str, ignore_case: bool = False) -> bool:
+    """
+    Statically checks a pattern for nested unbounded quantifiers, or unbounded groups
+    with overlapping alternatives, which could take exponential time to fail to
+    match, e.g. ``(a+)+$`` against ``"aaaaaaaaaaaaaaaaaaaaaa!"``.
+
+    Errs on the side of flagging a pattern when some part of it cannot be analyzed,
+    such as a back reference inside a repeated group. ``ignore_case`` is whether the
+    pattern is compiled with ``re.IGNORECASE``, which it may also set inline.
+    """
+    ignore_case = ignore_case or bool(_IGNORECASE_PATTERN.search(pattern))
+    return _find_ambiguous_repeat(
+        [_Term(None, [_parse_sequence(a) for a in split_alternatives(pattern)])],
+        ignore_case,
+    )
@@ -0,0 +1,213 @@
+"""
+Cleans batches of URLs on a pool of workers, so that they can be cleaned on every CPU
+core rather than on the single thread of the event loop, which only awaits the results.
+
+Each worker is a process, which compiles its own copy of the engine from the rules
+once, when it starts. On a free-threaded build of Python, the workers are threads
+instead, which share the current engine. Subinterpreters, which each have their own GIL,
+can be used instead of processes where they are available, but the modules which the
+workers import depend on extension modules which may not support them, in which case
+worker processes stand in for them.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import pathlib
+import sys
+import threading
+from collections.abc import Sequence
+from datetime import timedelta
+from typing import Literal
+
+from memebot import config, log
+from memebot.integrations import clear_urls
+from memebot.lib import exception
+
+type WorkerKind = Literal["threads", "interpreters", "processes"]
+
+WORKER_KINDS: tuple[WorkerKind, ...] = ("threads", "interpreters", "processes")
+
+
+def default_worker_kind() -> WorkerKind:
+    """
+    Picks threads on a free-threaded build of Python, and processes otherwise
+    """
+    if not sys._is_gil_enabled():
+        return "threads"
+    return "processes"
+
+
+def configure_worker(log_level: str, rules_files: Sequence[pathlib.Path]) -> None:
+    """
+    Configures Memebot for cleaning URLs outside of the bot, without any command-line
+    parsing. Results are not cached, since each URL is expected to be cleaned once,
+    and there is no time budget, since there is no event loop to keep responsive.
+    """
+    config.log_level = log_level
+    config.log_location = logging.StreamHandler(sys.stderr)
+    config.clearurls_rules_files = list(rules_files)
+    config.clearurls_result_cache_size = 0
+    config.clearurls_url_time_budget = timedelta(0)
+    log.configure_logging()
+
+
+def _initialize_worker(
+    rules: str, rules_files: Sequence[pathlib.Path], log_level: str
+) -> None:
+    """
+    Prepares a worker subinterpreter or process, which compiles its own copy of the
+    engine
+    """
+    configure_worker(log_level, rules_files)
+    clear_urls._publish_engine(clear_urls._build_engine(rules))
+
+
+def strip_batch(dirty_urls: list[str]) -> list[str]:
+    """
+    Cleans a batch of URLs with the engine of the worker which runs it. The result
+    cache and the time budget are not used, so that threads can share the engine.
+    """
+    current_engine = clear_urls.engine
+    return [current_engine.clean(dirty_url) for dirty_url in dirty_urls]
+
+
+def create_executor(
+    workers: int, rules: str, kind: WorkerKind | None = None
+) -> concurrent.futures.Executor:
+    """
+    Creates a pool of ``workers`` workers to run ``strip_batch``, which compile the
+    rules and the configured rules files. Threads share the current engine instead,
+    which should have been built from the same rules.
+    """
+    match kind or default_worker_kind():
+        case "threads":
+            return concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix="clearurls"
+            )
+        case "interpreters":
+            return concurrent.futures.InterpreterPoolExecutor(
+                workers,
+                initializer=_initialize_worker,
+                initargs=(rules, config.clearurls_rules_files, config.log_level),
+            )
+        case "processes":
+            return concurrent.futures.ProcessPoolExecutor(
+                workers,
+                initializer=_initialize_worker,
+                initargs=(rules, config.clearurls_rules_files, config.log_level),
+            )
+
+
+class WorkerPool:
+    """
+    Cleans URLs for the event loop on a pool of workers. The pool is replaced whenever
+    a new engine is published, so that the workers always clean URLs with the current
+    rules, while batches which are already in flight finish with the old ones.
+    """
+
+    def __init__(self, workers: int, kind: WorkerKind | None = None) -> None:
+        self.workers = workers
+        self.kind = kind or default_worker_kind()
+        self._executor: concurrent.futures.Executor | None = None
+        # Checksum of the engine which the workers were created for
+        self._checksum = ""
+        # Threads which wait for the workers of replaced executors to stop
+        self._joiners: list[threading.Thread] = []
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        current_engine = clear_urls.engine
+        if self._executor is None or self._checksum != current_engine.checksum:
+            self.shutdown()
+            self._executor = create_executor(
+                self.workers, current_engine.rules, self.kind
+            )
+            self._checksum = current_engine.checksum
+        return self._executor
+
+    async def _strip_batches(self, batches: list[list[str]]) -> list[list[str]]:
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *(loop.run_in_executor(executor, strip_batch, batch) for batch in batches)
+        )
+
+    async def strip_trackers_many(self, dirty_urls: Sequence[str]) -> list[str]:
+        """
+        Cleans many URLs as ``clear_urls.strip_trackers_many`` does, split evenly
+        between the workers
+        """
+        if not clear_urls.engine.providers:
+            raise exception.MemebotInternalError(
+                f"Failed to strip tracking params from {dirty_urls}: "
+                "No ClearURLs providers"
+            )
+        if not dirty_urls:
+            return []
+
+        batch_size = -(-len(dirty_urls) // self.workers)
+        batches = [
+            list(dirty_urls[i : i + batch_size])
+            for i in range(0, len(dirty_urls), batch_size)
+        ]
+        try:
+            results = await self._strip_batches(batches)
+        except concurrent.futures.BrokenExecutor as e:
+            if self.kind != "interpreters":
+                raise
+            log.warning(
+                "ClearURLs worker subinterpreters failed to start, "
+                f"using worker processes instead: {e!r}"
+            )
+            self.kind = "processes"
+            self.shutdown()
+            results = await self._strip_batches(batches)
+        return [clean_url for batch in results for clean_url in batch]
+
+    def shutdown(self, wait: bool = False) -> None:
+        """
+        Stops the workers once they have finished the batches in flight. They are
+        joined in the background, so that the event loop is not blocked meanwhile.
+        With ``wait``, blocks until the workers of every executor which this pool
+        created have stopped.
+        """
+        if self._executor is not None:
+            joiner = threading.Thread(
+                target=self._executor.shutdown, name="clearurls-shutdown", daemon=True
+            )
+            joiner.start()
+            self._joiners.append(joiner)
+            self._executor = None
+        if wait:
+            for joiner in self._joiners:
+                joiner.join()
+        self._joiners = [joiner for joiner in self._joiners if joiner.is_alive()]
+
+
+_pool: WorkerPool | None = None
+
+
+async def strip_trackers_many(dirty_urls: Sequence[str]) -> list[str]:
+    """
+    Cleans many URLs as ``clear_urls.strip_trackers_many`` does, on the configured
+    number of workers, or on the event loop if there are none
+    """
+    global _pool
+    if config.clearurls_workers <= 0:
+        return clear_urls.strip_trackers_many(dirty_urls)
+    if _pool is None or _pool.workers != config.clearurls_workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = WorkerPool(config.clearurls_workers)
+    return await _pool.strip_trackers_many(dirty_urls)
+
+
+async def close() -> None:
+    """
+    Stops the workers which clean URLs for the bot, if there are any, and waits for
+    them to stop
+    """
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.shutdown, wait=True)
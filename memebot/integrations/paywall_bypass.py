@@ -0,0 +1,157 @@
+"""
+Finds a working way around the paywall of a link, among the configured archive and
+bypass backends. The backends are probed concurrently, and the first one to respond
+successfully is used. It is remembered for the link's domain for a while, so that
+later links from the same domain are answered without probing any backend.
+"""
+
+import asyncio
+import functools
+import urllib.parse
+from dataclasses import dataclass
+from datetime import timedelta
+
+import aiohttp
+
+from memebot import config, log
+from memebot.lib import cache
+
+_MEMO_SIZE = 1024
+_MEMO_TTL = timedelta(hours=12)
+
+
+@dataclass(frozen=True)
+class PaywallBackend:
+    """
+    An archive or bypass service, which serves a link at its URL template with
+    ``{url}`` replaced by the link
+    """
+
+    template: str
+
+    @property
+    def name(self) -> str:
+        return urllib.parse.urlsplit(self.template).hostname or self.template
+
+    def bypass_link(self, link: str) -> str:
+        return self.template.replace("{url}", link)
+
+
+@dataclass
+class _Prober:
+    """
+    The HTTP session of the event loop which probes backends. It is created on first
+    use, since the session has to be created on the loop.
+    """
+
+    loop: asyncio.AbstractEventLoop
+    session: aiohttp.ClientSession
+
+
+_prober: _Prober | None = None
+
+
+@functools.cache
+def get_memo() -> cache.LRUCache[str, str]:
+    """
+    Returns the URL template of the backend which last worked for each domain
+    """
+    return cache.LRUCache(_MEMO_SIZE, _MEMO_TTL)
+
+
+def get_backends() -> list[PaywallBackend]:
+    return [PaywallBackend(template) for template in config.paywall_backends]
+
+
+def _domain(link: str) -> str:
+    try:
+        host = urllib.parse.urlsplit(link).hostname or ""
+    except ValueError:
+        return ""
+    return host.removeprefix("www.")
+
+
+def known_backend(link: str) -> PaywallBackend | None:
+    """
+    Returns the backend to use for a link without probing any backends: the one which
+    last worked for its domain, or the first one if probing is disabled
+    """
+    if not config.paywall_backends:
+        return None
+    if not config.paywall_probe_timeout:
+        return PaywallBackend(config.paywall_backends[0])
+    template = get_memo().get(_domain(link))
+    if template is None or template not in config.paywall_backends:
+        return None
+    return PaywallBackend(template)
+
+
+def _get_prober() -> _Prober:
+    global _prober
+    loop = asyncio.get_running_loop()
+    if _prober is None or _prober.loop is not loop or _prober.session.closed:
+        _prober = _Prober(loop, aiohttp.ClientSession())
+    return _prober
+
+
+async def close() -> None:
+    """
+    Closes the HTTP session used to probe backends, if there is one
+    """
+    global _prober
+    if _prober is not None:
+        await _prober.session.close()
+        _prober = None
+
+
+async def _probe(
+    session: aiohttp.ClientSession, backend: PaywallBackend, link: str
+) -> PaywallBackend | None:
+    """
+    Requests the link from a backend, and returns the backend if it responded
+    successfully. Only the response headers are read.
+    """
+    try:
+        async with session.get(backend.bypass_link(link)) as response:
+            if response.ok:
+                return backend
+            log.info(f"Paywall backend {backend.name} responded {response.status}")
+    except aiohttp.ClientError as e:
+        log.info(f"Failed to probe paywall backend {backend.name}: {e!r}")
+    return None
+
+
+async def find_backend(link: str) -> PaywallBackend | None:
+    """
+    Returns a backend which works for a link, or ``None`` if none of them responded
+    successfully within the probe timeout. Without a remembered backend, every backend
+    is probed at once, and the first one to respond successfully is remembered for the
+    link's domain.
+    """
+    if (backend := known_backend(link)) is not None:
+        return backend
+    if not config.paywall_backends:
+        return None
+
+    session = _get_prober().session
+    probes = [
+        asyncio.create_task(_probe(session, backend, link))
+        for backend in get_backends()
+    ]
+    try:
+        for probe in asyncio.as_completed(
+            probes, timeout=config.paywall_probe_timeout.total_seconds()
+        ):
+            if (backend := await probe) is not None:
+                get_memo().put(_domain(link), backend.template)
+                return backend
+    except TimeoutError:
+        log.info(
+            f"No paywall backend responded for {link} within "
+            f"{config.paywall_probe_timeout}"
+        )
+    finally:
+        # The remaining probes are no longer needed
+        for probe in probes:
+            probe.cancel()
+    return None
@@ -0,0 +1,84 @@
+import collections
+import math
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters describing how effective a cache is
+    """
+
+    hits: int = 0
+    misses: int = 0
+    # Entries dropped to make room for new ones
+    evictions: int = 0
+    # Entries dropped because they outlived the cache's time-to-live
+    expirations: int = 0
+
+
+class LRUCache[K, V]:
+    """
+    A size-bounded cache which evicts its least recently used entries first.
+    Entries can optionally expire after a fixed time-to-live.
+
+    A ``maxsize`` of 0 disables the cache entirely.
+    """
+
+    def __init__(self, maxsize: int, ttl: timedelta | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        # Maps keys to their values and the monotonic time at which they expire
+        self._entries: collections.OrderedDict[K, tuple[V, float]] = (
+            collections.OrderedDict()
+        )
+
+    def get(self, key: K) -> V | None:
+        """
+        Returns the value cached for ``key``, or ``None`` if there is none
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Caches ``value`` for ``key``, evicting the least recently used entries if the
+        cache is full
+        """
+        if self.maxsize <= 0:
+            return
+
+        expires = time.monotonic() + self.ttl.total_seconds() if self.ttl else math.inf
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Drops every entry from the cache. The stats are kept.
+        """
+        self._entries.clear()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
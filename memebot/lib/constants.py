@@ -2,3 +2,6 @@ import discord
 
 # official MemeBot color
 COLOR: discord.Colour = discord.Colour(0x00BCD4)
+
+# The maximum length of a Discord message
+MAX_MESSAGE_LENGTH: int = 2000
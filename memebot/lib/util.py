@@ -5,7 +5,7 @@ from typing import Union, cast, get_args, get_origin
 import discord
 import discord.ext.commands
 
-from memebot.lib import exception
+from memebot.lib import constants, exception
 
 URL_REGEX = re.compile(r"https?://\S+")
 
@@ -29,6 +29,38 @@ def extract_link(message: discord.Message) -> str:
     raise exception.MemebotUserError("Cannot extract link from replied-to message")
 
 
+def extract_links(message: discord.Message) -> list[str]:
+    """
+    Extracts every distinct link from the given message's content and embeds,
+    in order of appearance
+    """
+    links = dict.fromkeys(cast(list[str], URL_REGEX.findall(message.content)))
+    links |= dict.fromkeys(embed.url for embed in message.embeds if embed.url)
+
+    if not links:
+        raise exception.MemebotUserError("Cannot extract links from replied-to message")
+    return list(links)
+
+
+def format_links(header: str, links: list[str]) -> str:
+    """
+    Formats a list of links into a single message, omitting any links which would
+    make the message too long for Discord
+    """
+    lines = [header]
+    length = len(header)
+    for i, link in enumerate(links):
+        line = f"- {link}"
+        # Leave room for a note about the links which have been omitted
+        omitted_note = f"- ...and {len(links) - i} more"
+        if length + len(line) + len(omitted_note) + 2 > constants.MAX_MESSAGE_LENGTH:
+            lines.append(omitted_note)
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
 def parse_invocation(interaction: discord.Interaction) -> str:
     """Returns the command invocation parsed from the raw interaction data"""
 
@@ -1,8 +1,10 @@
+from datetime import timedelta
 from unittest import mock
 
 import pytest
 
-from memebot import commands
+from memebot import commands, config
+from memebot.integrations import paywall_bypass
 from memebot.lib import exception
 
 
@@ -116,3 +118,43 @@ async def test_paywall_context_menu_fails_with_no_link(
     with pytest.raises(exception.MemebotUserError):
         await commands.paywall_context_menu.callback(mock_interaction, mock_message)
     mock_interaction.response.send_message.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_paywall_command_probes_unknown_domain(
+    mock_interaction: mock.Mock,
+) -> None:
+    link = "https://foo.com/poop"
+    backend = paywall_bypass.PaywallBackend("https://archive.example/{url}")
+    config.paywall_probe_timeout = timedelta(seconds=1)
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with mock.patch.object(
+        paywall_bypass, "find_backend", return_value=backend
+    ) as mock_find_backend:
+        await commands.paywall.callback(mock_interaction, link)
+
+    mock_find_backend.assert_awaited_once_with(link)
+    mock_interaction.response.defer.assert_awaited_once_with(thinking=True)
+    mock_interaction.followup.send.assert_awaited_once_with(
+        StringContaining(f"https://archive.example/{link}")
+    )
+    mock_interaction.response.send_message.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_paywall_command_without_working_backend(
+    mock_interaction: mock.Mock,
+) -> None:
+    link = "https://foo.com/poop"
+    config.paywall_probe_timeout = timedelta(seconds=1)
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with mock.patch.object(paywall_bypass, "find_backend", return_value=None):
+        await commands.paywall.callback(mock_interaction, link)
+
+    mock_interaction.followup.send.assert_awaited_once_with(
+        StringContaining("Could not find a working way around the paywall")
+    )
@@ -3,7 +3,8 @@ from unittest import mock
 import pytest
 
 from memebot import commands
-from memebot.lib import exception
+from memebot.integrations import clear_urls
+from memebot.lib import constants, exception, util
 
 
 class StringContaining(str):
@@ -33,6 +34,113 @@ async def test_trackers_command(mock_interaction: mock.Mock) -> None:
         mock_strip_trackers.assert_called_once_with(link)
 
 
+@pytest.mark.asyncio
+async def test_trackers_command_explain(mock_interaction: mock.Mock) -> None:
+    link = "https://example.com/page?utm_source=test&id=1"
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_[a-z]+"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
+        ),
+        mock.patch(
+            "memebot.integrations.clear_urls.strip_trackers"
+        ) as mock_strip_trackers,
+    ):
+        await commands.trackers.callback(mock_interaction, link, explain=True)
+
+        mock_strip_trackers.assert_not_called()
+
+    mock_interaction.response.defer.assert_awaited_once_with(
+        thinking=True, ephemeral=True
+    )
+    mock_interaction.followup.send.assert_awaited_once()
+    [message] = mock_interaction.followup.send.call_args.args
+    assert mock_interaction.followup.send.call_args.kwargs == {"ephemeral": True}
+    assert "Link without trackers: <https://example.com/page?id=1>" in message
+    assert "**test_provider**" in message
+    assert "`utm_source` (rule `utm_[a-z]+`)" in message
+
+
+@pytest.mark.asyncio
+async def test_trackers_command_expands_short_link(
+    mock_interaction: mock.Mock,
+) -> None:
+    link = "https://t.co/abc"
+    expanded_link = "https://example.com/page?utm_source=test"
+
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with (
+        mock.patch(
+            "memebot.integrations.clear_urls.short_links.expand",
+            return_value=expanded_link,
+        ) as mock_expand,
+        mock.patch(
+            "memebot.integrations.clear_urls.strip_trackers",
+            return_value="https://example.com/page",
+        ) as mock_strip_trackers,
+    ):
+        await commands.trackers.callback(mock_interaction, link)
+
+        mock_expand.assert_awaited_once_with(link)
+        mock_strip_trackers.assert_called_once_with(expanded_link)
+        mock_interaction.followup.send.assert_awaited_once_with(
+            "Link without trackers: https://example.com/page"
+        )
+
+
+@pytest.mark.asyncio
+async def test_trackers_command_explain_mentions_expanded_short_link(
+    mock_interaction: mock.Mock,
+) -> None:
+    link = "https://t.co/abc"
+
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_[a-z]+"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
+        ),
+        mock.patch(
+            "memebot.integrations.clear_urls.short_links.expand",
+            return_value="https://example.com/page?utm_source=test",
+        ),
+    ):
+        await commands.trackers.callback(mock_interaction, link, explain=True)
+
+    [message] = mock_interaction.followup.send.call_args.args
+    assert message.startswith("Expanded short link <https://t.co/abc>\n")
+    assert "Link without trackers: <https://example.com/page>" in message
+
+
 @pytest.mark.asyncio
 async def test_trackers_command_rejects_invalid_link(
     mock_interaction: mock.Mock,
@@ -128,3 +236,67 @@ async def test_trackers_context_menu_fails_with_no_link(
         mock_extract_link.assert_called_once_with(mock_message)
         mock_interaction.response.defer.assert_not_called()
         mock_interaction.followup.send.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_trackers_all_links_context_menu(
+    mock_interaction: mock.Mock, mock_message: mock.Mock
+) -> None:
+    links = [
+        "https://example.com/page?utm_source=test",
+        "https://other.com/page?fbclid=123",
+    ]
+    mock_message.content = f"Check out these links: {links[0]} {links[1]}"
+    mock_message.embeds = []
+
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with mock.patch(
+        "memebot.integrations.clear_urls.strip_trackers_many"
+    ) as mock_strip_trackers_many:
+        mock_strip_trackers_many.return_value = [
+            "https://example.com/page",
+            "https://other.com/page",
+        ]
+
+        await commands.trackers_all_links_context_menu.callback(
+            mock_interaction, mock_message
+        )
+
+        mock_strip_trackers_many.assert_called_once_with(links)
+        mock_interaction.response.defer.assert_awaited_once_with(thinking=True)
+        mock_interaction.followup.send.assert_awaited_once_with(
+            "Links without trackers:\n"
+            "- https://example.com/page\n"
+            "- https://other.com/page"
+        )
+
+
+@pytest.mark.asyncio
+async def test_trackers_all_links_context_menu_fails_with_no_link(
+    mock_interaction: mock.Mock, mock_message: mock.Mock
+) -> None:
+    mock_message.content = "No link here"
+    mock_message.embeds = []
+
+    mock_interaction.response.defer = mock.AsyncMock()
+    mock_interaction.followup.send = mock.AsyncMock()
+
+    with pytest.raises(exception.MemebotUserError):
+        await commands.trackers_all_links_context_menu.callback(
+            mock_interaction, mock_message
+        )
+
+    mock_interaction.response.defer.assert_not_called()
+    mock_interaction.followup.send.assert_not_called()
+
+
+def test_format_links_omits_links_over_message_limit() -> None:
+    links = [f"https://example.com/{'a' * 100}/{i}" for i in range(50)]
+
+    message = util.format_links("Links without trackers:", links)
+
+    assert len(message) <= constants.MAX_MESSAGE_LENGTH
+    assert message.startswith(f"Links without trackers:\n- {links[0]}\n")
+    assert message.endswith("more")
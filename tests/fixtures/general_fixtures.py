@@ -1,5 +1,6 @@
 import logging
 import os
+import pathlib
 import sys
 from datetime import timedelta
 from unittest import mock
@@ -14,7 +15,7 @@ DEFAULT_ENVIRONMENT = os.environ | {
 
 
 @pytest.fixture(autouse=True)
-def setup_and_teardown() -> None:
+def setup_and_teardown(tmp_path: pathlib.Path) -> None:
     """
     This is a universal setup and teardown function which is automatically run
     surrounding each test. The function contains both the setup and teardown behavior.
@@ -35,6 +36,23 @@ def setup_and_teardown() -> None:
 
     # Ensure rules are not refreshed automatically
     config.clearurls_rules_refresh_hours = timedelta(days=365 * 1000)
+    # Ensure rules snapshots do not leak between tests
+    config.clearurls_cache_dir = tmp_path / "clearurls"
+    config.clearurls_rules_files = []
+    config.clearurls_result_cache_size = 1024
+    config.clearurls_url_time_budget = timedelta(0)
+    config.clearurls_metrics_interval = timedelta(0)
+    config.clearurls_auto_clean_guilds = set()
+    # Ensure short links are not expanded over the network
+    config.clearurls_short_link_budget = timedelta(0)
+    # Ensure new rules are published without a canary evaluation
+    config.clearurls_canary_corpus = pathlib.Path(os.devnull)
+    config.clearurls_canary_max_changed_percent = 10.0
+    config.clearurls_canary_max_slowdown_percent = 50.0
+    config.clearurls_workers = 0
+    # Ensure paywall backends are not probed over the network
+    config.paywall_backends = ["https://removepaywalls.com/{url}"]
+    config.paywall_probe_timeout = timedelta(0)
 
     # Run test
     return
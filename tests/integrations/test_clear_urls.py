@@ -1,12 +1,44 @@
+import asyncio
+import json
+import os
+import pathlib
+import re
+import threading
+import urllib.error
 import urllib.parse
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from email.message import Message
+from typing import Any
 from unittest import mock
 
+import pymongo.errors
 import pytest
 
+from memebot import config
 from memebot.integrations import clear_urls
 from memebot.lib import exception
 
 
+@pytest.fixture(autouse=True)
+def fresh_result_cache() -> None:
+    """
+    Ensures that cleaned URLs are not cached between tests
+    """
+    clear_urls.get_result_cache.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics() -> Iterator[None]:
+    """
+    Ensures that metrics are not recorded across tests
+    """
+    with mock.patch.object(
+        clear_urls.metrics, "registry", clear_urls.metrics.MetricsRegistry()
+    ):
+        yield
+
+
 class TestClearURLsProvider:
     def test_matches(self) -> None:
         provider = clear_urls.ClearURLsProvider(
@@ -47,6 +79,213 @@ class TestClearURLsProvider:
         assert "id" in params
         assert params["id"] == ["123"]
 
+    @pytest.mark.parametrize(
+        ("url", "expected"),
+        [
+            (
+                "https://example.com/?b=2&utm_source=x&a=&c=%20+#utm_source=y",
+                "https://example.com/?b=2&a=&c=%20+#utm_source=y",
+            ),
+            ("https://example.com/?utm_source=x&ref", "https://example.com/"),
+            ("https://example.com/?utm_source=x#top", "https://example.com/#top"),
+            ("https://example.com/?id=1&utm%5Fsource=x", "https://example.com/?id=1"),
+            ("https://example.com/?a=1&&ref=2&", "https://example.com/?a=1&&"),
+        ],
+    )
+    def test_strip_params_splices_query(self, url: str, expected: str) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source", "ref"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+        assert provider.strip_params(url) == expected
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "https://example.com/page",
+            "https://example.com/?b=2&a=1&a=&c=%20+",
+            "https://example.com/#?utm_source=x",
+            "https://example.com/?",
+        ],
+    )
+    def test_strip_params_returns_untouched_url(self, url: str) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+        assert provider.strip_params(url) is url
+
+    def test_strip_params_removes_raw_rules_from_whole_url(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["tag"],
+            raw_rule_patterns=[r"\/ref=[^/?]*", r"\?pc$"],
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+        assert provider.strip_params_counted(
+            "https://example.com/dp/B0/REF=sr_1_1?tag=x&id=1"
+        ) == ("https://example.com/dp/B0?id=1", 2)
+        assert provider.strip_params("https://example.com/game?pc") == (
+            "https://example.com/game"
+        )
+        # Raw rules are not query parameter names
+        assert not provider.is_tracking_param("ref")
+        assert provider.matching_raw_rules("https://example.com/a/ref=x/b/ref=y") == [
+            ("/ref=x", r"\/ref=[^/?]*"),
+            ("/ref=y", r"\/ref=[^/?]*"),
+        ]
+        url = "https://example.com/dp/B0?id=1"
+        assert provider.strip_params(url) is url
+
+    def test_is_tracking_param(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source", "gs_[a-z]*", r"field\-id"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=["ref_?"],
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+        assert provider.literal_rules == {"utm_source", "field-id"}
+        assert provider.rules_pattern is not None
+
+        assert provider.is_tracking_param("utm_source") is True
+        assert provider.is_tracking_param("field-id") is True
+        assert provider.is_tracking_param("gs_lcp") is True
+        assert provider.is_tracking_param("ref") is True
+        assert provider.is_tracking_param("ref_") is True
+        # Rules are case-insensitive
+        assert provider.is_tracking_param("UTM_SOURCE") is True
+        assert provider.is_tracking_param("Field-Id") is True
+        assert provider.is_tracking_param("GS_LCP") is True
+        assert provider.is_tracking_param("Ref") is True
+        assert provider.matching_rule("GS_LCP") == "gs_[a-z]*"
+        # Rules must match the whole parameter name
+        assert provider.is_tracking_param("utm_source_platform") is False
+        assert provider.is_tracking_param("gs_lcp1") is False
+        assert provider.is_tracking_param("referrer") is False
+        assert provider.is_tracking_param("id") is False
+
+    def test_compiles_patterns_on_first_match(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source", "gs_[a-z]*"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=[r"^https?:\/\/example\.com\/redirect\?url=(.*)$"],
+            exception_patterns=[r"^https?:\/\/example\.com\/excluded"],
+        )
+
+        assert provider.compiled is False
+        assert provider.matches("https://other-domain.com") is False
+        assert provider.compiled is False
+        assert provider.matches("https://example.com/page") is True
+        assert provider.compiled is True
+
+        index = clear_urls.ProviderIndex([provider])
+        assert index.compiled_count == 1
+
+    def test_invalid_pattern_disables_provider(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source", "gs_[a-z"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+        with mock.patch("memebot.log.exception") as mock_log_exc:
+            assert provider.is_tracking_param("utm_source") is False
+            assert provider.is_tracking_param("utm_source") is False
+            mock_log_exc.assert_called_once()
+
+    def test_quarantines_catastrophic_patterns(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source", "gs_[a-z]*", "(a+)+"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=[r"^https?:\/\/example\.com\/(.*,)*$"],
+            exception_patterns=None,
+        )
+
+        with mock.patch("memebot.log.warning") as mock_log_warning:
+            assert provider.is_tracking_param("gs_lcp") is True
+            assert provider.is_tracking_param("aaaa") is False
+            assert provider.redirections == ()
+            assert mock_log_warning.call_count == 2
+
+    def test_quarantined_exception_disables_provider(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/example\.com",
+            rule_patterns=["utm_source"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=[r"^https?:\/\/example\.com\/(\w+\/?)+$"],
+        )
+
+        with mock.patch("memebot.log.warning"):
+            url = "https://example.com/page?utm_source=test"
+            assert provider.clean(url) == url
+
+    def test_quarantines_overlapping_alternatives(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/x\.com",
+            rule_patterns=["utm_source"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=[r"^https?:\/\/x\.com\/(?:[^/]+\/)*\?to=([^&]+)"],
+            exception_patterns=[r"^https?:\/\/x\.com\/(a|aa)+$"],
+        )
+
+        with mock.patch("memebot.log.warning") as mock_log_warning:
+            url = "https://x.com/" + "a" * 36 + "!?utm_source=test"
+            assert provider.clean(url) == url
+            assert provider.exceptions == ()
+            mock_log_warning.assert_called_once()
+            [message] = mock_log_warning.call_args.args
+            assert "(a|aa)+" in message
+
+    def test_keeps_negated_classes_which_separate_repeats(self) -> None:
+        provider = clear_urls.ClearURLsProvider(
+            provider="test_provider",
+            url_pattern=r"^https?:\/\/x\.com",
+            rule_patterns=["utm_source"],
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=[r"^https?:\/\/x\.com\/(?:[^/]+\/)*\?to=([^&]+)"],
+            exception_patterns=None,
+        )
+
+        with mock.patch("memebot.log.warning") as mock_log_warning:
+            assert len(provider.redirections) == 1
+            mock_log_warning.assert_not_called()
+
     def test_redirect(self) -> None:
         provider = clear_urls.ClearURLsProvider(
             provider="test_provider",
@@ -78,16 +317,24 @@ class TestClearURLsProvider:
         )
 
         with (
-            mock.patch.object(provider, "strip_params") as mock_strip_params,
-            mock.patch.object(provider, "redirect") as mock_redirect,
+            mock.patch.object(
+                clear_urls.ClearURLsProvider, "strip_params", autospec=True
+            ) as mock_strip_params,
+            mock.patch.object(
+                clear_urls.ClearURLsProvider, "redirect", autospec=True
+            ) as mock_redirect,
         ):
             mock_strip_params.return_value = "https://example.com/stripped"
             mock_redirect.return_value = "https://destination.com"
 
             result = provider.clean("https://example.com/original")
 
-            mock_strip_params.assert_called_once_with("https://example.com/original")
-            mock_redirect.assert_called_once_with("https://example.com/stripped")
+            mock_strip_params.assert_called_once_with(
+                provider, "https://example.com/original"
+            )
+            mock_redirect.assert_called_once_with(
+                provider, "https://example.com/stripped"
+            )
             assert result == "https://destination.com"
 
 
@@ -96,15 +343,10 @@ def test_decode_uri() -> None:
     decoded_uri = clear_urls._decode_uri(encoded_uri)
     assert decoded_uri == "https://example.com/path?param=value"
 
-    # Double encoding
+    # Only one level of encoding is removed at a time
     double_encoded = urllib.parse.quote(encoded_uri)
     decoded_uri = clear_urls._decode_uri(double_encoded)
-    assert decoded_uri == "https://example.com/path?param=value"
-
-
-def test_is_encoded_uri() -> None:
-    assert clear_urls._is_encoded_uri("https%3A%2F%2Fexample.com") is True
-    assert clear_urls._is_encoded_uri("https://example.com") is False
+    assert decoded_uri == encoded_uri
 
 
 def test_strip_trackers() -> None:
@@ -118,9 +360,9 @@ def test_strip_trackers() -> None:
         exception_patterns=None,
     )
 
-    with (
-        mock.patch("memebot.integrations.clear_urls.providers", [test_provider]),
-        mock.patch("memebot.integrations.clear_urls._refresh_providers"),
+    with mock.patch(
+        "memebot.integrations.clear_urls.engine",
+        clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
     ):
         # URL matches the provider
         url = "https://example.com/page?utm_source=test&id=123"
@@ -138,68 +380,1653 @@ def test_strip_trackers() -> None:
         assert stripped == url
 
 
-def test_strip_trackers_no_providers() -> None:
-    # Mock empty provider list and ensure _refresh_providers doesn't add any
+def test_strip_trackers_time_budget() -> None:
+    slow_provider = clear_urls.ClearURLsProvider(
+        provider="slow_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    skipped_provider = clear_urls.ClearURLsProvider(
+        provider="skipped_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_medium"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    config.clearurls_url_time_budget = timedelta(milliseconds=100)
+    url = "https://example.com/?utm_source=a&utm_medium=b"
+
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex([slow_provider, skipped_provider])
+        ),
+    ):
+        with (
+            # The call starts, cleaning starts, and the first provider takes 1 second
+            mock.patch("time.perf_counter_ns", side_effect=[0, 0, *[10**9] * 3]),
+            mock.patch("memebot.log.warning") as mock_log_warning,
+        ):
+            result = clear_urls.strip_trackers(url)
+
+        assert result == "https://example.com/?utm_medium=b"
+        assert "slow_provider" in mock_log_warning.call_args.args[0]
+
+        # The partially cleaned URL is not cached
+        assert clear_urls.strip_trackers(url) == "https://example.com/"
+        assert clear_urls.strip_trackers_many([url]) == ["https://example.com/"]
+
+
+def test_strip_trackers_many_does_not_cache_partially_cleaned_urls() -> None:
+    provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    config.clearurls_url_time_budget = timedelta(milliseconds=100)
+    url = "https://example.com/?utm_source=a"
+
     with (
-        mock.patch.object(clear_urls, "providers", []),
-        mock.patch.object(clear_urls, "_refresh_providers"),
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([provider])),
+        ),
+        mock.patch.object(
+            clear_urls.ClearURLsEngine, "_clean_url", return_value=(url, False)
+        ),
     ):
-        url = "https://example.com/page?utm_source=test"
+        assert clear_urls.strip_trackers_many([url]) == [url]
+        assert clear_urls.strip_trackers(url) == url
 
-        # Should raise an exception when no providers are available
-        with pytest.raises(exception.MemebotInternalError):
-            clear_urls.strip_trackers(url)
+    assert clear_urls.get_result_cache().get(("", url)) is None
 
 
-def test_json_to_provider() -> None:
-    provider_data = {
-        "urlPattern": r"^https?:\/\/example\.com",
-        "rules": ["utm_source", "utm_medium"],
-        "redirections": [r"^https?:\/\/example\.com\/redirect\?url=(.*)$"],
-    }
+def test_strip_trackers_records_metrics() -> None:
+    tracking_provider = clear_urls.ClearURLsProvider(
+        provider="tracking_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source", "utm_medium"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=[r"^https?:\/\/example\.com\/out\?to=([^&]*)"],
+        exception_patterns=None,
+    )
+    other_provider = clear_urls.ClearURLsProvider(
+        provider="other_provider",
+        url_pattern=r"^https?:\/\/other\.org",
+        rule_patterns=["ref"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
 
-    provider = clear_urls._json_to_provider("test_provider", provider_data)
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex([tracking_provider, other_provider])
+        ),
+    ):
+        clear_urls.strip_trackers("https://example.com/?utm_source=a&utm_medium=b")
+        clear_urls.strip_trackers("https://example.com/out?to=https%3A%2F%2Fa.com")
+        clear_urls.strip_trackers_many(["https://example.com/?id=1"])
 
-    assert provider is not None
+    registry = clear_urls.metrics.registry
+    tracking_metrics = registry.providers["tracking_provider"]
+    assert tracking_metrics.matched == 3
+    assert tracking_metrics.params_removed == 2
+    assert tracking_metrics.redirects == 1
+    assert tracking_metrics.latency.count == 3
+    # Only the providers which match the host are candidates
+    assert "other_provider" not in registry.providers
+    assert registry.calls["strip_trackers"].count == 2
+    assert registry.calls["strip_trackers_many"].count == 1
+    assert "tracking_provider" in registry.summary()
 
-    assert provider.provider == "test_provider"
-    assert len(provider.rules) == 2
-    assert len(provider.redirections) == 1
 
+def test_explain() -> None:
+    vetoed_provider = clear_urls.ClearURLsProvider(
+        provider="vetoed_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["id"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=[r"^https?:\/\/example\.com\/out"],
+    )
+    redirect_provider = clear_urls.ClearURLsProvider(
+        provider="redirect_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source", "ref_[a-z]+"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=[r"^https?:\/\/example\.com\/out\?to=([^&]*)"],
+        exception_patterns=None,
+    )
+    other_provider = clear_urls.ClearURLsProvider(
+        provider="other_provider",
+        url_pattern=r"^https?:\/\/other\.org",
+        rule_patterns=None,
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    url = "https://example.com/out?to=https%3A%2F%2Fa.com&utm_source=x&ref_src=y"
 
-def test_json_to_provider_invalid() -> None:
-    # Missing urlPattern
-    invalid_data = {"rules": ["utm_source"]}
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex(
+                [vetoed_provider, redirect_provider, other_provider]
+            )
+        ),
+    ):
+        explanation = clear_urls.explain(url)
+        assert explanation.clean_url == clear_urls.strip_trackers(url)
 
-    with mock.patch("memebot.log.exception") as mock_log_exc:
-        result = clear_urls._json_to_provider("invalid_provider", invalid_data)
-        assert result is None
-        mock_log_exc.assert_called_once()
+    assert explanation.clean_url == "https://a.com"
+    assert explanation.hops == [url, "https://a.com"]
+    assert explanation.candidates == 2
+    vetoed, redirected = explanation.providers
+    assert vetoed.provider == "vetoed_provider"
+    assert vetoed.vetoed_by == r"^https?:\/\/example\.com\/out"
+    assert vetoed.removed_params == []
+    assert redirected.vetoed_by is None
+    assert redirected.removed_params == [
+        ("utm_source", "utm_source"),
+        ("ref_src", "ref_[a-z]+"),
+    ]
+    assert redirected.redirection == r"^https?:\/\/example\.com\/out\?to=([^&]*)"
+    assert redirected.redirected_url == "https://a.com"
+    # Only cleaning the URL counts towards the metrics, not explaining it
+    assert clear_urls.metrics.registry.providers["redirect_provider"].matched == 1
 
 
-def test_convert_rules_to_providers() -> None:
-    rules_json = r"""
-    {
-        "providers": {
-            "test_provider": {
-                "urlPattern": "^https?:\\/\\/example\\.com",
-                "rules": ["utm_source", "utm_medium"]
-            },
-            "another_provider": {
-                "urlPattern": "^https?:\\/\\/another\\.com",
-                "rules": ["ref"]
-            }
-        }
-    }
+def redirect_provider(name: str, host: str) -> clear_urls.ClearURLsProvider:
     """
+    Creates a provider which redirects ``https://{host}/?u=...`` to ``...``
+    """
+    escaped_host = host.replace(".", r"\.")
+    return clear_urls.ClearURLsProvider(
+        provider=name,
+        url_pattern=rf"^https?:\/\/{escaped_host}",
+        rule_patterns=None,
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=[rf"^https?:\/\/{escaped_host}\/\?u=([^&]*)"],
+        exception_patterns=None,
+    )
 
-    providers = clear_urls._convert_rules_to_providers(rules_json)
 
-    assert len(providers) == 2 + len(clear_urls._CUSTOM_PROVIDERS)
-    for custom_provider in clear_urls._CUSTOM_PROVIDERS:
-        assert any(p.provider == custom_provider for p in providers)
-    assert any(p.provider == "test_provider" for p in providers)
-    assert any(p.provider == "another_provider" for p in providers)
+def wrap_url(url: str, host: str) -> str:
+    return f"https://{host}/?u={urllib.parse.quote(url, safe='')}"
+
+
+def test_strip_trackers_follows_redirects_to_other_hosts() -> None:
+    target_provider = clear_urls.ClearURLsProvider(
+        provider="target_provider",
+        url_pattern=r"^https?:\/\/target\.com",
+        rule_patterns=["tag"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    target_url = "https://target.com/item?tag=affiliate"
+    # Each hop is decoded once, so the inner hop keeps its own encoding
+    inner_url = wrap_url(target_url, "inner.com")
+
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex(
+                [
+                    redirect_provider("outer", "outer.com"),
+                    redirect_provider("inner", "inner.com"),
+                    target_provider,
+                ]
+            )
+        ),
+    ):
+        result = clear_urls.strip_trackers(
+            wrap_url(wrap_url(target_url, "inner.com"), "outer.com")
+        )
+
+    assert result == "https://target.com/item"
+    # Each hop of the chain is cached with the final URL
+    result_cache = clear_urls.get_result_cache()
+    assert result_cache.get(("", inner_url)) == "https://target.com/item"
+    assert result_cache.get(("", target_url)) == "https://target.com/item"
+
+
+def test_strip_trackers_follows_google_redirect_to_facebook_redirect() -> None:
+    # The redirections of the ClearURLs Google and Facebook providers. Facebook's only
+    # matches an encoded URL, so the Google redirect must not decode it completely.
+    google_provider = clear_urls.ClearURLsProvider(
+        provider="google",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?google(?:\.[a-z]{2,}){1,}",
+        rule_patterns=["usg", "sa"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=[
+            (
+                r"^https?:\/\/(?:[a-z0-9-]+\.)*?google(?:\.[a-z]{2,}){1,}\/url\?.*?"
+                r"(?:url|q)=(https?[^&]+)"
+            )
+        ],
+        exception_patterns=None,
+    )
+    facebook_provider = clear_urls.ClearURLsProvider(
+        provider="facebook",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?facebook\.com",
+        rule_patterns=None,
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=[
+            r"^https?:\/\/l[a-z]?\.facebook\.com/l\.php\?.*?u=(https?%3A%2F%2F[^&]*)"
+        ],
+        exception_patterns=None,
+    )
+    twitter_provider = clear_urls.ClearURLsProvider(
+        provider="twitter",
+        url_pattern=r"^https?:\/\/twitter\.com",
+        rule_patterns=["igshid"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    site_url = "https://twitter.com/memebot/status/1?page=2&igshid=abc"
+    facebook_url = (
+        f"https://l.facebook.com/l.php?u={urllib.parse.quote(site_url, safe='')}&h=AT0"
+    )
+    google_url = (
+        "https://www.google.com/url?sa=t"
+        f"&url={urllib.parse.quote(facebook_url, safe='')}&usg=AOv"
+    )
+
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex(
+                [google_provider, facebook_provider, twitter_provider]
+            )
+        ),
+    ):
+        result = clear_urls.strip_trackers(google_url)
+
+    assert result == "https://twitter.com/memebot/status/1?page=2"
+
+
+def test_strip_trackers_stops_at_cached_hop() -> None:
+    inner_provider = redirect_provider("inner", "inner.com")
+    clear_urls.get_result_cache().put(
+        ("", wrap_url("https://target.com/", "inner.com")), "https://cached.com/"
+    )
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(
+                clear_urls.ProviderIndex(
+                    [redirect_provider("outer", "outer.com"), inner_provider]
+                )
+            ),
+        ),
+        mock.patch.object(
+            clear_urls.ClearURLsProvider,
+            "matches",
+            autospec=True,
+            side_effect=clear_urls.ClearURLsProvider.matches,
+        ) as mock_matches,
+    ):
+        result = clear_urls.strip_trackers(
+            wrap_url(wrap_url("https://target.com/", "inner.com"), "outer.com")
+        )
+
+    assert result == "https://cached.com/"
+    assert all(call.args[0] is not inner_provider for call in mock_matches.mock_calls)
+
+
+def test_strip_trackers_stops_redirect_loops() -> None:
+    a_provider = redirect_provider("a", "a.com")
+    b_provider = redirect_provider("b", "b.com")
+    redirects = {"https://a.com/": "https://b.com/", "https://b.com/": "https://a.com/"}
+
+    def redirect(_provider: clear_urls.ClearURLsProvider, url: str) -> str:
+        return redirects.get(url, url)
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(
+                clear_urls.ProviderIndex([a_provider, b_provider])
+            ),
+        ),
+        mock.patch.object(
+            clear_urls.ClearURLsProvider,
+            "redirect",
+            autospec=True,
+            side_effect=redirect,
+        ),
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        assert clear_urls.strip_trackers("https://a.com/") == "https://a.com/"
+
+    mock_log_warning.assert_called_once()
+    assert "loop" in mock_log_warning.call_args.args[0]
+    # The result depends on where the loop was entered, so only that URL is cached
+    assert ("", "https://b.com/") not in clear_urls.get_result_cache()
+
+
+def test_strip_trackers_limits_redirect_hops() -> None:
+    url = "https://target.com/"
+    for _ in range(clear_urls._MAX_REDIRECT_HOPS + 2):
+        url = wrap_url(url, "wrap.com")
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(
+                clear_urls.ProviderIndex([redirect_provider("wrap", "wrap.com")])
+            ),
+        ),
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        result = clear_urls.strip_trackers(url)
+
+    assert result.startswith("https://wrap.com/")
+    mock_log_warning.assert_called_once()
+    assert "hops" in mock_log_warning.call_args.args[0]
+
+
+def test_find_dirty_urls() -> None:
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=[r"\/ref=[^/?]*"],
+        referral_marketing_patterns=None,
+        redirection_patterns=[r"^https?:\/\/example\.com\/out\?to=([^&]*)"],
+        exception_patterns=[r"^https?:\/\/example\.com\/keep"],
+    )
+    index = clear_urls.ProviderIndex([test_provider])
+    text = (
+        "see https://example.com/a?utm_source=x and https://example.com/a?id=1 "
+        "or https://example.com/b/ref=x https://example.com/out?to=https%3A%2F%2Fa.com "
+        "https://example.com/keep?utm_source=x https://other.org/?utm_source=x "
+        "and again https://example.com/a?utm_source=x"
+    )
+
+    with mock.patch.object(clear_urls, "engine", clear_urls.ClearURLsEngine(index)):
+        assert clear_urls.find_dirty_urls(text) == [
+            "https://example.com/a?utm_source=x",
+            "https://example.com/b/ref=x",
+            "https://example.com/out?to=https%3A%2F%2Fa.com",
+        ]
+        with mock.patch.object(index, "candidates") as mock_candidates:
+            assert clear_urls.find_dirty_urls("no links, just example.com") == []
+            mock_candidates.assert_not_called()
+
+
+def test_strip_trackers_only_tests_candidates() -> None:
+    indexed_provider = clear_urls.ClearURLsProvider(
+        provider="indexed_provider",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    other_provider = clear_urls.ClearURLsProvider(
+        provider="other_provider",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?other(?:\.[a-z]{2,}){1,}",
+        rule_patterns=["ref"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+
+    with (
+        mock.patch(
+            "memebot.integrations.clear_urls.engine",
+            clear_urls.ClearURLsEngine(
+                clear_urls.ProviderIndex([indexed_provider, other_provider])
+            ),
+        ),
+        mock.patch.object(
+            clear_urls.ClearURLsProvider,
+            "matches",
+            autospec=True,
+            side_effect=clear_urls.ClearURLsProvider.matches,
+        ) as mock_matches,
+    ):
+        stripped = clear_urls.strip_trackers(
+            "https://www.example.com/page?utm_source=test"
+        )
+
+        assert stripped == "https://www.example.com/page"
+        assert [call.args[0] for call in mock_matches.mock_calls] == [indexed_provider]
+
+
+def test_strip_trackers_caches_results() -> None:
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    url = "https://example.com/page?utm_source=test"
+    result_cache = clear_urls.get_result_cache()
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
+        ),
+        mock.patch.object(
+            clear_urls.ClearURLsProvider,
+            "strip_params_counted",
+            autospec=True,
+            side_effect=clear_urls.ClearURLsProvider.strip_params_counted,
+        ) as mock_strip_params,
+    ):
+        assert clear_urls.strip_trackers(url) == "https://example.com/page"
+        assert clear_urls.strip_trackers(f"  {url} ") == "https://example.com/page"
+
+        mock_strip_params.assert_called_once()
+        assert result_cache.stats.hits == 1
+        assert result_cache.stats.misses == 1
+
+        # Results from other rules are never reused
+        other_engine = clear_urls.ClearURLsEngine(
+            clear_urls.ProviderIndex([test_provider]), checksum="new"
+        )
+        other_engine.strip_trackers(url)
+        assert mock_strip_params.call_count == 2
+
+
+def test_strip_trackers_many() -> None:
+    example = clear_urls.ClearURLsProvider(
+        provider="example",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    other = clear_urls.ClearURLsProvider(
+        provider="other",
+        url_pattern=r"^https?:\/\/(?:[a-z0-9-]+\.)*?other\.com",
+        rule_patterns=["ref"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    index = clear_urls.ProviderIndex([example, other])
+    dirty_urls = [
+        "https://example.com/a?utm_source=test&id=1",
+        "https://other.com/b?ref=test",
+        "https://example.com/c?utm_source=test",
+        "https://unknown.com/d?utm_source=test",
+        " https://example.com/a?utm_source=test&id=1 ",
+    ]
+
+    with (
+        mock.patch.object(clear_urls, "engine", clear_urls.ClearURLsEngine(index)),
+        mock.patch.object(
+            index, "candidates_for_authority", wraps=index.candidates_for_authority
+        ) as mock_candidates,
+    ):
+        assert clear_urls.strip_trackers_many(dirty_urls) == [
+            "https://example.com/a?id=1",
+            "https://other.com/b",
+            "https://example.com/c",
+            "https://unknown.com/d?utm_source=test",
+            "https://example.com/a?id=1",
+        ]
+        # Candidates are resolved once per authority
+        assert mock_candidates.call_count == 3
+
+        # Results are shared with strip_trackers through the cache
+        assert clear_urls.strip_trackers(dirty_urls[1]) == "https://other.com/b"
+        assert mock_candidates.call_count == 3
+
+
+def test_strip_trackers_many_no_providers() -> None:
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        pytest.raises(exception.MemebotInternalError),
+    ):
+        clear_urls.strip_trackers_many(["https://example.com/page"])
+
+
+def test_build_engine_reuses_current_providers() -> None:
+    current_engine = clear_urls._build_engine(TEST_RULES)
+
+    with mock.patch.object(clear_urls, "engine", current_engine):
+        new_engine = clear_urls._build_engine(TEST_RULES)
+
+    assert new_engine is not current_engine
+    assert new_engine.rules_checksum == clear_urls._compute_rules_checksum(TEST_RULES)
+    assert new_engine.loaded_at >= current_engine.loaded_at
+    assert list(new_engine.providers) == list(current_engine.providers)
+
+
+def test_publish_engine_clears_result_cache() -> None:
+    result_cache = clear_urls.get_result_cache()
+    result_cache.put(("", "https://example.com"), "https://example.com")
+
+    with mock.patch.object(
+        clear_urls, "engine", clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([]))
+    ):
+        new_engine = clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([]))
+        clear_urls._publish_engine(new_engine)
+
+        assert clear_urls.engine is new_engine
+        assert len(result_cache) == 0
+
+
+def test_strip_trackers_no_providers() -> None:
+    with mock.patch.object(
+        clear_urls, "engine", clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([]))
+    ):
+        url = "https://example.com/page?utm_source=test"
+
+        # Should raise an exception when no providers are available
+        with pytest.raises(exception.MemebotInternalError):
+            clear_urls.strip_trackers(url)
+
+
+def test_strip_trackers_does_not_download_rules() -> None:
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
+        ),
+        mock.patch.object(
+            clear_urls,
+            "rules_last_download",
+            datetime.fromtimestamp(0.0, tz=UTC),
+        ),
+        mock.patch.object(clear_urls, "_download_new_rules") as mock_download,
+    ):
+        clear_urls.strip_trackers("https://example.com/page?utm_source=test")
+        mock_download.assert_not_called()
+
+
+TEST_RULES = r"""
+{
+    "providers": {
+        "test_provider": {
+            "urlPattern": "^https?:\\/\\/example\\.com",
+            "rules": ["utm_source"]
+        }
+    }
+}
+"""
+
+
+@pytest.mark.asyncio
+async def test_refresh_providers_collapses_concurrent_refreshes() -> None:
+    download_started = threading.Event()
+    release_download = threading.Event()
+
+    def slow_download(_: str) -> str:
+        download_started.set()
+        release_download.wait(timeout=5)
+        return TEST_RULES
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        mock.patch.object(
+            clear_urls, "_download_new_rules", side_effect=slow_download
+        ) as mock_download,
+    ):
+        refreshes = asyncio.gather(
+            clear_urls.refresh_providers(),
+            clear_urls.refresh_providers(),
+            clear_urls.refresh_providers(),
+        )
+        # The event loop is not blocked while the download is in flight
+        await asyncio.to_thread(download_started.wait, 5)
+        assert not clear_urls.engine.providers
+        release_download.set()
+        await refreshes
+
+        mock_download.assert_called_once()
+        assert any(p.provider == "test_provider" for p in clear_urls.engine.providers)
+
+
+@pytest.mark.asyncio
+async def test_refresh_providers_keeps_old_providers_on_failure() -> None:
+    old_engine = clear_urls.ClearURLsEngine(
+        clear_urls.ProviderIndex(
+            [clear_urls.ClearURLsProvider("old", r".*", None, None, None, None, None)]
+        )
+    )
+
+    with (
+        mock.patch.object(clear_urls, "engine", old_engine),
+        mock.patch.object(
+            clear_urls,
+            "_download_new_rules",
+            side_effect=urllib.error.URLError("unreachable"),
+        ),
+    ):
+        await clear_urls.refresh_providers()
+        assert clear_urls.engine is old_engine
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_refresh_providers_keeps_old_providers_on_timeout() -> None:
+    old_engine = clear_urls.ClearURLsEngine(
+        clear_urls.ProviderIndex(
+            [clear_urls.ClearURLsProvider("old", r".*", None, None, None, None, None)]
+        )
+    )
+    config.database_enabled = False
+    config.clearurls_rules_url = "https://rules.example.com/data.json"
+
+    with (
+        mock.patch.object(clear_urls, "engine", old_engine),
+        mock.patch(
+            "urllib.request.urlopen", side_effect=TimeoutError("timed out")
+        ) as mock_urlopen,
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        assert await clear_urls.refresh_providers() is False
+        assert clear_urls.engine is old_engine
+
+    assert mock_urlopen.call_args.kwargs["timeout"] == (
+        clear_urls._DOWNLOAD_TIMEOUT.total_seconds()
+    )
+    assert "timed out" in mock_log_warning.call_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_refresh_providers_fails_without_providers() -> None:
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        mock.patch.object(
+            clear_urls,
+            "_download_new_rules",
+            side_effect=urllib.error.URLError("unreachable"),
+        ),
+        pytest.raises(urllib.error.URLError),
+    ):
+        await clear_urls.refresh_providers()
+
+
+@pytest.fixture
+def rules_state() -> Iterator[None]:
+    """
+    Restores the module-level state of the downloaded rules after a test
+    """
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        mock.patch.object(
+            clear_urls, "rules_last_download", datetime.fromtimestamp(0.0, tz=UTC)
+        ),
+        mock.patch.object(clear_urls, "rules_etag", None),
+        mock.patch.object(clear_urls, "rules_last_modified", None),
+    ):
+        yield
+
+
+def mock_manifest(data: str, headers: dict[str, str]) -> mock.MagicMock:
+    manifest = mock.MagicMock()
+    manifest.__enter__.return_value.read.return_value = data.encode()
+    manifest.__enter__.return_value.headers = headers
+    return manifest
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_download_new_rules_saves_snapshot() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    with mock.patch(
+        "urllib.request.urlopen",
+        return_value=mock_manifest(
+            TEST_RULES,
+            {"ETag": '"abc"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+        ),
+    ):
+        assert clear_urls._download_new_rules(rules_url) == TEST_RULES.strip()
+
+    downloaded = clear_urls.rules_last_download
+    clear_urls._forget_rules()
+
+    assert clear_urls._load_rules_snapshot(rules_url) == TEST_RULES.strip()
+    assert clear_urls.rules_last_download == downloaded
+    assert clear_urls.rules_etag == '"abc"'
+    assert clear_urls.rules_last_modified == "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    # Snapshots are only used for the URL they were downloaded from
+    assert clear_urls._load_rules_snapshot("https://other.example.com") == ""
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_download_new_rules_not_modified() -> None:
+    clear_urls.rules_etag = '"abc"'
+    clear_urls.rules_last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    with (
+        mock.patch.object(
+            clear_urls, "engine", clear_urls._build_engine(TEST_RULES.strip())
+        ),
+        mock.patch(
+            "urllib.request.urlopen",
+            side_effect=urllib.error.HTTPError(
+                "https://rules.example.com", 304, "Not Modified", Message(), None
+            ),
+        ) as mock_urlopen,
+    ):
+        assert clear_urls._download_new_rules("https://rules.example.com") == ""
+
+        [request] = mock_urlopen.call_args.args
+        assert request.get_header("If-none-match") == '"abc"'
+        assert (
+            request.get_header("If-modified-since") == "Wed, 21 Oct 2015 07:28:00 GMT"
+        )
+    assert clear_urls.rules_last_download > datetime.fromtimestamp(0.0, tz=UTC)
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_download_new_rules_without_current_rules_is_unconditional() -> None:
+    clear_urls.rules_etag = '"abc"'
+    clear_urls.rules_last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    with mock.patch(
+        "urllib.request.urlopen", return_value=mock_manifest(TEST_RULES, {})
+    ) as mock_urlopen:
+        assert clear_urls._download_new_rules("https://rules.example.com") != ""
+
+    [request] = mock_urlopen.call_args.args
+    assert not request.has_header("If-none-match")
+    assert not request.has_header("If-modified-since")
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_build_engine_forgets_rules_on_any_failure() -> None:
+    clear_urls.rules_etag = '"abc"'
+    clear_urls.rules_last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    with (
+        mock.patch.object(
+            clear_urls, "_read_rules_files", side_effect=OSError("unreadable")
+        ),
+        pytest.raises(OSError, match="unreadable"),
+    ):
+        clear_urls._build_engine(TEST_RULES)
+
+    assert clear_urls.rules_etag is None
+    assert clear_urls.rules_last_modified is None
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_download_new_rules_raises_other_http_errors() -> None:
+    with (
+        mock.patch(
+            "urllib.request.urlopen",
+            side_effect=urllib.error.HTTPError(
+                "https://rules.example.com", 500, "Server Error", Message(), None
+            ),
+        ),
+        pytest.raises(urllib.error.HTTPError),
+    ):
+        clear_urls._download_new_rules("https://rules.example.com")
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_rules_snapshot_ignores_corrupt_rules() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    with mock.patch(
+        "urllib.request.urlopen", return_value=mock_manifest(TEST_RULES, {})
+    ):
+        clear_urls._download_new_rules(rules_url)
+    clear_urls._forget_rules()
+
+    (config.clearurls_cache_dir / "rules.json").write_text("{}")
+
+    assert clear_urls._load_rules_snapshot(rules_url) == ""
+    assert clear_urls.rules_etag is None
+
+
+def test_load_rules_snapshot_missing() -> None:
+    assert clear_urls._load_rules_snapshot("https://rules.example.com") == ""
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_new_engine_without_database() -> None:
+    config.database_enabled = False
+    config.clearurls_rules_url = "https://rules.example.com/data.json"
+
+    with mock.patch(
+        "urllib.request.urlopen", return_value=mock_manifest(TEST_RULES, {})
+    ) as mock_urlopen:
+        new_engine = clear_urls._load_new_engine()
+
+    mock_urlopen.assert_called_once()
+    assert new_engine is not None
+    assert any(p.provider == "test_provider" for p in new_engine.providers)
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_new_engine_falls_back_on_database_error() -> None:
+    collection = mock.MagicMock()
+    collection.find_one.side_effect = pymongo.errors.ServerSelectionTimeoutError()
+    config.clearurls_rules_url = "https://rules.example.com/data.json"
+
+    with (
+        mock.patch("memebot.db.get_collection", return_value=collection),
+        mock.patch(
+            "urllib.request.urlopen", return_value=mock_manifest(TEST_RULES, {})
+        ) as mock_urlopen,
+    ):
+        new_engine = clear_urls._load_new_engine()
+
+    mock_urlopen.assert_called_once()
+    assert new_engine is not None
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_shared_engine_uses_rules_from_other_replica() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    checksum = clear_urls._compute_rules_checksum(TEST_RULES)
+    downloaded = datetime.now(UTC)
+    metadata = {
+        "_id": rules_url,
+        "checksum": checksum,
+        "etag": '"abc"',
+        "last_modified": None,
+        "downloaded": downloaded.isoformat(),
+    }
+    collection = mock.MagicMock()
+    collection.find_one.side_effect = [metadata, metadata | {"rules": TEST_RULES}]
+    config.clearurls_rules_refresh_hours = timedelta(hours=24)
+
+    with mock.patch("urllib.request.urlopen") as mock_urlopen:
+        new_engine = clear_urls._load_shared_engine(collection, rules_url)
+
+    mock_urlopen.assert_not_called()
+    collection.update_one.assert_not_called()
+    assert new_engine is not None
+    assert new_engine.rules_checksum == checksum
+    assert clear_urls.rules_last_download == downloaded
+    assert clear_urls.rules_etag == '"abc"'
+
+    # Nothing is loaded once this replica is up to date
+    collection.find_one.side_effect = [metadata]
+    with mock.patch.object(clear_urls, "engine", new_engine):
+        assert clear_urls._load_shared_engine(collection, rules_url) is None
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_shared_engine_fetches_for_other_replicas() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    collection = mock.MagicMock()
+    collection.find_one.return_value = None
+    config.clearurls_rules_refresh_hours = timedelta(hours=24)
+
+    with mock.patch(
+        "urllib.request.urlopen",
+        return_value=mock_manifest(TEST_RULES, {"ETag": '"abc"'}),
+    ):
+        new_engine = clear_urls._load_shared_engine(collection, rules_url)
+
+    assert new_engine is not None
+    lease, shared_rules, release = collection.update_one.call_args_list
+    assert lease.args[1]["$set"]["lease_owner"] == clear_urls._REPLICA_ID
+    assert shared_rules.args[1]["$set"]["rules"] == TEST_RULES.strip()
+    assert shared_rules.args[1]["$set"]["checksum"] == new_engine.rules_checksum
+    assert shared_rules.args[1]["$set"]["etag"] == '"abc"'
+    assert release.args[1] == {"$unset": {"lease_owner": "", "lease_expires": ""}}
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_shared_engine_records_refused_rules() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    current_engine = clear_urls._build_engine(TEST_RULES)
+    collection = mock.MagicMock()
+    collection.find_one.return_value = {
+        "_id": rules_url,
+        "checksum": current_engine.rules_checksum,
+        "etag": '"abc"',
+        "last_modified": None,
+        "downloaded": datetime.fromtimestamp(0.0, tz=UTC).isoformat(),
+    }
+    config.clearurls_rules_refresh_hours = timedelta(hours=24)
+    new_rules = TEST_RULES.replace("utm_source", "utm_medium")
+
+    with (
+        mock.patch.object(clear_urls, "engine", current_engine),
+        mock.patch(
+            "urllib.request.urlopen",
+            return_value=mock_manifest(new_rules, {"ETag": '"def"'}),
+        ),
+        mock.patch.object(
+            clear_urls,
+            "_evaluate_canary",
+            side_effect=exception.MemebotInternalError("refused"),
+        ),
+        pytest.raises(exception.MemebotInternalError),
+    ):
+        clear_urls._load_shared_engine(collection, rules_url)
+
+    _, refused, release = collection.update_one.call_args_list
+    assert refused.args[1]["$set"] == {
+        "etag": None,
+        "last_modified": None,
+        "downloaded": clear_urls.rules_last_download.isoformat(),
+        "refused_checksum": clear_urls._compute_rules_checksum(new_rules.strip()),
+    }
+    assert clear_urls.rules_last_download > datetime.fromtimestamp(0.0, tz=UTC)
+    assert release.args[1] == {"$unset": {"lease_owner": "", "lease_expires": ""}}
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_shared_engine_leaves_fetch_to_lease_holder() -> None:
+    collection = mock.MagicMock()
+    collection.find_one.return_value = None
+    collection.update_one.side_effect = pymongo.errors.DuplicateKeyError("lease")
+    config.clearurls_rules_refresh_hours = timedelta(hours=24)
+
+    with mock.patch("urllib.request.urlopen") as mock_urlopen:
+        assert (
+            clear_urls._load_shared_engine(collection, "https://rules.example.com")
+            is None
+        )
+
+    mock_urlopen.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_background_refresh_starts_from_snapshot() -> None:
+    rules_url = "https://rules.example.com/data.json"
+    with (
+        mock.patch.object(config, "clearurls_rules_url", rules_url),
+        mock.patch(
+            "urllib.request.urlopen", return_value=mock_manifest(TEST_RULES, {})
+        ),
+    ):
+        clear_urls._download_new_rules(rules_url)
+    clear_urls._forget_rules()
+
+    with (
+        mock.patch.object(config, "clearurls_rules_url", rules_url),
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        mock.patch.object(clear_urls, "_download_new_rules") as mock_download,
+    ):
+        await clear_urls._load_providers_from_snapshot()
+
+        assert any(p.provider == "test_provider" for p in clear_urls.engine.providers)
+        mock_download.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_background_refresh_waits_when_nothing_was_loaded() -> None:
+    config.database_enabled = False
+
+    with (
+        mock.patch.object(config, "clearurls_rules_url", "https://rules.example.com"),
+        mock.patch.object(clear_urls, "refresh_providers") as mock_refresh,
+        mock.patch("asyncio.sleep", side_effect=asyncio.CancelledError) as mock_sleep,
+        pytest.raises(asyncio.CancelledError),
+    ):
+        await clear_urls._refresh_providers_periodically()
+
+    mock_refresh.assert_awaited_once()
+    mock_sleep.assert_awaited_once_with(clear_urls._REFRESH_RETRY_DELAY.total_seconds())
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_background_refresh_polls_while_lease_holder_fetches() -> None:
+    collection = mock.MagicMock()
+    collection.find_one.return_value = None
+    collection.update_one.side_effect = pymongo.errors.DuplicateKeyError("lease")
+    config.database_enabled = True
+
+    with (
+        mock.patch.object(config, "clearurls_rules_url", "https://rules.example.com"),
+        mock.patch("memebot.db.get_collection", return_value=collection),
+        mock.patch("urllib.request.urlopen") as mock_urlopen,
+        mock.patch("asyncio.sleep", side_effect=asyncio.CancelledError) as mock_sleep,
+        pytest.raises(asyncio.CancelledError),
+    ):
+        await clear_urls._refresh_providers_periodically()
+
+    mock_urlopen.assert_not_called()
+    mock_sleep.assert_awaited_once_with(
+        clear_urls._SHARED_RULES_POLL_INTERVAL.total_seconds()
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_background_refresh_waits_after_failed_refresh() -> None:
+    old_engine = clear_urls.ClearURLsEngine(
+        clear_urls.ProviderIndex(
+            [clear_urls.ClearURLsProvider("old", r".*", None, None, None, None, None)]
+        )
+    )
+    config.database_enabled = False
+
+    with (
+        mock.patch.object(config, "clearurls_rules_url", "https://rules.example.com"),
+        mock.patch.object(clear_urls, "engine", old_engine),
+        mock.patch.object(
+            clear_urls, "refresh_providers", return_value=False
+        ) as mock_refresh,
+        mock.patch(
+            "asyncio.sleep", side_effect=[None, asyncio.CancelledError]
+        ) as mock_sleep,
+        pytest.raises(asyncio.CancelledError),
+    ):
+        await clear_urls._refresh_providers_periodically()
+
+    mock_refresh.assert_awaited_once()
+    # The rules were due, and are retried after the retry delay
+    assert mock_sleep.await_args_list[1].args == (
+        clear_urls._REFRESH_RETRY_DELAY.total_seconds(),
+    )
+
+
+def test_json_to_provider() -> None:
+    provider_data = {
+        "urlPattern": r"^https?:\/\/example\.com",
+        "rules": ["utm_source", "utm_medium"],
+        "redirections": [r"^https?:\/\/example\.com\/redirect\?url=(.*)$"],
+    }
+
+    provider = clear_urls._json_to_provider("test_provider", provider_data)
+
+    assert provider is not None
+
+    assert provider.provider == "test_provider"
+    assert provider.literal_rules == {"utm_source", "utm_medium"}
+    assert provider.rules_pattern is None
+    assert len(provider.redirections) == 1
+
+
+def test_json_to_provider_invalid() -> None:
+    # Missing urlPattern
+    invalid_data = {"rules": ["utm_source"]}
+
+    with mock.patch("memebot.log.exception") as mock_log_exc:
+        result = clear_urls._json_to_provider("invalid_provider", invalid_data)
+        assert result is None
+        mock_log_exc.assert_called_once()
+
+
+def test_json_to_provider_quarantines_catastrophic_url_pattern() -> None:
+    provider_data = {"urlPattern": r"^https?:\/\/(?:[a-z]+)+\.com", "rules": ["a"]}
+
+    with mock.patch("memebot.log.warning") as mock_log_warning:
+        assert clear_urls._json_to_provider("test_provider", provider_data) is None
+        mock_log_warning.assert_called_once()
+
+
+def test_convert_rules_to_providers() -> None:
+    rules_json = r"""
+    {
+        "providers": {
+            "test_provider": {
+                "urlPattern": "^https?:\\/\\/example\\.com",
+                "rules": ["utm_source", "utm_medium"]
+            },
+            "another_provider": {
+                "urlPattern": "^https?:\\/\\/another\\.com",
+                "rules": ["ref"]
+            }
+        }
+    }
+    """
+
+    providers = clear_urls._convert_rules_to_providers(rules_json)
+
+    assert len(providers) == 2
+    assert any(p.provider == "test_provider" for p in providers)
+    assert any(p.provider == "another_provider" for p in providers)
+
+
+def test_convert_rules_to_providers_reuses_unchanged_providers() -> None:
+    old_rules = {
+        "providers": {
+            "unchanged": {"urlPattern": r"^https?:\/\/unchanged\.com", "rules": ["a"]},
+            "changed": {"urlPattern": r"^https?:\/\/changed\.com", "rules": ["a"]},
+            "dropped": {"urlPattern": r"^https?:\/\/dropped\.com", "rules": ["a"]},
+        }
+    }
+    new_rules = {
+        "providers": {
+            "unchanged": {"urlPattern": r"^https?:\/\/unchanged\.com", "rules": ["a"]},
+            "changed": {"urlPattern": r"^https?:\/\/changed\.com", "rules": ["b"]},
+            "added": {"urlPattern": r"^https?:\/\/added\.com", "rules": ["a"]},
+        }
+    }
+    old_providers = clear_urls._convert_rules_to_providers(json.dumps(old_rules))
+    old_by_name = {p.provider: p for p in old_providers}
+
+    with (
+        mock.patch(
+            "memebot.integrations.clear_urls._json_to_provider",
+            wraps=clear_urls._json_to_provider,
+        ) as mock_json_to_provider,
+        mock.patch("memebot.log.info") as mock_log_info,
+    ):
+        new_providers = clear_urls._convert_rules_to_providers(
+            json.dumps(new_rules), old_providers
+        )
+
+    new_by_name = {p.provider: p for p in new_providers}
+    assert list(new_by_name) == ["unchanged", "changed", "added"]
+    assert new_by_name["unchanged"] is old_by_name["unchanged"]
+    assert new_by_name["changed"] is not old_by_name["changed"]
+    assert new_by_name["changed"].is_tracking_param("b")
+    assert not new_by_name["changed"].is_tracking_param("a")
+    assert [call.args[0] for call in mock_json_to_provider.call_args_list] == [
+        "changed",
+        "added",
+    ]
+    mock_log_info.assert_any_call(
+        "Reused 1, rebuilt 2 and dropped 1 ClearURLs providers"
+    )
+
+
+def test_convert_rules_to_providers_shares_patterns() -> None:
+    provider_data = {
+        "rules": ["utm_source", "gs_[a-z]*"],
+        "exceptions": [r"^https?:\/\/[^/]+\/login"],
+    }
+    rules = {
+        "providers": {
+            "a": provider_data | {"urlPattern": r"^https?:\/\/a\.com"},
+            "b": provider_data | {"urlPattern": r"^https?:\/\/b\.com"},
+        }
+    }
+
+    a, b = clear_urls._convert_rules_to_providers(json.dumps(rules))
+
+    assert not hasattr(a, "__dict__")
+    assert a.rules_pattern is b.rules_pattern
+    assert a.exceptions[0] is b.exceptions[0]
+    assert next(iter(a.literal_rules)) is next(iter(b.literal_rules))
+    assert a.url_pattern is not b.url_pattern
+
+
+def test_interner() -> None:
+    interner = clear_urls._Interner()
+    first = "".join(["utm_", "source"])
+    second = "".join(["utm_", "source"])
+
+    assert interner.strings([first]) is interner.strings([second])
+    assert interner.strings([second])[0] is first
+    assert interner.compile("a+") is interner.compile("a+")
+    assert interner.compile("a+") is not interner.compile("a+", re.IGNORECASE)
+
+    # Compiled patterns are still shared once the refresh is done
+    interner.finish_refresh()
+    assert interner.intern(second) is second
+    assert interner.compile("a+") is interner.compile("a+")
+
+
+def write_rules_file(
+    path: pathlib.Path, providers: dict[str, Any], mtime_ns: int
+) -> pathlib.Path:
+    path.write_text(json.dumps({"providers": providers}))
+    # Modification times are set explicitly, since writes in quick succession may
+    # share one
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_convert_rules_to_providers_merges_rules_files(tmp_path: pathlib.Path) -> None:
+    rules = {
+        "providers": {
+            "replaced": {"urlPattern": r"^https?:\/\/replaced\.com", "rules": ["a"]},
+            "removed": {"urlPattern": r"^https?:\/\/removed\.com", "rules": ["a"]},
+            "kept": {"urlPattern": r"^https?:\/\/kept\.com", "rules": ["a"]},
+        }
+    }
+    first = write_rules_file(
+        tmp_path / "first.json",
+        {
+            "replaced": {"urlPattern": r"^https?:\/\/replaced\.com", "rules": ["b"]},
+            "added": {"urlPattern": r"^https?:\/\/added\.com", "rules": ["b"]},
+        },
+        10**9,
+    )
+    second = write_rules_file(
+        tmp_path / "second.json",
+        {
+            "added": {"urlPattern": r"^https?:\/\/added\.com", "rules": ["c"]},
+            "removed": None,
+        },
+        10**9,
+    )
+    rules_files = [
+        clear_urls._read_rules_file(first, None),
+        clear_urls._read_rules_file(second, None),
+    ]
+
+    providers = {
+        p.provider: p
+        for p in clear_urls._convert_rules_to_providers(
+            json.dumps(rules), rules_files=rules_files
+        )
+    }
+
+    assert list(providers) == ["replaced", "kept", "added"]
+    assert providers["replaced"].is_tracking_param("b")
+    assert not providers["replaced"].is_tracking_param("a")
+    assert providers["added"].is_tracking_param("c")
+
+    # The rules files can be used without any other rules
+    providers = {
+        p.provider: p
+        for p in clear_urls._convert_rules_to_providers("", rules_files=rules_files)
+    }
+    assert list(providers) == ["replaced", "added"]
+
+
+def test_convert_rules_to_providers_without_any_providers(
+    tmp_path: pathlib.Path,
+) -> None:
+    rules_file = write_rules_file(tmp_path / "rules.json", {"removed": None}, 10**9)
+
+    with pytest.raises(exception.MemebotInternalError):
+        clear_urls._convert_rules_to_providers(
+            "", rules_files=[clear_urls._read_rules_file(rules_file, None)]
+        )
+
+
+@pytest.mark.parametrize(
+    "rules", ["not json", "[]", '{"providers": []}', '{"providers": {"a": 1}}']
+)
+def test_read_rules_file_malformed(tmp_path: pathlib.Path, rules: str) -> None:
+    path = tmp_path / "rules.json"
+    path.write_text(rules)
+
+    with pytest.raises(exception.MemebotInternalError):
+        clear_urls._read_rules_file(path, None)
+
+
+def test_build_engine_reads_rules_files(tmp_path: pathlib.Path) -> None:
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    rules_file = write_rules_file(tmp_path / "rules.json", {"local": provider}, 10**9)
+    config.clearurls_rules_files = [rules_file]
+
+    current_engine = clear_urls._build_engine(TEST_RULES)
+
+    assert [f.path for f in current_engine.rules_files] == [
+        clear_urls._CUSTOM_RULES_FILE,
+        rules_file,
+    ]
+    assert (
+        current_engine.strip_trackers("https://local.com/?a=1") == "https://local.com/"
+    )
+    assert current_engine.checksum != current_engine.rules_checksum
+
+    # Unmodified rules files are not read again
+    with (
+        mock.patch.object(clear_urls, "engine", current_engine),
+        mock.patch.object(pathlib.Path, "read_text") as mock_read_text,
+    ):
+        new_engine = clear_urls._build_engine(TEST_RULES)
+    mock_read_text.assert_not_called()
+    assert new_engine.rules_files == current_engine.rules_files
+    assert new_engine.checksum == current_engine.checksum
+
+
+def test_build_engine_skips_unreadable_rules_files(tmp_path: pathlib.Path) -> None:
+    rules_file = tmp_path / "rules.json"
+    config.clearurls_rules_files = [rules_file]
+
+    with mock.patch("memebot.log.warning") as mock_log_warning:
+        current_engine = clear_urls._build_engine(TEST_RULES)
+        mock_log_warning.assert_called_once()
+        assert str(rules_file) in mock_log_warning.call_args.args[0]
+
+        # The missing file is only warned about once
+        with mock.patch.object(clear_urls, "engine", current_engine):
+            assert clear_urls._load_rules_files_engine() is None
+            assert clear_urls._build_engine(TEST_RULES).rules_files == (
+                current_engine.rules_files
+            )
+        mock_log_warning.assert_called_once()
+
+    assert any(p.provider == "test_provider" for p in current_engine.providers)
+
+    # The file is read once it appears
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    write_rules_file(rules_file, {"local": provider}, 10**9)
+    with mock.patch.object(clear_urls, "engine", current_engine):
+        new_engine = clear_urls._load_rules_files_engine()
+    assert new_engine is not None
+    assert new_engine.strip_trackers("https://local.com/?a=1") == "https://local.com/"
+
+
+def test_load_rules_files_engine_only_reloads_changed_files(
+    tmp_path: pathlib.Path,
+) -> None:
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    rules_file = write_rules_file(tmp_path / "rules.json", {"local": provider}, 10**9)
+    config.clearurls_rules_files = [rules_file]
+    current_engine = clear_urls._build_engine(TEST_RULES)
+
+    with mock.patch.object(clear_urls, "engine", current_engine):
+        assert clear_urls._load_rules_files_engine() is None
+
+        write_rules_file(rules_file, {"local": provider | {"rules": ["b"]}}, 2 * 10**9)
+        new_engine = clear_urls._load_rules_files_engine()
+
+    assert new_engine is not None
+    assert new_engine.rules is current_engine.rules
+    assert new_engine.rules_checksum == current_engine.rules_checksum
+    assert new_engine.checksum != current_engine.checksum
+    assert new_engine.strip_trackers("https://local.com/?a=1&b=2") == (
+        "https://local.com/?a=1"
+    )
+    # Providers of the unchanged rules are reused
+    assert next(iter(new_engine.providers)) is next(iter(current_engine.providers))
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_load_new_engine_without_rules_url(tmp_path: pathlib.Path) -> None:
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    config.clearurls_rules_url = ""
+    config.clearurls_rules_files = [
+        write_rules_file(tmp_path / "rules.json", {"local": provider}, 10**9)
+    ]
+
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        mock.patch("urllib.request.urlopen") as mock_urlopen,
+    ):
+        new_engine = clear_urls._load_new_engine()
+        assert new_engine is not None
+        assert new_engine.strip_trackers("https://local.com/?a=1") == (
+            "https://local.com/"
+        )
+
+        # Nothing is reloaded until the rules files change
+        with mock.patch.object(clear_urls, "engine", new_engine):
+            assert clear_urls._load_new_engine() is None
+
+    mock_urlopen.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_reload_rules_files_keeps_engine_on_failure(
+    tmp_path: pathlib.Path,
+) -> None:
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    rules_file = write_rules_file(tmp_path / "rules.json", {"local": provider}, 10**9)
+    config.clearurls_rules_files = [rules_file]
+    current_engine = clear_urls._build_engine(TEST_RULES)
+    rules_file.write_text("{")
+
+    with (
+        mock.patch.object(clear_urls, "engine", current_engine),
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        await clear_urls.reload_rules_files()
+
+        assert clear_urls.engine is current_engine
+        mock_log_warning.assert_called_once()
+
+
+def write_canary_corpus(path: pathlib.Path, urls: list[str]) -> pathlib.Path:
+    path.write_text("\n".join(urls))
+    config.clearurls_canary_corpus = path
+    return path
+
+
+def test_clean_bypasses_result_cache() -> None:
+    current_engine = clear_urls._build_engine(TEST_RULES)
+    clear_urls.get_result_cache().put(
+        (current_engine.checksum, "https://example.com/?utm_source=a"), "cached"
+    )
+
+    assert current_engine.clean(" https://example.com/?utm_source=a ") == (
+        "https://example.com/"
+    )
+    assert len(clear_urls.get_result_cache()) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("rules_state")
+async def test_refresh_providers_refuses_rules_failing_canary(
+    tmp_path: pathlib.Path,
+) -> None:
+    rules_url = "https://rules.example.com/data.json"
+    config.clearurls_rules_url = rules_url
+    write_canary_corpus(tmp_path / "corpus.txt", ["https://example.com/?id=1"])
+    new_rules = json.dumps(
+        {
+            "providers": {
+                "test_provider": {
+                    "urlPattern": r"^https?:\/\/example\.com",
+                    "rules": ["utm_source", "id"],
+                }
+            }
+        }
+    )
+
+    with mock.patch(
+        "urllib.request.urlopen",
+        return_value=mock_manifest(TEST_RULES, {"ETag": '"old"'}),
+    ):
+        await clear_urls.refresh_providers()
+    current_engine = clear_urls.engine
+    assert current_engine.providers
+
+    with (
+        mock.patch(
+            "urllib.request.urlopen",
+            return_value=mock_manifest(new_rules, {"ETag": '"new"'}),
+        ),
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        await clear_urls.refresh_providers()
+
+    assert clear_urls.engine is current_engine
+    [summary], [refusal] = (call.args for call in mock_log_warning.call_args_list)
+    assert "    + https://example.com/" in summary
+    assert "Refused to publish new ClearURLs rules: 100.0%" in refusal
+    # The refused rules are downloaded in full next time, and are not loaded on restart
+    assert clear_urls.rules_etag is None
+    assert clear_urls._load_rules_snapshot(rules_url) == TEST_RULES.strip()
+
+
+@pytest.mark.usefixtures("rules_state")
+def test_build_engine_publishes_rules_passing_canary(tmp_path: pathlib.Path) -> None:
+    write_canary_corpus(
+        tmp_path / "corpus.txt",
+        ["https://example.com/?utm_source=a", "https://other.com/?ref=1"],
+    )
+    new_rules = json.dumps(
+        {
+            "providers": {
+                "test_provider": {
+                    "urlPattern": r"^https?:\/\/example\.com",
+                    "rules": ["utm_source"],
+                },
+                "other": {"urlPattern": r"^https?:\/\/other\.com", "rules": ["ref"]},
+            }
+        }
+    )
+    config.clearurls_canary_max_changed_percent = 50.0
+    config.clearurls_canary_max_slowdown_percent = float("inf")
+
+    with mock.patch.object(clear_urls, "engine", clear_urls._build_engine(TEST_RULES)):
+        with mock.patch("memebot.log.info") as mock_log_info:
+            new_engine = clear_urls._build_engine(new_rules)
+        assert "1 cleaned differently (50.0%)" in str(mock_log_info.call_args_list)
+
+        config.clearurls_canary_max_changed_percent = 0.0
+        with pytest.raises(exception.MemebotInternalError):
+            clear_urls._build_engine(new_rules)
+
+    # Evaluating the canary is not counted as traffic
+    assert clear_urls.metrics.registry.providers == {}
+    assert clear_urls.metrics.registry.calls == {}
+    assert new_engine.strip_trackers("https://other.com/?ref=1") == "https://other.com/"
+
+
+def test_rules_files_skip_canary(tmp_path: pathlib.Path) -> None:
+    provider = {"urlPattern": r"^https?:\/\/local\.com", "rules": ["a"]}
+    rules_file = write_rules_file(tmp_path / "rules.json", {"local": provider}, 10**9)
+    config.clearurls_rules_files = [rules_file]
+    write_canary_corpus(tmp_path / "corpus.txt", ["https://local.com/?a=1&b=2"])
+    config.clearurls_canary_max_changed_percent = 0.0
+
+    with mock.patch.object(clear_urls, "engine", clear_urls._build_engine(TEST_RULES)):
+        write_rules_file(rules_file, {"local": provider | {"rules": ["b"]}}, 2 * 10**9)
+        new_engine = clear_urls._load_rules_files_engine()
+
+    assert new_engine is not None
+    assert new_engine.strip_trackers("https://local.com/?a=1&b=2") == (
+        "https://local.com/?a=1"
+    )
+
+
+@pytest.mark.parametrize(
+    ("url_pattern", "expected_keys"),
+    [
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?amazon(?:\.[a-z]{2,}){1,}", ["amazon"]),
+        (
+            r"^https?:\/\/(?:[a-z0-9-]+\.)*?fls-na\.amazon(?:\.[a-z]{2,}){1,}",
+            ["fls-na"],
+        ),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?net\-parade\.it", ["net-parade"]),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?twitter.com", ["twitter"]),
+        (r"^https?:\/\/(?:accounts\.)?firefox\.com", ["firefox"]),
+        (r"https?:\/\/([a-z0-9-.]*\.)shutterstock\.com", ["shutterstock"]),
+        (r"^https?:\/\/vk\.com", ["vk"]),
+        (
+            r"^https?:\/\/(?:[a-z0-9-]+\.)*?(?:yandex(?:\.[a-z]{2,}){1,}|ya\.ru)",
+            ["yandex", "ya"],
+        ),
+        (r".*", None),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?example", None),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?example(?:\.[a-z]{2,})?", None),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?(?:foo\.com|bar\.com)?", None),
+        (r"^https?:\/\/[a-z]*example\.com", None),
+    ],
+)
+def test_host_index_keys(url_pattern: str, expected_keys: list[str] | None) -> None:
+    assert clear_urls._host_index_keys(url_pattern) == expected_keys
+
+
+def test_provider_index_candidates() -> None:
+    def make_provider(name: str, url_pattern: str) -> clear_urls.ClearURLsProvider:
+        return clear_urls.ClearURLsProvider(
+            provider=name,
+            url_pattern=url_pattern,
+            rule_patterns=None,
+            raw_rule_patterns=None,
+            referral_marketing_patterns=None,
+            redirection_patterns=None,
+            exception_patterns=None,
+        )
+
+    global_provider = make_provider("global", r".*")
+    amazon = make_provider(
+        "amazon", r"^https?:\/\/(?:[a-z0-9-]+\.)*?amazon(?:\.[a-z]{2,}){1,}"
+    )
+    amazon_search = make_provider(
+        "amazon_search",
+        r"^https?:\/\/(?:[a-z0-9-]+\.)*?amazon(?:\.[a-z]{2,}){1,}\/s\?",
+    )
+    example = make_provider("example", r"^https?:\/\/(?:[a-z0-9-]+\.)*?example\.com")
+
+    index = clear_urls.ProviderIndex([amazon, global_provider, example, amazon_search])
+
+    assert len(index) == 4
+    assert list(index) == [amazon, global_provider, example, amazon_search]
+    assert index.global_providers == [global_provider]
+    assert index.candidates("https://www.amazon.co.uk/s?k=foo") == [
+        amazon,
+        global_provider,
+        amazon_search,
+    ]
+    assert index.candidates("https://WWW.EXAMPLE.COM/") == [global_provider, example]
+    assert index.candidates("https://amazon.com@example.com/") == [
+        amazon,
+        global_provider,
+        example,
+        amazon_search,
+    ]
+    assert index.candidates("https://other.com/?tag=amazon") == [global_provider]
+    assert index.candidates("not a url") == [global_provider]
 
 
 def test_convert_rules_to_providers_invalid_without_existing_providers() -> None:
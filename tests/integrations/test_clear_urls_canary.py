@@ -0,0 +1,95 @@
+import pathlib
+import time
+
+from memebot.integrations.clear_urls import canary
+
+
+def test_load_corpus(tmp_path: pathlib.Path) -> None:
+    corpus_path = tmp_path / "corpus.txt"
+    corpus_path.write_text(
+        "# A comment\n"
+        "https://example.com/a\n"
+        "\n"
+        "  https://example.com/b  \n"
+        "https://example.com/a\n"
+    )
+
+    assert canary.load_corpus(corpus_path) == [
+        "https://example.com/a",
+        "https://example.com/b",
+    ]
+
+
+def test_load_builtin_corpus() -> None:
+    corpus = canary.load_corpus()
+
+    assert len(corpus) > 50
+    assert all(url.startswith("http") for url in corpus)
+
+
+def test_evaluate_diffs_outputs() -> None:
+    corpus = ["https://example.com/a?x=1", "https://example.com/b?x=1"]
+
+    def clean_candidate(url: str) -> str:
+        return url.removesuffix("?x=1") if "/a" in url else url
+
+    report = canary.evaluate(corpus, lambda url: url, clean_candidate)
+
+    assert report.changes == [
+        canary.CanaryChange(
+            "https://example.com/a?x=1",
+            "https://example.com/a?x=1",
+            "https://example.com/a",
+        )
+    ]
+    assert [timing.url for timing in report.timings] == corpus
+    assert report.changed_percent == 50.0
+    assert not report.refusal(max_changed_percent=50, max_slowdown_percent=1000)
+    assert "50.0% of the canary URLs" in report.refusal(
+        max_changed_percent=10, max_slowdown_percent=1000
+    )
+
+    summary = report.summary()
+    assert "1 cleaned differently (50.0%)" in summary
+    assert "    - https://example.com/a?x=1\n    + https://example.com/a" in summary
+
+
+def test_evaluate_compares_timings() -> None:
+    def clean_slowly(url: str) -> str:
+        time.sleep(0.001)
+        return url
+
+    report = canary.evaluate(["https://example.com"], lambda url: url, clean_slowly)
+
+    [timing] = report.timings
+    assert timing.candidate_ns >= 1_000_000 > timing.current_ns
+    assert report.slowdown_percent > 100
+    assert not report.changes
+    assert "cleaned" in report.refusal(max_changed_percent=0, max_slowdown_percent=50)
+    assert "us https://example.com" in report.summary()
+
+
+def test_evaluate_times_each_url_after_comparing_outputs() -> None:
+    calls: list[str] = []
+
+    def clean(url: str) -> str:
+        calls.append(url)
+        return url
+
+    canary.evaluate(["https://example.com"], clean, clean)
+
+    assert len(calls) == 2 + 2 * canary._TIMING_ROUNDS
+
+
+def test_report_summary_is_cut_short() -> None:
+    report = canary.CanaryReport(
+        [canary.CanaryChange(f"https://example.com/{i}", "a", "b") for i in range(12)],
+        [canary.CanaryTiming(f"https://example.com/{i}", 1, 1) for i in range(12)],
+    )
+
+    summary = report.summary(top=10)
+
+    assert "https://example.com/9\n" in summary
+    assert "https://example.com/10\n" not in summary
+    assert "... and 2 more" in summary
+    assert report.slowdown_percent == 0.0
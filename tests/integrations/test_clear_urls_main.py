@@ -0,0 +1,123 @@
+import io
+import pathlib
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from memebot.integrations import clear_urls
+from memebot.integrations.clear_urls import __main__ as clear_urls_main
+from memebot.integrations.clear_urls import workers
+
+TEST_RULES = r"""
+{
+    "providers": {
+        "test_provider": {
+            "urlPattern": "^https?:\\/\\/(?:[a-z0-9-]+\\.)*?example\\.com",
+            "rules": ["utm_source", "utm_medium"]
+        }
+    }
+}
+"""
+
+DIRTY_URLS = [
+    "https://example.com/a?utm_source=test&id=1",
+    "",
+    "https://www.example.com/b?utm_medium=social",
+    "https://other.com/c?utm_source=test",
+]
+CLEAN_URLS = [
+    "https://example.com/a?id=1",
+    "",
+    "https://www.example.com/b",
+    "https://other.com/c?utm_source=test",
+]
+
+
+@pytest.fixture(autouse=True)
+def restore_providers() -> Iterator[None]:
+    """
+    Ensures that the providers loaded by the CLI do not leak between tests
+    """
+    with mock.patch.object(
+        clear_urls, "engine", clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([]))
+    ):
+        clear_urls.get_result_cache.cache_clear()
+        yield
+
+
+@pytest.mark.parametrize(
+    ("jobs", "worker_kind"), [(1, None), (2, None), (2, "threads"), (2, "processes")]
+)
+def test_clean_stream(jobs: int, worker_kind: workers.WorkerKind | None) -> None:
+    output = io.StringIO()
+
+    clear_urls_main.clean_stream(
+        (f"{url}\n" for url in DIRTY_URLS),
+        output,
+        TEST_RULES,
+        jobs,
+        batch_size=1,
+        worker_kind=worker_kind,
+    )
+
+    assert output.getvalue().splitlines() == CLEAN_URLS
+
+
+def test_main(tmp_path: pathlib.Path) -> None:
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text(TEST_RULES)
+    input_path = tmp_path / "urls.txt"
+    input_path.write_text("\n".join(DIRTY_URLS))
+
+    with mock.patch("sys.stdout", new_callable=io.StringIO) as mock_stdout:
+        clear_urls_main.main(["--rules", str(rules_path), str(input_path)])
+
+        assert mock_stdout.getvalue().splitlines() == CLEAN_URLS
+
+
+def test_main_requires_rules(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(SystemExit):
+        clear_urls_main.main([str(tmp_path / "urls.txt")])
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_merges_rules_files(tmp_path: pathlib.Path, jobs: str) -> None:
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text(TEST_RULES)
+    override_path = tmp_path / "override.json"
+    override_path.write_text(
+        r"""
+        {
+            "providers": {
+                "test_provider": null,
+                "other_provider": {
+                    "urlPattern": "^https?:\\/\\/other\\.com",
+                    "rules": ["utm_source"]
+                }
+            }
+        }
+        """
+    )
+    input_path = tmp_path / "urls.txt"
+    input_path.write_text("\n".join(DIRTY_URLS))
+
+    with mock.patch("sys.stdout", new_callable=io.StringIO) as mock_stdout:
+        clear_urls_main.main(
+            [
+                "--rules",
+                str(rules_path),
+                "--rules-file",
+                str(override_path),
+                "--jobs",
+                jobs,
+                str(input_path),
+            ]
+        )
+
+        assert mock_stdout.getvalue().splitlines() == [
+            "https://example.com/a?utm_source=test&id=1",
+            "",
+            "https://www.example.com/b?utm_medium=social",
+            "https://other.com/c",
+        ]
@@ -0,0 +1,52 @@
+from unittest import mock
+
+from memebot.integrations.clear_urls import metrics
+
+
+def test_latency_histogram_buckets() -> None:
+    histogram = metrics.LatencyHistogram()
+
+    # Below 1us, below 2us, below 4us, and beyond the last bucket
+    for elapsed_ns in (500, 1_500, 3_000, 10**10):
+        histogram.observe(elapsed_ns)
+
+    assert histogram.count == 4
+    assert histogram.buckets[:3] == [1, 1, 1]
+    assert histogram.buckets[-1] == 1
+    assert histogram.quantile_us(0.5) == 2.0
+    assert histogram.quantile_us(0.75) == 4.0
+    assert histogram.quantile_us(1.0) == float("inf")
+
+
+def test_latency_histogram_empty() -> None:
+    histogram = metrics.LatencyHistogram()
+
+    assert histogram.mean_us == 0.0
+    assert histogram.quantile_us(0.99) == 0.0
+
+
+def test_registry_summary_lists_slowest_providers() -> None:
+    registry = metrics.MetricsRegistry()
+    registry.provider("fast").latency.observe(1_000)
+    registry.provider("slow").latency.observe(1_000_000)
+    registry.provider("slow").matched += 1
+    registry.call("strip_trackers").observe(1_001_000)
+
+    summary = registry.summary(top=1)
+
+    assert "strip_trackers: count=1" in summary
+    assert "provider slow: matched=1" in summary
+    assert "fast" not in summary
+
+
+def test_registry_reset() -> None:
+    registry = metrics.MetricsRegistry()
+    registry.provider("provider").matched += 1
+    registry.call("strip_trackers").observe(1_000)
+
+    with mock.patch.object(metrics, "datetime") as mock_datetime:
+        registry.reset()
+
+    assert registry.providers == {}
+    assert registry.calls == {}
+    assert registry.since == mock_datetime.now.return_value
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from datetime import timedelta
+from unittest import mock
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import test_utils, web
+
+from memebot import config
+from memebot.integrations.clear_urls import short_links
+
+
+@dataclass
+class StubServer:
+    """
+    A local HTTP server standing in for link shorteners. Each route maps a path to
+    the status and Location header it responds with.
+    """
+
+    server: test_utils.TestServer
+    routes: dict[str, tuple[int, str | None]] = field(default_factory=dict)
+    requests: list[str] = field(default_factory=list)
+    delay: timedelta = timedelta(0)
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(path))
+
+
+@pytest_asyncio.fixture
+async def stub_server() -> AsyncIterator[StubServer]:
+    stub: StubServer
+
+    async def handle(request: web.Request) -> web.Response:
+        stub.requests.append(request.path)
+        stub.in_flight += 1
+        stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        try:
+            await asyncio.sleep(stub.delay.total_seconds())
+        finally:
+            stub.in_flight -= 1
+        status, location = stub.routes.get(request.path, (404, None))
+        headers = {"Location": location} if location is not None else {}
+        return web.Response(status=status, headers=headers)
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/{path:.*}", handle)
+    stub = StubServer(test_utils.TestServer(app, host="127.0.0.1"))
+    await stub.server.start_server()
+
+    config.clearurls_short_link_hosts = {"127.0.0.1"}
+    config.clearurls_short_link_budget = timedelta(seconds=5)
+    short_links.get_expansion_cache.cache_clear()
+    try:
+        yield stub
+    finally:
+        await short_links.close()
+        await stub.server.close()
+
+
+def redirect(to: str) -> tuple[int, str]:
+    return 302, to
+
+
+@pytest.mark.asyncio
+async def test_expand_follows_redirects_to_long_link(stub_server: StubServer) -> None:
+    long_link = "https://example.com/page?utm_source=test"
+    stub_server.routes["/a"] = redirect(stub_server.url("/b"))
+    stub_server.routes["/b"] = redirect("/c")
+    stub_server.routes["/c"] = redirect(long_link)
+
+    assert await short_links.expand(stub_server.url("/a")) == long_link
+    assert stub_server.requests == ["/a", "/b", "/c"]
+
+    # Every link along the way is cached
+    assert await short_links.expand(stub_server.url("/a")) == long_link
+    assert await short_links.expand(stub_server.url("/b")) == long_link
+    assert stub_server.requests == ["/a", "/b", "/c"]
+
+
+@pytest.mark.asyncio
+async def test_expand_stops_at_non_redirect(stub_server: StubServer) -> None:
+    stub_server.routes["/a"] = redirect(stub_server.url("/b"))
+    stub_server.routes["/b"] = (200, None)
+
+    assert await short_links.expand(stub_server.url("/a")) == stub_server.url("/b")
+
+
+@pytest.mark.asyncio
+async def test_expand_ignores_other_links(stub_server: StubServer) -> None:
+    link = "https://example.com/page"
+    assert await short_links.expand(link) == link
+    assert not short_links.is_short_link(link)
+
+    config.clearurls_short_link_budget = timedelta(0)
+    assert await short_links.expand(stub_server.url("/a")) == stub_server.url("/a")
+    assert stub_server.requests == []
+
+
+@pytest.mark.asyncio
+async def test_expand_limits_hops(stub_server: StubServer) -> None:
+    for i in range(10):
+        stub_server.routes[f"/{i}"] = redirect(f"/{i + 1}")
+
+    expanded = await short_links.expand(stub_server.url("/0"))
+
+    assert expanded == stub_server.url(f"/{short_links._MAX_HOPS}")
+    assert len(stub_server.requests) == short_links._MAX_HOPS
+
+
+@pytest.mark.asyncio
+async def test_expand_stops_redirect_loops(stub_server: StubServer) -> None:
+    stub_server.routes["/a"] = redirect("/b")
+    stub_server.routes["/b"] = redirect("/a")
+
+    assert await short_links.expand(stub_server.url("/a")) == stub_server.url("/a")
+    assert stub_server.requests == ["/a", "/b"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("route", "reached"),
+    [((500, None), None), (redirect("http://127.0.0.1:1/c"), "http://127.0.0.1:1/c")],
+    ids=["server_error", "connection_error"],
+)
+async def test_expand_returns_partial_expansion_on_failure(
+    stub_server: StubServer, route: tuple[int, str | None], reached: str | None
+) -> None:
+    stub_server.routes["/a"] = redirect("/b")
+    stub_server.routes["/b"] = route
+
+    expanded = await short_links.expand(stub_server.url("/a"))
+    assert expanded == (reached or stub_server.url("/b"))
+    # Failed expansions are not cached, so that they are retried next time
+    assert stub_server.url("/a") not in short_links.get_expansion_cache()
+
+
+@pytest.mark.asyncio
+async def test_expand_returns_within_budget(stub_server: StubServer) -> None:
+    long_link = "https://example.com/page"
+    stub_server.routes["/a"] = redirect(long_link)
+    stub_server.delay = timedelta(milliseconds=300)
+    config.clearurls_short_link_budget = timedelta(milliseconds=50)
+
+    start = time.perf_counter()
+    assert await short_links.expand(stub_server.url("/a")) == stub_server.url("/a")
+    assert time.perf_counter() - start < 0.25
+
+    # The expansion carries on in the background, and is cached once it is done
+    await asyncio.sleep(0.5)
+    assert await short_links.expand(stub_server.url("/a")) == long_link
+    assert stub_server.requests == ["/a"]
+
+
+@pytest.mark.asyncio
+async def test_expand_shares_concurrent_expansions(stub_server: StubServer) -> None:
+    long_link = "https://example.com/page"
+    stub_server.routes["/a"] = redirect(long_link)
+    stub_server.delay = timedelta(milliseconds=50)
+
+    expanded = await short_links.expand_many([stub_server.url("/a")] * 10)
+
+    assert expanded == [long_link] * 10
+    assert stub_server.requests == ["/a"]
+
+
+@pytest.mark.asyncio
+async def test_expand_limits_requests_per_host(stub_server: StubServer) -> None:
+    for i in range(10):
+        stub_server.routes[f"/{i}"] = redirect(f"https://example.com/{i}")
+    stub_server.delay = timedelta(milliseconds=50)
+
+    with mock.patch.object(short_links, "_MAX_REQUESTS_PER_HOST", 2):
+        expanded = await short_links.expand_many(
+            stub_server.url(f"/{i}") for i in range(10)
+        )
+
+    assert expanded == [f"https://example.com/{i}" for i in range(10)]
+    assert stub_server.max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_close_recreates_session(stub_server: StubServer) -> None:
+    stub_server.routes["/a"] = redirect("https://example.com/a")
+    stub_server.routes["/b"] = redirect("https://example.com/b")
+
+    assert await short_links.expand(stub_server.url("/a")) == "https://example.com/a"
+    session = short_links._get_expander().session
+    await short_links.close()
+    assert session.closed
+
+    assert await short_links.expand(stub_server.url("/b")) == "https://example.com/b"
+    assert isinstance(short_links._get_expander().session, aiohttp.ClientSession)
+    assert short_links._get_expander().session is not session
+
+
+@pytest.mark.asyncio
+async def test_expand_times_out_slow_requests(stub_server: StubServer) -> None:
+    short_link = stub_server.url("/a")
+    stub_server.routes["/a"] = redirect("https://example.com/")
+    stub_server.delay = timedelta(seconds=1)
+
+    with (
+        mock.patch.object(short_links, "_REQUEST_TIMEOUT", timedelta(milliseconds=50)),
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        assert await short_links.expand(short_link) == short_link
+
+    mock_log_warning.assert_called_once()
+    assert short_links.get_expansion_cache().get(short_link) is None
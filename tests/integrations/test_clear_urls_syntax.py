@@ -0,0 +1,50 @@
+import pytest
+
+from memebot.integrations.clear_urls import syntax
+
+
+@pytest.mark.parametrize(
+    ("pattern", "expected"),
+    [
+        (r"(a+)+$", True),
+        (r"(.*,)*", True),
+        (r"(a+b?)*", True),
+        (r"([a-z]+)*", True),
+        (r"(\w+\s?)+$", True),
+        (r"((ab)*)*", True),
+        (r"(x+x+)+y", True),
+        (r"(?P<name>a+)+", True),
+        (r"(?i)(?:A[a-z]+)*", True),
+        (r"(?:(?=a)b+)+", True),
+        (r"(a|aa)+$", True),
+        (r"(?:ab|ac)+", True),
+        (r"(?:b|c?)+", True),
+        (r"(?:(?:x|y)z|yw)*", True),
+        (r"(?i)(?:a|B|A)+", True),
+        (r"(?:[^/]+[^a])*", True),
+        (r"(?:[^/]|[^a])+", True),
+        (r"(?:[^/]+\/)*", False),
+        (r"(?i)(?:[^a]+A)*", False),
+        (r"(?:[^/]|\/)+", False),
+        (r"(?:[a-z]+A)*", False),
+        (r"(?:\.[a-z]{2,}){1,}", False),
+        (r"^https?:\/\/(?:[a-z0-9-]+\.)*?amazon(?:\.[a-z]{2,}){1,}", False),
+        (r"(?:x\d+)+", False),
+        (r"(a|b)*", False),
+        (r"(?:a{2,5})+", False),
+        (r"(?:a*)", False),
+        (r".*", False),
+        (r"utm_source", False),
+    ],
+)
+def test_has_catastrophic_backtracking(pattern: str, expected: bool) -> None:
+    assert syntax.has_catastrophic_backtracking(pattern) is expected
+
+
+def test_split_alternatives() -> None:
+    assert syntax.split_alternatives(r"a|(?:b|c)|[|]|\|") == [
+        "a",
+        "(?:b|c)",
+        "[|]",
+        r"\|",
+    ]
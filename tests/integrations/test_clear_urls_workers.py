@@ -0,0 +1,200 @@
+import concurrent.futures
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from memebot import config
+from memebot.integrations import clear_urls
+from memebot.integrations.clear_urls import workers
+from memebot.lib import exception
+
+TEST_RULES = r"""
+{
+    "providers": {
+        "test_provider": {
+            "urlPattern": "^https?:\\/\\/example\\.com",
+            "rules": ["utm_source"]
+        }
+    }
+}
+"""
+
+DIRTY_URLS = [f"https://example.com/{i}?utm_source=test&id={i}" for i in range(10)]
+CLEAN_URLS = [f"https://example.com/{i}?id={i}" for i in range(10)]
+
+
+@pytest.fixture(autouse=True)
+def test_engine() -> Iterator[None]:
+    """
+    Publishes an engine built from the test rules, and stops any workers afterwards
+    """
+    with (
+        mock.patch.object(clear_urls, "engine", clear_urls._build_engine(TEST_RULES)),
+        mock.patch.object(workers, "_pool", None),
+    ):
+        yield
+        if workers._pool is not None:
+            workers._pool.shutdown(wait=True)
+
+
+def test_default_worker_kind(monkeypatch: pytest.MonkeyPatch) -> None:
+    with mock.patch("sys._is_gil_enabled", return_value=False):
+        assert workers.default_worker_kind() == "threads"
+
+    # Subinterpreters are only used when they are asked for
+    monkeypatch.setattr(
+        concurrent.futures, "InterpreterPoolExecutor", mock.Mock(), raising=False
+    )
+    with mock.patch("sys._is_gil_enabled", return_value=True):
+        assert workers.default_worker_kind() == "processes"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "kind",
+    [
+        "threads",
+        "processes",
+        pytest.param(
+            "interpreters",
+            marks=pytest.mark.skipif(
+                not hasattr(concurrent.futures, "InterpreterPoolExecutor"),
+                reason="Subinterpreter workers require Python 3.14",
+            ),
+        ),
+    ],
+)
+async def test_worker_pool_strips_trackers(kind: workers.WorkerKind) -> None:
+    pool = workers.WorkerPool(3, kind)
+    try:
+        assert await pool.strip_trackers_many(DIRTY_URLS) == CLEAN_URLS
+        assert await pool.strip_trackers_many([]) == []
+    finally:
+        pool.shutdown()
+    # The workers started, rather than falling back to another kind
+    assert pool.kind == kind
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_is_replaced_with_new_engine() -> None:
+    pool = workers.WorkerPool(2, "threads")
+    try:
+        await pool.strip_trackers_many(DIRTY_URLS)
+        executor = pool._get_executor()
+        assert pool._get_executor() is executor
+
+        with mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls._build_engine(TEST_RULES.replace("utm_source", "id")),
+        ):
+            assert await pool.strip_trackers_many(DIRTY_URLS[:1]) == [
+                "https://example.com/0?utm_source=test"
+            ]
+            assert pool._get_executor() is not executor
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_shutdown_joins_replaced_executors() -> None:
+    pool = workers.WorkerPool(2, "threads")
+    await pool.strip_trackers_many(DIRTY_URLS)
+    old_executor = pool._get_executor()
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls._build_engine(TEST_RULES.replace("utm_source", "id")),
+    ):
+        await pool.strip_trackers_many(DIRTY_URLS)
+    new_executor = pool._get_executor()
+
+    pool.shutdown(wait=True)
+
+    assert pool._executor is None
+    assert pool._joiners == []
+    for executor in (old_executor, new_executor):
+        assert isinstance(executor, concurrent.futures.ThreadPoolExecutor)
+        assert not any(thread.is_alive() for thread in executor._threads)
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_falls_back_to_processes() -> None:
+    broken_executor = mock.Mock()
+    broken_executor.submit.side_effect = concurrent.futures.BrokenExecutor()
+    pool = workers.WorkerPool(2, "interpreters")
+
+    with (
+        mock.patch.object(
+            workers,
+            "create_executor",
+            side_effect=[
+                broken_executor,
+                concurrent.futures.ThreadPoolExecutor(2),
+            ],
+        ) as mock_create_executor,
+        mock.patch("memebot.log.warning") as mock_log_warning,
+    ):
+        try:
+            assert await pool.strip_trackers_many(DIRTY_URLS) == CLEAN_URLS
+        finally:
+            pool.shutdown(wait=True)
+
+    assert pool.kind == "processes"
+    assert [call.args[2] for call in mock_create_executor.call_args_list] == [
+        "interpreters",
+        "processes",
+    ]
+    broken_executor.shutdown.assert_called_once_with()
+    mock_log_warning.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_requires_providers() -> None:
+    pool = workers.WorkerPool(2, "threads")
+    with (
+        mock.patch.object(
+            clear_urls,
+            "engine",
+            clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([])),
+        ),
+        pytest.raises(exception.MemebotInternalError),
+    ):
+        await pool.strip_trackers_many(DIRTY_URLS)
+
+
+@pytest.mark.asyncio
+async def test_strip_trackers_many_uses_configured_workers() -> None:
+    with mock.patch.object(
+        clear_urls, "strip_trackers_many", wraps=clear_urls.strip_trackers_many
+    ) as mock_strip_trackers_many:
+        assert await workers.strip_trackers_many(DIRTY_URLS) == CLEAN_URLS
+        mock_strip_trackers_many.assert_called_once_with(DIRTY_URLS)
+        assert workers._pool is None
+
+        config.clearurls_workers = 2
+        with mock.patch.object(workers, "default_worker_kind", return_value="threads"):
+            assert await workers.strip_trackers_many(DIRTY_URLS) == CLEAN_URLS
+        mock_strip_trackers_many.assert_called_once()
+
+    assert workers._pool is not None
+    assert workers._pool.workers == 2
+    assert workers._pool.kind == "threads"
+
+
+@pytest.mark.asyncio
+async def test_close_stops_workers() -> None:
+    await workers.close()
+
+    config.clearurls_workers = 2
+    with mock.patch.object(workers, "default_worker_kind", return_value="threads"):
+        await workers.strip_trackers_many(DIRTY_URLS)
+    pool = workers._pool
+    assert pool is not None
+
+    with mock.patch.object(pool, "shutdown", wraps=pool.shutdown) as mock_shutdown:
+        await workers.close()
+
+    mock_shutdown.assert_called_once_with(wait=True)
+    assert workers._pool is None
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+import pytest_asyncio
+from aiohttp import test_utils, web
+
+from memebot import config
+from memebot.integrations import paywall_bypass
+
+LINK = "https://www.news.example.com/story"
+
+
+@dataclass
+class StubBackends:
+    """
+    A local HTTP server standing in for paywall backends. Each backend is served under
+    its own path, and responds with its status after its delay.
+    """
+
+    server: test_utils.TestServer
+    statuses: dict[str, int] = field(default_factory=dict)
+    delays: dict[str, timedelta] = field(default_factory=dict)
+    requests: list[str] = field(default_factory=list)
+
+    def template(self, name: str) -> str:
+        return f"{self.server.make_url(f'/{name}/')}{{url}}"
+
+    def use(self, *names: str) -> None:
+        config.paywall_backends = [self.template(name) for name in names]
+
+
+@pytest_asyncio.fixture
+async def stub_backends() -> AsyncIterator[StubBackends]:
+    stub: StubBackends
+
+    async def handle(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        stub.requests.append(name)
+        await asyncio.sleep(stub.delays.get(name, timedelta(0)).total_seconds())
+        return web.Response(status=stub.statuses.get(name, 200))
+
+    app = web.Application()
+    app.router.add_get("/{name}/{link:.*}", handle)
+    stub = StubBackends(test_utils.TestServer(app, host="127.0.0.1"))
+    await stub.server.start_server()
+
+    config.paywall_probe_timeout = timedelta(seconds=5)
+    paywall_bypass.get_memo.cache_clear()
+    try:
+        yield stub
+    finally:
+        await paywall_bypass.close()
+        await stub.server.close()
+
+
+@pytest.mark.asyncio
+async def test_find_backend_uses_fastest_working_backend(
+    stub_backends: StubBackends,
+) -> None:
+    stub_backends.use("dead", "slow", "fast")
+    stub_backends.statuses["dead"] = 503
+    stub_backends.delays["slow"] = timedelta(milliseconds=200)
+
+    backend = await paywall_bypass.find_backend(LINK)
+
+    assert backend == paywall_bypass.PaywallBackend(stub_backends.template("fast"))
+    assert backend.bypass_link(LINK) == f"{stub_backends.template('fast')[:-5]}{LINK}"
+    assert backend.name == "127.0.0.1"
+    assert sorted(stub_backends.requests) == ["dead", "fast", "slow"]
+
+
+@pytest.mark.asyncio
+async def test_find_backend_remembers_backend_per_domain(
+    stub_backends: StubBackends,
+) -> None:
+    stub_backends.use("first", "second")
+    stub_backends.delays["first"] = timedelta(milliseconds=100)
+
+    await paywall_bypass.find_backend(LINK)
+    stub_backends.requests.clear()
+
+    # Links from the same domain are answered without probing
+    other_link = "https://news.example.com/other"
+    backend = paywall_bypass.known_backend(other_link)
+    assert backend == paywall_bypass.PaywallBackend(stub_backends.template("second"))
+    assert await paywall_bypass.find_backend(other_link) == backend
+    assert stub_backends.requests == []
+
+    # A remembered backend which is no longer configured is forgotten
+    stub_backends.use("first")
+    assert paywall_bypass.known_backend(LINK) is None
+
+
+@pytest.mark.asyncio
+async def test_find_backend_without_working_backend(
+    stub_backends: StubBackends,
+) -> None:
+    stub_backends.use("dead", "missing")
+    stub_backends.statuses |= {"dead": 500, "missing": 404}
+
+    assert await paywall_bypass.find_backend(LINK) is None
+    assert paywall_bypass.known_backend(LINK) is None
+
+
+@pytest.mark.asyncio
+async def test_find_backend_times_out(stub_backends: StubBackends) -> None:
+    stub_backends.use("slow")
+    stub_backends.delays["slow"] = timedelta(seconds=1)
+    config.paywall_probe_timeout = timedelta(milliseconds=50)
+
+    start = time.perf_counter()
+    assert await paywall_bypass.find_backend(LINK) is None
+    assert time.perf_counter() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_find_backend_survives_connection_errors(
+    stub_backends: StubBackends,
+) -> None:
+    config.paywall_backends = ["http://127.0.0.1:1/{url}", stub_backends.template("ok")]
+
+    backend = await paywall_bypass.find_backend(LINK)
+
+    assert backend == paywall_bypass.PaywallBackend(stub_backends.template("ok"))
+
+
+def test_known_backend_without_probing() -> None:
+    config.paywall_backends = ["https://first.example/{url}", "https://second/{url}"]
+
+    assert paywall_bypass.known_backend(LINK) == paywall_bypass.PaywallBackend(
+        "https://first.example/{url}"
+    )
+
+    config.paywall_backends = []
+    assert paywall_bypass.known_backend(LINK) is None
+
+
+@pytest.mark.asyncio
+async def test_find_backend_does_not_probe_without_backends() -> None:
+    config.paywall_backends = []
+    config.paywall_probe_timeout = timedelta(seconds=1)
+
+    with mock.patch.object(paywall_bypass, "_probe") as mock_probe:
+        assert await paywall_bypass.find_backend(LINK) is None
+        mock_probe.assert_not_called()
@@ -0,0 +1,64 @@
+from datetime import timedelta
+from unittest import mock
+
+from memebot.lib import cache
+
+
+def test_lru_cache_hit_and_miss() -> None:
+    lru: cache.LRUCache[str, int] = cache.LRUCache(maxsize=2)
+
+    assert lru.get("a") is None
+    lru.put("a", 1)
+    assert lru.get("a") == 1
+    assert "a" in lru
+    assert len(lru) == 1
+    assert lru.stats == cache.CacheStats(hits=1, misses=1)
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    lru: cache.LRUCache[str, int] = cache.LRUCache(maxsize=2)
+
+    lru.put("a", 1)
+    lru.put("b", 2)
+    # Touching "a" makes "b" the least recently used entry
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+
+    assert "a" in lru
+    assert "b" not in lru
+    assert "c" in lru
+    assert lru.stats.evictions == 1
+
+
+def test_lru_cache_expires_entries() -> None:
+    lru: cache.LRUCache[str, int] = cache.LRUCache(maxsize=2, ttl=timedelta(seconds=10))
+
+    with mock.patch("time.monotonic", return_value=100.0):
+        lru.put("a", 1)
+    with mock.patch("time.monotonic", return_value=105.0):
+        assert lru.get("a") == 1
+    with mock.patch("time.monotonic", return_value=111.0):
+        assert lru.get("a") is None
+
+    assert "a" not in lru
+    assert lru.stats == cache.CacheStats(hits=1, misses=1, expirations=1)
+
+
+def test_lru_cache_disabled() -> None:
+    lru: cache.LRUCache[str, int] = cache.LRUCache(maxsize=0)
+
+    lru.put("a", 1)
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_lru_cache_clear() -> None:
+    lru: cache.LRUCache[str, int] = cache.LRUCache(maxsize=2)
+
+    lru.put("a", 1)
+    lru.get("a")
+    lru.clear()
+
+    assert len(lru) == 0
+    # Stats survive clearing, so they describe the cache over its whole lifetime
+    assert lru.stats.hits == 1
@@ -0,0 +1,127 @@
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from memebot import client, config
+from memebot.integrations import clear_urls, paywall_bypass
+from memebot.integrations.clear_urls import short_links, workers
+
+DIRTY_URL = "https://example.com/page?utm_source=test"
+CLEAN_URL = "https://example.com/page"
+
+
+@pytest.fixture
+def auto_clean_message(mock_message: mock.Mock) -> mock.Mock:
+    config.clearurls_auto_clean_guilds = {1234}
+    mock_message.guild.id = 1234
+    mock_message.author.bot = False
+    mock_message.reply = mock.AsyncMock()
+    return mock_message
+
+
+@pytest.fixture(autouse=True)
+def test_provider_engine() -> Iterator[None]:
+    test_provider = clear_urls.ClearURLsProvider(
+        provider="test_provider",
+        url_pattern=r"^https?:\/\/example\.com",
+        rule_patterns=["utm_source"],
+        raw_rule_patterns=None,
+        referral_marketing_patterns=None,
+        redirection_patterns=None,
+        exception_patterns=None,
+    )
+    with mock.patch.object(
+        clear_urls,
+        "engine",
+        clear_urls.ClearURLsEngine(clear_urls.ProviderIndex([test_provider])),
+    ):
+        yield
+
+
+@pytest.mark.asyncio
+async def test_on_message_replies_with_clean_links(
+    auto_clean_message: mock.Mock,
+) -> None:
+    auto_clean_message.content = f"look {DIRTY_URL} and https://example.com/?id=1"
+
+    await client.on_message(auto_clean_message)
+
+    auto_clean_message.reply.assert_awaited_once_with(
+        f"Links without trackers:\n- {CLEAN_URL}", mention_author=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_on_message_ignores_clean_links(auto_clean_message: mock.Mock) -> None:
+    auto_clean_message.content = "look https://example.com/?id=1"
+
+    with mock.patch.object(clear_urls, "strip_trackers_many") as mock_strip:
+        await client.on_message(auto_clean_message)
+
+    mock_strip.assert_not_called()
+    auto_clean_message.reply.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_on_message_ignores_other_guilds(auto_clean_message: mock.Mock) -> None:
+    auto_clean_message.content = DIRTY_URL
+    auto_clean_message.guild.id = 5678
+
+    await client.on_message(auto_clean_message)
+
+    auto_clean_message.reply.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_on_message_ignores_bots(auto_clean_message: mock.Mock) -> None:
+    auto_clean_message.content = DIRTY_URL
+    auto_clean_message.author.bot = True
+
+    await client.on_message(auto_clean_message)
+
+    auto_clean_message.reply.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_on_message_edit_only_cleans_new_links(
+    auto_clean_message: mock.Mock,
+) -> None:
+    before = mock.Mock(content=f"look {DIRTY_URL}")
+    auto_clean_message.content = (
+        f"look {DIRTY_URL} and https://example.com/other?utm_source=test"
+    )
+
+    await client.on_message_edit(before, auto_clean_message)
+
+    auto_clean_message.reply.assert_awaited_once_with(
+        "Links without trackers:\n- https://example.com/other", mention_author=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_on_message_edit_ignores_unchanged_content(
+    auto_clean_message: mock.Mock,
+) -> None:
+    auto_clean_message.content = DIRTY_URL
+    before = mock.Mock(content=DIRTY_URL)
+
+    await client.on_message_edit(before, auto_clean_message)
+
+    auto_clean_message.reply.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_close_closes_integrations() -> None:
+    with (
+        mock.patch("discord.ext.commands.Bot.close") as mock_bot_close,
+        mock.patch.object(short_links, "close") as mock_short_links_close,
+        mock.patch.object(paywall_bypass, "close") as mock_paywall_bypass_close,
+        mock.patch.object(workers, "close") as mock_workers_close,
+    ):
+        await client.get_memebot().close()
+
+    mock_bot_close.assert_awaited_once()
+    mock_short_links_close.assert_awaited_once()
+    mock_paywall_bypass_close.assert_awaited_once()
+    mock_workers_close.assert_awaited_once()